@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+pytest-benchmark suite for the Database and JobQueue hot paths
+
+Not collected by a plain `pytest` run; name the file explicitly:
+    
+    pytest benchmarks/bench_queuectl.py --benchmark-json=bench.json
+    pytest benchmarks/bench_queuectl.py --benchmark-compare --benchmark-compare-fail=mean:20%
+
+Multi-process scenarios (claim rate per worker count, end-to-end latency,
+contention) are in `queuectl bench`, which reports them as JSON too.
+"""
+
+import itertools
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from queuectl.bench import GROWTH_SIZES, prefill, temp_queue
+
+
+# Set QUEUECTL_BENCH_SIZES=10000,100000 to skip the slow 1M-row prefill
+SIZES = [int(size) for size in os.environ.get("QUEUECTL_BENCH_SIZES", "").split(",") if size] \
+    or list(GROWTH_SIZES)
+
+
+@pytest.fixture
+def queue():
+    with temp_queue() as queue:
+        yield queue
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda rows: f"rows={rows}")
+def grown_queue(request):
+    """Queue whose table already holds `rows` completed jobs"""
+    with temp_queue() as queue:
+        prefill(queue.db, request.param)
+        yield queue
+
+
+def test_enqueue_single(benchmark, queue):
+    ids = itertools.count()
+    benchmark(lambda: queue.enqueue(f"job-{next(ids)}", "true"))
+
+
+@pytest.mark.parametrize("batch_size", [100, 1000])
+def test_enqueue_batch(benchmark, queue, batch_size):
+    batches = itertools.count()
+    
+    def enqueue_batch():
+        batch = next(batches)
+        queue.enqueue_many([{"id": f"job-{batch}-{i}", "command": "true"} for i in range(batch_size)])
+    
+    benchmark(enqueue_batch)
+
+
+@pytest.mark.parametrize("prefetch", [1, 10])
+def test_claim(benchmark, queue, prefetch):
+    queue.enqueue_many([{"id": f"job-{i}", "command": "true"} for i in range(200 * prefetch)])
+    benchmark.pedantic(queue.get_next_jobs, args=("bench", prefetch), rounds=100, iterations=1)
+
+
+def test_complete(benchmark, queue):
+    queue.enqueue_many([{"id": f"job-{i}", "command": "true"} for i in range(200)])
+    jobs = iter(queue.get_next_jobs("bench", 200))
+    benchmark.pedantic(lambda: queue.db.update_job(next(jobs)['id'], state="completed"),
+                       rounds=100, iterations=1)
+
+
+def test_complete_write_behind(benchmark, queue):
+    queue.enqueue_many([{"id": f"job-{i}", "command": "true"} for i in range(200)])
+    jobs = iter(queue.get_next_jobs("bench", 200))
+    queue.db.start_write_behind(5)
+    benchmark.pedantic(lambda: queue.db.update_job(next(jobs)['id'], state="completed"),
+                       rounds=100, iterations=1)
+    queue.db.stop_write_behind()
+
+
+def test_claim_grown(benchmark, grown_queue):
+    ids = itertools.count()
+    
+    def enqueue_and_claim():
+        grown_queue.enqueue(f"new-{next(ids)}", "true")
+        return grown_queue.get_next_jobs("bench", 1)
+    
+    benchmark(enqueue_and_claim)
+
+
+def test_stats_grown(benchmark, grown_queue):
+    benchmark(grown_queue.get_stats)
+
+
+def test_list_page_grown(benchmark, grown_queue):
+    benchmark(lambda: list(grown_queue.iter_jobs(limit=100)))
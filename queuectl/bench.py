@@ -0,0 +1,414 @@
+"""Throughput and latency benchmarks for the queue
+
+Every scenario runs against a fresh database in a temporary directory, so
+results do not depend on (or disturb) the queue in the working directory.
+Metric names carry their direction: *_rate is per second, higher is better;
+*_seconds and *_bytes are lower-is-better. compare() relies on that.
+"""
+
+import multiprocessing
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+from .database import Database, LOCK_WAIT
+from .metrics import REGISTRY
+from .queue import JobQueue
+
+
+# Scenarios in the order they run
+SCENARIOS = ("enqueue", "claim", "latency", "growth", "contention")
+
+# Table sizes for the growth scenario; --quick only runs the first
+GROWTH_SIZES = (10000, 100000, 1000000)
+
+# Worker counts for the claim scenario
+CLAIM_WORKERS = (1, 2, 4, 8)
+
+# Rows inserted per transaction when prefilling a large table
+PREFILL_BATCH_SIZE = 10000
+
+# Relative change in a metric that compare() reports as a regression
+DEFAULT_THRESHOLD = 0.2
+
+# Seconds the latency scenario waits for its jobs before giving up
+LATENCY_TIMEOUT = 60.0
+
+
+def percentiles(values: Sequence[float]) -> Dict:
+    """Nearest-rank p50/p95/p99 and max of a sample, None when it is empty"""
+    ordered = sorted(values)
+    
+    def rank(p):
+        if not ordered:
+            return None
+        return round(ordered[max(0, -(-len(ordered) * p // 100) - 1)], 6)
+    
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99),
+            "max": round(ordered[-1], 6) if ordered else None}
+
+
+@contextmanager
+def temp_queue() -> Iterator[JobQueue]:
+    """JobQueue on a new database that is removed afterwards"""
+    directory = tempfile.mkdtemp(prefix="queuectl-bench-")
+    queue = JobQueue(os.path.join(directory, "bench.db"))
+    try:
+        yield queue
+    finally:
+        queue.db.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _jobs(count: int, prefix: str = "job", command: str = "true") -> List[Dict]:
+    return [{"id": f"{prefix}-{i}", "command": command} for i in range(count)]
+
+
+def prefill(db: Database, rows: int, state: str = "completed"):
+    """Insert `rows` finished jobs directly, the way a long-lived queue accumulates them"""
+    start = datetime.utcnow() - timedelta(days=30)
+    for offset in range(0, rows, PREFILL_BATCH_SIZE):
+        batch = []
+        for i in range(offset, min(rows, offset + PREFILL_BATCH_SIZE)):
+            stamp = (start + timedelta(milliseconds=i)).isoformat() + "Z"
+            batch.append((f"old-{i}", "true", state, 1, 3, stamp, stamp, stamp, stamp,
+                          "default", "0:00.01"))
+        with db._get_connection(immediate=True) as conn:
+            conn.executemany("""
+                INSERT INTO jobs (id, command, state, attempts, max_retries, created_at,
+                                  updated_at, completed_at, queued_at, queue, output_tail)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, batch)
+    db.rebuild_job_counts()
+
+
+def drain(queue: JobQueue, worker_id: str, prefetch: int = 1) -> int:
+    """Claim and complete jobs until none are pending; returns how many"""
+    done = 0
+    while True:
+        jobs = queue.get_next_jobs(worker_id, prefetch)
+        if not jobs:
+            return done
+        for job in jobs:
+            queue.db.update_job(job['id'], state="completed", attempts=1,
+                                completed_at=datetime.utcnow().isoformat() + "Z")
+        done += len(jobs)
+
+
+def _result(name: str, scenario: str, params: Dict, metrics: Dict) -> Dict:
+    return {"name": name, "scenario": scenario, "params": params, "metrics": metrics}
+
+
+def bench_enqueue(count: int = 2000, batch_size: int = 500) -> List[Dict]:
+    """Jobs per second through enqueue() one at a time and enqueue_many() in batches"""
+    results = []
+    with temp_queue() as queue:
+        started = time.perf_counter()
+        for job in _jobs(count, "single"):
+            queue.enqueue(job['id'], job['command'])
+        elapsed = time.perf_counter() - started
+    results.append(_result("enqueue[single]", "enqueue", {"jobs": count}, {
+        "enqueue_rate": round(count / elapsed, 1),
+        "per_job_seconds": round(elapsed / count, 6)
+    }))
+    
+    with temp_queue() as queue:
+        jobs = _jobs(count, "batch")
+        started = time.perf_counter()
+        for i in range(0, count, batch_size):
+            queue.enqueue_many(jobs[i:i + batch_size])
+        elapsed = time.perf_counter() - started
+    results.append(_result("enqueue[batch]", "enqueue", {"jobs": count, "batch_size": batch_size}, {
+        "enqueue_rate": round(count / elapsed, 1),
+        "per_job_seconds": round(elapsed / count, 6)
+    }))
+    return results
+
+
+def _claim_process(db_path: str, worker_id: str, prefetch: int, start, results):
+    """Child process of the claim scenario: drain the queue as fast as possible"""
+    queue = JobQueue(db_path)
+    start.wait()
+    before = _lock_wait_state()
+    began = time.perf_counter()
+    done = drain(queue, worker_id, prefetch)
+    results.put((done, time.perf_counter() - began, _lock_wait_since(before)))
+
+
+def _run_processes(target: Callable, db_path: str, count: int, args: tuple) -> Dict:
+    """Start `count` processes together and collect what each puts on the results queue"""
+    start = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=target, args=(db_path, f"bench-{i}") + args + (start, results))
+        for i in range(count)
+    ]
+    for process in processes:
+        process.start()
+    # Give the children time to import and open the database before the clock starts
+    time.sleep(0.2)
+    started = time.perf_counter()
+    start.set()
+    collected = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started
+    for process in processes:
+        process.join()
+    return {"elapsed": elapsed, "results": collected}
+
+
+def _lock_wait_state() -> List:
+    """This process's LOCK_WAIT histogram state, [bucket counts, sum]"""
+    return REGISTRY.snapshot()[LOCK_WAIT.name]["values"].get((), [[0], 0.0])
+
+
+def _lock_wait_since(before: List) -> List:
+    """LOCK_WAIT observations since `before`; forked children inherit the parent's"""
+    counts, total = _lock_wait_state()
+    return [[sum(counts) - sum(before[0])], total - before[1]]
+
+
+def _lock_wait_avg(results: List) -> Optional[float]:
+    """Average BEGIN IMMEDIATE wait over the (counts, sum) histogram states of the children"""
+    count = sum(sum(state[0]) for state in results)
+    total = sum(state[1] for state in results)
+    return round(total / count, 6) if count else None
+
+
+def bench_claim(jobs: int = 2000, workers: Sequence[int] = CLAIM_WORKERS,
+                prefetch: int = 1) -> List[Dict]:
+    """Jobs per second claimed and completed by 1..N competing worker processes"""
+    results = []
+    for count in workers:
+        with temp_queue() as queue:
+            queue.enqueue_many(_jobs(jobs))
+            run = _run_processes(_claim_process, queue.db.db_path, count, (prefetch,))
+            claimed = sum(done for done, _, _ in run["results"])
+        results.append(_result(f"claim[workers={count}]", "claim",
+                               {"jobs": jobs, "workers": count, "prefetch": prefetch}, {
+            "claim_rate": round(claimed / run["elapsed"], 1),
+            "lock_wait_avg_seconds": _lock_wait_avg([state for _, _, state in run["results"]])
+        }))
+    return results
+
+
+def bench_latency(jobs: int = 50, workers: int = 2, interval: float = 0.05) -> List[Dict]:
+    """Enqueue-to-completed latency of no-op jobs (`true`) through real workers
+    
+    Jobs are enqueued one at a time against idle workers, so this measures
+    wake-up, claim and process start rather than queueing behind a backlog.
+    """
+    from .worker import WorkerManager
+    
+    with temp_queue() as queue:
+        db = queue.db
+        manager = WorkerManager(db.db_path)
+        processes = manager.start_workers(workers)
+        try:
+            deadline = time.monotonic() + LATENCY_TIMEOUT
+            while len(db.get_active_workers()) < workers and time.monotonic() < deadline:
+                time.sleep(0.05)
+            
+            for i in range(jobs):
+                queue.enqueue(f"latency-{i}", "true")
+                time.sleep(interval)
+            while db.get_job_stats().get("completed", 0) < jobs and time.monotonic() < deadline:
+                time.sleep(0.05)
+            
+            latencies = []
+            waits = []
+            with db._get_connection() as conn:
+                for row in conn.execute("SELECT created_at, completed_at FROM jobs WHERE state = 'completed'"):
+                    latencies.append((_parse(row['completed_at']) - _parse(row['created_at'])).total_seconds())
+                for row in conn.execute("SELECT wait_time FROM job_attempts WHERE wait_time IS NOT NULL"):
+                    waits.append(row['wait_time'])
+        finally:
+            manager.stop_workers()
+            for process in processes:
+                process.join(timeout=30)
+    
+    latency = percentiles(latencies)
+    wait = percentiles(waits)
+    return [_result(f"latency[workers={workers}]", "latency", {"jobs": jobs, "workers": workers}, {
+        "completed": len(latencies),
+        "latency_p50_seconds": latency["p50"],
+        "latency_p95_seconds": latency["p95"],
+        "latency_p99_seconds": latency["p99"],
+        "latency_max_seconds": latency["max"],
+        "wait_p50_seconds": wait["p50"],
+        "wait_p99_seconds": wait["p99"]
+    })]
+
+
+def _parse(timestamp: str) -> datetime:
+    return datetime.fromisoformat(timestamp.rstrip("Z"))
+
+
+def _timed(fn: Callable, repeat: int = 20) -> float:
+    """Best of `repeat` calls, in seconds"""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 6)
+
+
+def bench_growth(sizes: Sequence[int] = GROWTH_SIZES, jobs: int = 1000) -> List[Dict]:
+    """Cost of the hot paths once the table holds many finished jobs
+    
+    Claims, stats and the first page of `list` should stay flat as rows
+    accumulate; growth here means an index or counter stopped being used.
+    """
+    results = []
+    for rows in sizes:
+        with temp_queue() as queue:
+            db = queue.db
+            prefill(db, rows)
+            
+            started = time.perf_counter()
+            queue.enqueue_many(_jobs(jobs, "new"))
+            enqueue_elapsed = time.perf_counter() - started
+            
+            started = time.perf_counter()
+            drain(queue, "bench", prefetch=1)
+            claim_elapsed = time.perf_counter() - started
+            
+            metrics = {
+                "enqueue_rate": round(jobs / enqueue_elapsed, 1),
+                "claim_rate": round(jobs / claim_elapsed, 1),
+                "stats_seconds": _timed(db.get_job_stats),
+                "list_page_seconds": _timed(lambda: list(db.iter_jobs(limit=100))),
+                "list_pending_seconds": _timed(lambda: list(db.iter_jobs("pending", limit=100))),
+                "db_bytes": _db_size(db.db_path)
+            }
+            metrics["bytes_per_row"] = round(metrics["db_bytes"] / (rows + jobs), 1)
+        results.append(_result(f"growth[rows={rows}]", "growth", {"rows": rows, "jobs": jobs}, metrics))
+    return results
+
+
+def _db_size(db_path: str) -> int:
+    """Size of the database including its write-ahead log"""
+    return sum(os.path.getsize(path) for path in (db_path, db_path + "-wal") if os.path.exists(path))
+
+
+def _contention_process(db_path: str, worker_id: str, ops: int, start, results):
+    """Child process of the contention scenario: interleave enqueues, claims and updates"""
+    queue = JobQueue(db_path)
+    latencies = {"enqueue": [], "claim": [], "complete": []}
+    errors = 0
+    start.wait()
+    before = _lock_wait_state()
+    began = time.perf_counter()
+    for i in range(ops):
+        for op in ("enqueue", "claim", "complete"):
+            started = time.perf_counter()
+            try:
+                if op == "enqueue":
+                    queue.enqueue(f"{worker_id}-{i}", "true")
+                elif op == "claim":
+                    jobs = queue.get_next_jobs(worker_id, 1)
+                elif jobs:
+                    queue.db.update_job(jobs[0]['id'], state="completed", attempts=1,
+                                        completed_at=datetime.utcnow().isoformat() + "Z")
+            except sqlite3.OperationalError:
+                # "database is locked" once busy_timeout runs out
+                errors += 1
+                jobs = []
+            latencies[op].append(time.perf_counter() - started)
+    results.put((latencies, errors, time.perf_counter() - began, _lock_wait_since(before)))
+
+
+def bench_contention(processes: Sequence[int] = (1, 4, 8), ops: int = 200) -> List[Dict]:
+    """Per-operation latency and lock errors with several processes writing at once"""
+    results = []
+    for count in processes:
+        with temp_queue() as queue:
+            run = _run_processes(_contention_process, queue.db.db_path, count, (ops,))
+        
+        metrics = {"ops_rate": round(count * ops * 3 / run["elapsed"], 1),
+                   "errors": sum(errors for _, errors, _, _ in run["results"])}
+        for op in ("enqueue", "claim", "complete"):
+            sample = [value for latencies, _, _, _ in run["results"] for value in latencies[op]]
+            summary = percentiles(sample)
+            metrics[f"{op}_p50_seconds"] = summary["p50"]
+            metrics[f"{op}_p99_seconds"] = summary["p99"]
+        metrics["lock_wait_avg_seconds"] = _lock_wait_avg([state for _, _, _, state in run["results"]])
+        results.append(_result(f"contention[processes={count}]", "contention",
+                               {"processes": count, "ops": ops}, metrics))
+    return results
+
+
+def run_suite(scenarios: Sequence[str] = SCENARIOS, quick: bool = False,
+              sizes: Optional[Sequence[int]] = None,
+              progress: Optional[Callable[[str], None]] = None) -> Dict:
+    """Run the named scenarios and return {"meta": ..., "results": [...]}
+    
+    quick shrinks every scenario to a few seconds, for smoke runs and CI.
+    """
+    if sizes is None:
+        sizes = GROWTH_SIZES[:1] if quick else GROWTH_SIZES
+    runners = {
+        "enqueue": lambda: bench_enqueue(500 if quick else 5000),
+        "claim": lambda: bench_claim(500 if quick else 5000, (1, 4) if quick else CLAIM_WORKERS),
+        "latency": lambda: bench_latency(20 if quick else 100),
+        "growth": lambda: bench_growth(sizes),
+        "contention": lambda: bench_contention((1, 4) if quick else (1, 4, 8), 50 if quick else 200)
+    }
+    
+    results = []
+    started = time.time()
+    for scenario in scenarios:
+        if progress:
+            progress(scenario)
+        results.extend(runners[scenario]())
+    
+    return {
+        "meta": {
+            "started_at": datetime.utcfromtimestamp(started).isoformat() + "Z",
+            "duration": round(time.time() - started, 3),
+            "quick": quick,
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count()
+        },
+        "results": results
+    }
+
+
+def _direction(metric: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if informational"""
+    if metric.endswith("_rate"):
+        return 1
+    if metric.endswith("_seconds") or metric.endswith("_bytes"):
+        return -1
+    return 0
+
+
+def compare(current: Dict, baseline: Dict, threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """Metrics that got worse than baseline by more than threshold (0.2 = 20%)
+    
+    Benchmarks and metrics missing from either run are skipped.
+    """
+    previous = {result["name"]: result["metrics"] for result in baseline.get("results", [])}
+    regressions = []
+    for result in current.get("results", []):
+        old_metrics = previous.get(result["name"])
+        if old_metrics is None:
+            continue
+        for metric, value in result["metrics"].items():
+            direction = _direction(metric)
+            old = old_metrics.get(metric)
+            if not direction or not old or value is None:
+                continue
+            change = (value - old) / old
+            if change * direction < -threshold:
+                regressions.append({"name": result["name"], "metric": metric,
+                                    "baseline": old, "current": value, "change": round(change, 3)})
+    return regressions
@@ -1,13 +1,28 @@
 """CLI interface for queuectl"""
 
 import click
+import itertools
 import json
+import os
 import sys
-from tabulate import tabulate
-from .queue import JobQueue
-from .worker import WorkerManager
+from .queue import JobQueue, GC_BATCH_SIZE, LIMIT_FIELDS, parse_duration
 from .database import Database
 
+# tabulate, csv, .worker (threads, multiprocessing) and .server are imported
+# by the commands that use them: producers run `enqueue` and `status` very
+# often, and every module imported at the top is paid on each invocation.
+
+
+def _server_client():
+    """Connection to a running `queuectl serve`, or None to use the database directly"""
+    if os.environ.get('QUEUECTL_NO_SERVER'):
+        return None
+    from .notify import server_address
+    if not os.path.exists(server_address("queuectl.db")):
+        return None
+    from .server import Client
+    return Client.connect()
+
 
 @click.group()
 @click.version_option(version="1.0.0")
@@ -17,30 +32,79 @@ def main():
 
 
 @main.command()
-@click.argument('job_data', type=str)
-def enqueue(job_data):
+@click.argument('job_data', type=str, required=False)
+@click.option('--file', 'job_file', type=click.File('r'),
+              help='Read newline-delimited JSON jobs from a file ("-" for stdin)')
+@click.option('--batch-size', default=1000, type=int, help='Jobs inserted per transaction with --file')
+@click.option('--priority', type=int, help='Priority for jobs that do not set one (higher runs first)')
+@click.option('--queue', 'queue_name', help='Queue for jobs that do not name one (default: "default")')
+def enqueue(job_data, job_file, batch_size, priority, queue_name):
     """Enqueue a new job
     
     JOB_DATA: JSON string with job details, e.g., '{"id":"job1","command":"sleep 2"}'
+    
+    Optional fields: max_retries, priority (integer, higher runs first) and
+    queue (name of the queue, default "default").
+    
+    Resource limits: timeout (e.g. 90 or "10m", default config job-timeout),
+    max_memory (address space, e.g. "512M"), cpu_seconds and nice.
+    
+    Use --file to load many jobs, one JSON object per line.
+    
+    Jobs go through `queuectl serve` when it is running for this database
+    (set QUEUECTL_NO_SERVER=1 to bypass it).
     """
+    if (job_data is None) == (job_file is None):
+        click.echo("Error: provide either JOB_DATA or --file", err=True)
+        sys.exit(1)
+    
+    if job_file is not None:
+        if batch_size < 1:
+            click.echo("Error: --batch-size must be at least 1", err=True)
+            sys.exit(1)
+        _enqueue_file(job_file, batch_size, priority, queue_name)
+        return
+    
     try:
         data = json.loads(job_data)
         job_id = data.get('id')
         command = data.get('command')
         max_retries = data.get('max_retries')
+        job_priority = data.get('priority', priority)
+        if job_priority is None:
+            job_priority = 0
+        job_queue = data.get('queue', queue_name) or "default"
         
         if not job_id or not command:
             click.echo("Error: 'id' and 'command' are required fields", err=True)
             sys.exit(1)
         
-        queue = JobQueue()
-        job = queue.enqueue(job_id, command, max_retries)
+        if not isinstance(job_priority, int) or isinstance(job_priority, bool):
+            click.echo("Error: 'priority' must be an integer", err=True)
+            sys.exit(1)
+        
+        limits = {field: data.get(field) for field in LIMIT_FIELDS}
+        client = _server_client()
+        if client is not None:
+            with client:
+                job = _server_enqueue(client, {
+                    'id': job_id, 'command': command, 'max_retries': max_retries,
+                    'priority': job_priority, 'queue': job_queue, **limits
+                })
+        else:
+            queue = JobQueue()
+            job = queue.enqueue(job_id, command, max_retries, job_priority, job_queue, limits)
         
         click.echo(f"Job '{job_id}' enqueued successfully")
         click.echo(f"  Command: {command}")
         click.echo(f"  State: {job['state']}")
         click.echo(f"  Max Retries: {job['max_retries']}")
-        
+        click.echo(f"  Queue: {job['queue']}")
+        click.echo(f"  Priority: {job['priority']}")
+        for field in LIMIT_FIELDS:
+            if job[field] is not None:
+                click.echo(f"  {field.replace('_', ' ').title()}: {job[field]}")
+    
     except json.JSONDecodeError:
         click.echo("Error: Invalid JSON format", err=True)
         sys.exit(1)
@@ -52,6 +116,90 @@ def enqueue(job_data):
         sys.exit(1)
 
 
+def _server_enqueue(client, job):
+    """Enqueue one job through the server; returns its row like JobQueue.enqueue()"""
+    # Pipelined: the read runs once the enqueue has committed
+    client.send({'op': 'enqueue', 'jobs': [job]})
+    client.send({'op': 'get', 'id': job['id']})
+    result = client.receive()
+    row = client.receive()
+    if not result['ok']:
+        raise RuntimeError(result['error'])
+    if result['errors']:
+        raise ValueError(result['errors'][0][1])
+    if result['duplicates']:
+        raise ValueError(f"Job with id '{job['id']}' already exists")
+    return row['job']
+
+
+def _enqueue_file(job_file, batch_size, priority=None, queue_name=None):
+    """Stream NDJSON jobs into the queue in bounded batches"""
+    client = _server_client()
+    queue = JobQueue() if client is None else None
+    totals = {"enqueued": 0, "duplicates": 0, "errors": 0}
+    batch_number = 0
+    line_number = 0
+    
+    while True:
+        batch = []
+        errors = []
+        for line in itertools.islice(job_file, batch_size):
+            line_number += 1
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError:
+                errors.append((f"line {line_number}", "Invalid JSON format"))
+                continue
+            if isinstance(job, dict):
+                if priority is not None:
+                    job.setdefault('priority', priority)
+                if queue_name is not None:
+                    job.setdefault('queue', queue_name)
+            batch.append(job)
+        
+        if not batch and not errors:
+            break
+        
+        batch_number += 1
+        try:
+            if client is not None:
+                result = client.request({'op': 'enqueue', 'jobs': batch})
+                if not result['ok']:
+                    raise RuntimeError(result['error'])
+            else:
+                result = queue.enqueue_many(batch)
+        except Exception as e:
+            # Keep loading later batches; this one is reported as failed
+            failed = [(job.get('id') if isinstance(job, dict) else None, str(e)) for job in batch]
+            result = {"enqueued": 0, "duplicates": [], "errors": failed}
+        errors.extend(result['errors'])
+        
+        click.echo(
+            f"Batch {batch_number}: {result['enqueued']} enqueued, "
+            f"{len(result['duplicates'])} duplicates, {len(errors)} errors"
+        )
+        for job_id in result['duplicates']:
+            click.echo(f"  Duplicate: {job_id}", err=True)
+        for where, message in errors:
+            click.echo(f"  Error ({where or 'unknown'}): {message}", err=True)
+        
+        totals['enqueued'] += result['enqueued']
+        totals['duplicates'] += len(result['duplicates'])
+        totals['errors'] += len(errors)
+    
+    if client is not None:
+        client.close()
+    click.echo(
+        f"Enqueued {totals['enqueued']} job(s) "
+        f"({totals['duplicates']} duplicates, {totals['errors']} errors)"
+    )
+    if totals['duplicates'] or totals['errors']:
+        sys.exit(1)
+
+
 @main.group()
 def worker():
     """Manage worker processes"""
@@ -59,19 +207,121 @@ def worker():
 
 
 @worker.command()
-@click.option('--count', default=1, type=int, help='Number of workers to start')
-def start(count):
-    """Start one or more worker processes"""
-    if count < 1:
+@click.option('--count', type=int, help='Number of workers to start (default: 1)')
+@click.option('--prefetch', default=1, type=int, help='Jobs each worker claims per round-trip')
+@click.option('--concurrency', default=1, type=int, help='Jobs each worker runs in parallel')
+@click.option('--queues', help='Comma-separated queues to serve, in strict priority order; '
+                                'add weights (e.g. "urgent:3,bulk:1") for weighted selection')
+@click.option('--metrics-port', type=int, help='Serve OpenMetrics at http://HOST:PORT/metrics')
+@click.option('--metrics-host', default='127.0.0.1', help='Address for --metrics-port (default: 127.0.0.1)')
+@click.option('--profile', 'profile_dir', type=click.Path(file_okay=False),
+              help='Write cProfile stats and Database timings per worker to this directory on stop')
+@click.option('--slow-query-ms', type=float, help='Log SQL statements slower than this')
+@click.option('--slow-call-ms', type=float, help='Log Database method calls slower than this')
+@click.option('--flush-ms', default=0, type=float,
+              help='Commit job results and heartbeats in batches every N ms (default: 0, each at once)')
+@click.option('--min', 'min_workers', type=int,
+              help='Autoscale: fewest workers to keep running (default: 1)')
+@click.option('--max', 'max_workers', type=int,
+              help='Autoscale between --min and this many workers by queue load')
+@click.option('--target-wait', default='5s',
+              help='Autoscale: wait for a new job to aim below, e.g. 5s or 2m (default: 5s)')
+def start(count, prefetch, concurrency, queues, metrics_port, metrics_host, profile_dir,
+          slow_query_ms, slow_call_ms, flush_ms, min_workers, max_workers, target_wait):
+    """Start one or more worker processes
+    
+    --profile DIR leaves <worker>.prof (open with python -m pstats) and
+    <worker>-db.json (time per Database method and SQL statement, lock
+    waits) in DIR. Slow statements and calls go to DIR/<worker>-slow.log,
+    or to stderr without --profile.
+    
+    --flush-ms trades durability for completion throughput: results are
+    committed together, and those of the last N ms are lost if a worker
+    crashes (the jobs are then run again).
+    
+    --max N replaces the fixed --count with a supervised pool of --min to N
+    workers: more are started while a new job would wait longer than
+    --target-wait, one is retired after a sustained quiet spell, and workers
+    that crash are restarted.
+    """
+    autoscale = max_workers is not None
+    if min_workers is not None and not autoscale:
+        click.echo("Error: --min requires --max", err=True)
+        sys.exit(1)
+    if autoscale:
+        if count is not None:
+            click.echo("Error: --count cannot be combined with --max", err=True)
+            sys.exit(1)
+        if min_workers is None:
+            min_workers = 1
+        if min_workers < 0:
+            click.echo("Error: --min must not be negative", err=True)
+            sys.exit(1)
+        if max_workers < max(1, min_workers):
+            click.echo("Error: --max must be at least 1 and at least --min", err=True)
+            sys.exit(1)
+        from .queue import parse_duration
+        try:
+            target_seconds = parse_duration(target_wait)
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+        if target_seconds <= 0:
+            click.echo("Error: --target-wait must be positive", err=True)
+            sys.exit(1)
+        count = min_workers
+    elif count is None:
+        count = 1
+    elif count < 1:
         click.echo("Error: Worker count must be at least 1", err=True)
         sys.exit(1)
+    if prefetch < 1:
+        click.echo("Error: --prefetch must be at least 1", err=True)
+        sys.exit(1)
+    if concurrency < 1:
+        click.echo("Error: --concurrency must be at least 1", err=True)
+        sys.exit(1)
+    for name, value in (("--slow-query-ms", slow_query_ms), ("--slow-call-ms", slow_call_ms),
+                        ("--flush-ms", flush_ms)):
+        if value is not None and value < 0:
+            click.echo(f"Error: {name} must not be negative", err=True)
+            sys.exit(1)
+    
+    queue_list = None
+    if queues:
+        try:
+            queue_list = _parse_queues(queues)
+        except ValueError as e:
+            click.echo(f"Error: {e}", err=True)
+            sys.exit(1)
+    
+    if profile_dir is not None:
+        try:
+            os.makedirs(profile_dir, exist_ok=True)
+        except OSError as e:
+            click.echo(f"Error: cannot create {profile_dir}: {e}", err=True)
+            sys.exit(1)
+    
+    from .worker import WorkerManager
     
     click.echo(f"Starting {count} worker(s)...")
     
     manager = WorkerManager()
-    processes = manager.start_workers(count)
+    try:
+        processes = manager.start_workers(count, prefetch, concurrency, queue_list,
+                                          metrics_port, metrics_host, profile_dir,
+                                          slow_query_ms, slow_call_ms, flush_ms)
+    except OSError as e:
+        click.echo(f"Error: cannot serve metrics on {metrics_host}:{metrics_port}: {e}", err=True)
+        sys.exit(1)
     
     click.echo(f"Started {len(processes)} worker(s)")
+    if autoscale:
+        manager.autoscale(min_workers, max_workers, target_seconds)
+        click.echo(f"Autoscaling between {min_workers} and {max_workers} worker(s), "
+                   f"target wait {target_seconds:g}s")
+    if manager.metrics_server is not None:
+        click.echo(f"Metrics at http://{metrics_host}:{manager.metrics_server.port}/metrics")
     click.echo("Workers are running. Press Ctrl+C to stop.")
     
     try:
@@ -79,15 +329,41 @@ def start(count):
         import time
         while True:
             time.sleep(1)
+            manager.supervise()
     except KeyboardInterrupt:
         click.echo("\nStopping workers...")
         manager.stop_workers()
         click.echo("Workers stopped")
+    except RuntimeError as e:
+        # Workers keep crashing on startup; restarting them further is futile
+        click.echo(f"Error: {e}", err=True)
+        manager.stop_workers()
+        sys.exit(1)
+
+
+def _parse_queues(spec):
+    """Parse 'a,b' or 'a:3,b:1' into (name, weight) pairs"""
+    queues = []
+    for item in spec.split(','):
+        name, _, weight = item.strip().partition(':')
+        if not name:
+            raise ValueError(f"Invalid queue list '{spec}'")
+        if weight:
+            try:
+                weight = float(weight)
+            except ValueError:
+                raise ValueError(f"Invalid weight for queue '{name}': {weight}")
+            if weight <= 0:
+                raise ValueError(f"Weight for queue '{name}' must be positive")
+        queues.append((name, weight or None))
+    return queues
 
 
 @worker.command()
 def stop():
     """Stop all running workers gracefully"""
+    from .worker import WorkerManager
+    
     click.echo("Stopping all workers...")
     
     manager = WorkerManager()
@@ -97,10 +373,34 @@ def stop():
 
 
 @main.command()
-def status():
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json']), default='table',
+              help='Output format; json is cheaper for scripts polling the queue')
+def status(output_format):
     """Show summary of all job states & active workers"""
-    queue = JobQueue()
-    stats = queue.get_stats()
+    stats = None
+    client = _server_client()
+    if client is not None:
+        # The counters are a cheap read, so answer from the database instead
+        # when the server fails or goes away mid-request
+        try:
+            with client:
+                stats = client.request({'op': 'status'})
+            error = None if stats.pop('ok') else stats['error']
+        except OSError as e:
+            error = str(e) or type(e).__name__
+        if error is not None:
+            click.echo(f"Warning: server could not report status ({error}); "
+                       "reading the database", err=True)
+            stats = None
+    if stats is None:
+        queue = JobQueue()
+        stats = queue.get_stats()
+    
+    if output_format == 'json':
+        click.echo(json.dumps(stats, indent=2))
+        return
+    
+    from tabulate import tabulate
     
     # Job statistics
     job_stats = stats['jobs']
@@ -133,17 +433,109 @@ def status():
         ))
 
 
+@main.command()
+@click.option('--window', default='1h', help='How far back to look, e.g. 15m, 1h, 7d (default: 1h)')
+@click.option('--queue', 'queue_name', help='Only attempts from this queue')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json']), default='table',
+              help='Output format')
+def stats(window, queue_name, output_format):
+    """Show throughput and latency percentiles of recent job runs"""
+    try:
+        seconds = parse_duration(window)
+        if seconds <= 0:
+            raise ValueError(f"Invalid duration '{window}': must be positive")
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+    
+    queue = JobQueue()
+    result = queue.get_attempt_stats(seconds, queue_name)
+    
+    if output_format == 'json':
+        click.echo(json.dumps(result, indent=2))
+        return
+    
+    from tabulate import tabulate
+    
+    click.echo(f"=== Job Stats (last {window}) ===")
+    click.echo(f"\nAttempts: {result['attempts']}")
+    if not result['attempts']:
+        return
+    
+    outcomes = ", ".join(f"{count} {outcome}" for outcome, count in sorted(result['outcomes'].items()))
+    click.echo(f"Outcomes: {outcomes}")
+    click.echo(f"Workers: {result['workers']}")
+    click.echo(f"Throughput: {result['throughput'] * 60:.2f} completed job(s)/min")
+    
+    def seconds_cell(value):
+        return "-" if value is None else f"{value:.3f}"
+    
+    table_data = []
+    for label, metric in (("Queue wait", "wait_time"), ("Claim to start", "start_delay"),
+                          ("Run time", "run_time")):
+        summary = result[metric]
+        table_data.append([label] + [
+            seconds_cell(summary[key]) for key in ("p50", "p95", "p99", "avg", "max")
+        ])
+    click.echo("\nLatency (seconds):")
+    click.echo(tabulate(table_data, headers=["", "p50", "p95", "p99", "Avg", "Max"],
+                        tablefmt="grid"))
+
+
+TIMESTAMP_FORMATS = ['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S']
+
+# Jobs per page in table output when --limit is not given; json and csv are
+# streamed and unbounded
+LIST_PAGE_SIZE = 100
+
+LIST_FIELDS = ['id', 'command', 'state', 'queue', 'priority', 'attempts', 'max_retries',
+               'created_at', 'updated_at', 'completed_at', 'error_message', 'peak_rss', 'cpu_time']
+
+
+def _timestamp(value):
+    """Format a datetime the way jobs store their timestamps"""
+    if value is None:
+        return None
+    return value.isoformat(timespec='microseconds') + "Z"
+
+
 @main.command()
 @click.option('--state', type=click.Choice(['pending', 'processing', 'completed', 'failed', 'dead']), 
               help='Filter jobs by state')
-def list(state):
+@click.option('--limit', type=int,
+              help=f'Maximum number of jobs to show (table default: {LIST_PAGE_SIZE})')
+@click.option('--after', help='Continue after this job id (from the previous page)')
+@click.option('--since', type=click.DateTime(TIMESTAMP_FORMATS), help='Only jobs created at or after (UTC)')
+@click.option('--until', type=click.DateTime(TIMESTAMP_FORMATS), help='Only jobs created before (UTC)')
+@click.option('--format', 'output_format', type=click.Choice(['table', 'json', 'csv']), default='table',
+              help='Output format; json (one object per line) and csv are streamed')
+def list(state, limit, after, since, until, output_format):
     """List jobs, optionally filtered by state"""
+    if limit is not None and limit < 1:
+        click.echo("Error: --limit must be at least 1", err=True)
+        sys.exit(1)
+    if limit is None and output_format == 'table':
+        # A table is rendered whole, so it is built one page at a time
+        limit = LIST_PAGE_SIZE
+    
     queue = JobQueue()
-    jobs = queue.list_jobs(state)
+    try:
+        jobs = queue.iter_jobs(state, limit, after, _timestamp(since), _timestamp(until))
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
     
-    if not jobs:
-        state_msg = f" with state '{state}'" if state else ""
-        click.echo(f"No jobs found{state_msg}")
+    if output_format == 'json':
+        for job in jobs:
+            click.echo(json.dumps({field: job[field] for field in LIST_FIELDS}))
+        return
+    
+    if output_format == 'csv':
+        import csv
+        writer = csv.writer(sys.stdout)
+        writer.writerow(LIST_FIELDS)
+        for job in jobs:
+            writer.writerow([job[field] for field in LIST_FIELDS])
         return
     
     # Prepare table data
@@ -153,14 +545,234 @@ def list(state):
             job['id'],
             job['command'][:50] + ('...' if len(job['command']) > 50 else ''),
             job['state'],
+            job['queue'],
+            job['priority'],
             job['attempts'],
             job['max_retries'],
             job['created_at'],
             job['updated_at']
         ])
     
-    headers = ["ID", "Command", "State", "Attempts", "Max Retries", "Created At", "Updated At"]
+    if not table_data:
+        state_msg = f" with state '{state}'" if state else ""
+        click.echo(f"No jobs found{state_msg}")
+        return
+    
+    headers = ["ID", "Command", "State", "Queue", "Priority", "Attempts", "Max Retries",
+               "Created At", "Updated At"]
+    from tabulate import tabulate
     click.echo(tabulate(table_data, headers=headers, tablefmt="grid"))
+    
+    if limit is not None and len(table_data) == limit:
+        click.echo(f"Next page: --after {table_data[-1][0]}")
+
+
+@main.command()
+@click.argument('job_id', type=str)
+@click.option('--follow', '-f', is_flag=True, help='Keep printing output until the job finishes')
+def logs(job_id, follow):
+    """Show the output of a job
+    
+    Prints the full log if the output spilled to a file, otherwise the tail
+    kept in the database. With --follow, output of a running job is
+    printed as it is written.
+    """
+    queue = JobQueue()
+    try:
+        for text in queue.iter_log(job_id, follow):
+            click.echo(text, nl=False)
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+
+@main.command()
+def reconcile():
+    """Rebuild the job counters used by status from the jobs table"""
+    queue = JobQueue()
+    drift = queue.reconcile_stats()
+    
+    if not drift:
+        click.echo("Job counters are in sync")
+        return
+    
+    table_data = [[state, old, new] for state, (old, new) in sorted(drift.items())]
+    click.echo("Corrected job counters:")
+    from tabulate import tabulate
+    click.echo(tabulate(table_data, headers=["State", "Was", "Now"], tablefmt="grid"))
+
+
+@main.command()
+@click.option('--lease-timeout', type=float,
+              help='Seconds without a heartbeat before a worker is presumed dead (default: config)')
+def reap(lease_timeout):
+    """Recover jobs stuck in processing after a worker crashed"""
+    queue = JobQueue()
+    result = queue.reap_stale_jobs(lease_timeout)
+    
+    click.echo(f"Requeued {result['requeued']} job(s)")
+    click.echo(f"Moved {result['dead']} job(s) to Dead Letter Queue")
+    click.echo(f"Removed {result['workers']} dead worker(s)")
+
+
+@main.command()
+@click.option('--completed-ttl',
+              help='Remove completed jobs older than this, e.g. 7d or 12h; 0 keeps them (default: config)')
+@click.option('--dlq-max', type=int,
+              help='Keep only the N most recently dead-lettered jobs; 0 for no cap (default: config)')
+@click.option('--archive',
+              help='"none" to delete, "table" for jobs_archive, or path of an archive database (default: config)')
+@click.option('--batch-size', default=GC_BATCH_SIZE, type=int, help='Jobs removed per transaction')
+@click.option('--vacuum', is_flag=True,
+              help='Return freed space to the filesystem (a full VACUUM the first time on older databases)')
+def gc(completed_ttl, dlq_max, archive, batch_size, vacuum):
+    """Delete or archive old completed and dead jobs"""
+    if batch_size < 1:
+        click.echo("Error: --batch-size must be at least 1", err=True)
+        sys.exit(1)
+    
+    try:
+        ttl = parse_duration(completed_ttl) if completed_ttl is not None else None
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+    
+    queue = JobQueue()
+    result = queue.gc(ttl, dlq_max, archive, batch_size)
+    
+    action = "Archived" if result['archived'] else "Deleted"
+    click.echo(f"{action} {result['completed']} completed job(s)")
+    click.echo(f"{action} {result['dead']} job(s) from Dead Letter Queue")
+    
+    if vacuum:
+        freed = queue.vacuum(convert=True)
+        if freed['converted']:
+            click.echo("Enabled incremental vacuum (full VACUUM)")
+        click.echo(f"Freed {freed['freed']} page(s)")
+
+
+@main.command()
+@click.option('--scenario', 'scenarios', multiple=True,
+              type=click.Choice(['enqueue', 'claim', 'latency', 'growth', 'contention']),
+              help='Scenario to run; repeat for several (default: all)')
+@click.option('--quick', is_flag=True, help='Small sizes, a few seconds per scenario')
+@click.option('--sizes', help='Comma-separated table sizes for the growth scenario (default: 10000,100000,1000000)')
+@click.option('--output', type=click.File('w'), default='-', help='Write the JSON results here (default: stdout)')
+@click.option('--compare', 'baseline_file', type=click.File('r'),
+              help='Earlier results to compare against; exits 1 on a regression')
+@click.option('--threshold', default=0.2, type=float,
+              help='Relative change counted as a regression with --compare (default: 0.2)')
+def bench(scenarios, quick, sizes, output, baseline_file, threshold):
+    """Benchmark enqueue, claim and end-to-end latency on a scratch database
+    
+    Results are JSON. Rates are per second (higher is better); *_seconds
+    and *_bytes are lower-is-better.
+    """
+    from .bench import SCENARIOS, compare, run_suite
+    
+    try:
+        growth_sizes = [int(size) for size in sizes.split(",")] if sizes else None
+        if growth_sizes is not None and min(growth_sizes) < 1:
+            raise ValueError
+    except ValueError:
+        click.echo(f"Error: invalid --sizes '{sizes}', expected e.g. 10000,100000", err=True)
+        sys.exit(1)
+    
+    baseline = None
+    if baseline_file is not None:
+        try:
+            baseline = json.load(baseline_file)
+        except json.JSONDecodeError as e:
+            click.echo(f"Error: {baseline_file.name} is not valid JSON: {e}", err=True)
+            sys.exit(1)
+    
+    result = run_suite(
+        scenarios or SCENARIOS, quick, growth_sizes,
+        progress=lambda scenario: click.echo(f"Running {scenario}...", err=True)
+    )
+    
+    if baseline is not None:
+        result['regressions'] = compare(result, baseline, threshold)
+    output.write(json.dumps(result, indent=2) + "\n")
+    
+    if result.get('regressions'):
+        for regression in result['regressions']:
+            click.echo(
+                f"Regression: {regression['name']} {regression['metric']} "
+                f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.0%})",
+                err=True
+            )
+        sys.exit(1)
+
+
+@main.command()
+def serve():
+    """Serve enqueue, status and list on a local socket
+    
+    Keeps the database open so producers skip the per-call startup and
+    connection cost; `enqueue` and `status` use it automatically while it
+    runs. Enqueues arriving together are inserted in one transaction.
+    """
+    from .server import QueueServer
+    
+    server = QueueServer()
+    try:
+        server.start()
+    except (RuntimeError, OSError) as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
+    
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+    
+    # Commit the enqueues already received when stopped with kill too
+    import signal
+    signal.signal(signal.SIGTERM, terminate)
+    
+    click.echo(f"Serving on {server.path}. Press Ctrl+C to stop.")
+    try:
+        import time
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+@main.group()
+def metrics():
+    """Export queue metrics"""
+    pass
+
+
+@metrics.command('serve')
+@click.option('--port', default=9464, type=int, help='Port to listen on (default: 9464)')
+@click.option('--host', default='127.0.0.1', help='Address to listen on (default: 127.0.0.1)')
+def serve_metrics(port, host):
+    """Serve queue depth and worker heartbeats as OpenMetrics
+    
+    Reads the job counters and the workers table on each scrape. Job
+    latency and lock-wait metrics come from the workers themselves; use
+    `worker start --metrics-port` for those.
+    """
+    from .metrics import MetricsServer, database_snapshot, render
+    
+    db = Database()
+    server = MetricsServer(lambda: render(database_snapshot(db)), port, host)
+    try:
+        server.start()
+    except OSError as e:
+        click.echo(f"Error: cannot listen on {host}:{port}: {e}", err=True)
+        sys.exit(1)
+    
+    click.echo(f"Serving metrics at http://{host}:{server.port}/metrics. Press Ctrl+C to stop.")
+    try:
+        import time
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
 
 
 @main.group()
@@ -170,14 +782,21 @@ def dlq():
 
 
 @dlq.command()
-def list():
-    """List all jobs in Dead Letter Queue"""
-    queue = JobQueue()
-    jobs = queue.get_dlq_jobs()
+@click.option('--limit', default=LIST_PAGE_SIZE, type=int,
+              help=f'Maximum number of jobs to show (default: {LIST_PAGE_SIZE})')
+@click.option('--after', help='Continue after this job id (from the previous page)')
+def list(limit, after):
+    """List jobs in Dead Letter Queue, newest first, one page at a time"""
+    if limit < 1:
+        click.echo("Error: --limit must be at least 1", err=True)
+        sys.exit(1)
     
-    if not jobs:
-        click.echo("No jobs in Dead Letter Queue")
-        return
+    queue = JobQueue()
+    try:
+        jobs = queue.iter_jobs('dead', limit, after)
+    except ValueError as e:
+        click.echo(f"Error: {e}", err=True)
+        sys.exit(1)
     
     table_data = []
     for job in jobs:
@@ -194,8 +813,16 @@ def list():
             job['created_at']
         ])
     
+    if not table_data:
+        click.echo("No jobs in Dead Letter Queue")
+        return
+    
     headers = ["ID", "Command", "Attempts", "Max Retries", "Error", "Created At"]
+    from tabulate import tabulate
     click.echo(tabulate(table_data, headers=headers, tablefmt="grid"))
+    
+    if len(table_data) == limit:
+        click.echo(f"Next page: --after {table_data[-1][0]}")
 
 
 @dlq.command()
@@ -231,8 +858,17 @@ def set_config(key, value):
     Examples:
         queuectl config set max-retries 5
         queuectl config set backoff-base 3
+        queuectl config set lease-timeout 60
+        queuectl config set heartbeat-interval 10
+        queuectl config set completed-ttl 7d
+        queuectl config set dlq-max 10000
+        queuectl config set gc-archive table
+        queuectl config set log-dir /var/log/queuectl
+        queuectl config set log-compress true
+        queuectl config set job-timeout 10m
     """
-    valid_keys = ['max-retries', 'backoff-base']
+    valid_keys = ['max-retries', 'backoff-base', 'lease-timeout', 'heartbeat-interval', 'completed-ttl',
+                  'dlq-max', 'gc-archive', 'log-dir', 'log-compress', 'job-timeout']
     
     if key not in valid_keys:
         click.echo(f"Error: Invalid config key. Valid keys: {', '.join(valid_keys)}", err=True)
@@ -251,6 +887,53 @@ def set_config(key, value):
         except ValueError:
             click.echo("Error: backoff-base must be a number", err=True)
             sys.exit(1)
+    elif key in ('lease-timeout', 'heartbeat-interval'):
+        try:
+            if float(value) <= 0:
+                raise ValueError
+        except ValueError:
+            click.echo(f"Error: {key} must be a positive number", err=True)
+            sys.exit(1)
+        # Workers cap their heartbeat interval at half the lease; refuse settings that need it
+        queue = JobQueue()
+        if key == 'lease-timeout':
+            lease_timeout = float(value)
+            heartbeat_interval = float(queue.get_config('heartbeat_interval', '5'))
+        else:
+            lease_timeout = float(queue.get_config('lease_timeout', '30'))
+            heartbeat_interval = float(value)
+        if lease_timeout < 2 * heartbeat_interval:
+            click.echo(
+                f"Error: lease-timeout ({lease_timeout:g}) must be at least twice "
+                f"heartbeat-interval ({heartbeat_interval:g})", err=True
+            )
+            sys.exit(1)
+    elif key == 'completed-ttl':
+        try:
+            parse_duration(value)
+        except ValueError as e:
+            click.echo(f"Error: completed-ttl: {e}", err=True)
+            sys.exit(1)
+    elif key == 'dlq-max':
+        try:
+            if int(value) < 0:
+                raise ValueError
+        except ValueError:
+            click.echo("Error: dlq-max must be a non-negative integer", err=True)
+            sys.exit(1)
+    elif key == 'job-timeout':
+        try:
+            if parse_duration(value) <= 0:
+                raise ValueError("must be positive")
+        except ValueError as e:
+            click.echo(f"Error: job-timeout: {e}", err=True)
+            sys.exit(1)
+        # Stored in seconds, as workers read it
+        value = f"{parse_duration(value):g}"
+    elif key == 'log-compress':
+        if value not in ('true', 'false'):
+            click.echo("Error: log-compress must be true or false", err=True)
+            sys.exit(1)
     
     # Map CLI key to DB key
     db_key = key.replace('-', '_')
@@ -268,23 +951,42 @@ def get_config(key):
     queue = JobQueue()
     
     if key:
-        valid_keys = ['max-retries', 'backoff-base']
+        valid_keys = ['max-retries', 'backoff-base', 'lease-timeout', 'heartbeat-interval',
+                      'completed-ttl', 'dlq-max', 'gc-archive', 'log-dir', 'log-compress',
+                      'job-timeout']
         if key not in valid_keys:
             click.echo(f"Error: Invalid config key. Valid keys: {', '.join(valid_keys)}", err=True)
             sys.exit(1)
         
         db_key = key.replace('-', '_')
-        value = queue.get_config(db_key)
+        value = queue.log_dir() if key == 'log-dir' else queue.get_config(db_key)
         click.echo(f"{key}: {value}")
     else:
         # Show all config
         max_retries = queue.get_config('max_retries', '3')
         backoff_base = queue.get_config('backoff_base', '2')
+        lease_timeout = queue.get_config('lease_timeout', '30')
+        heartbeat_interval = queue.get_config('heartbeat_interval', '5')
+        completed_ttl = queue.get_config('completed_ttl', '0')
+        dlq_max = queue.get_config('dlq_max', '0')
+        gc_archive = queue.get_config('gc_archive', 'none')
+        log_dir = queue.log_dir()
+        log_compress = queue.get_config('log_compress', 'false')
+        job_timeout = queue.get_config('job_timeout', '300')
         
         table_data = [
             ['max-retries', max_retries],
-            ['backoff-base', backoff_base]
+            ['backoff-base', backoff_base],
+            ['lease-timeout', lease_timeout],
+            ['heartbeat-interval', heartbeat_interval],
+            ['completed-ttl', completed_ttl],
+            ['dlq-max', dlq_max],
+            ['gc-archive', gc_archive],
+            ['log-dir', log_dir],
+            ['log-compress', log_compress],
+            ['job-timeout', job_timeout]
         ]
+        from tabulate import tabulate
         click.echo(tabulate(table_data, headers=["Key", "Value"], tablefmt="grid"))
 
 
@@ -2,10 +2,414 @@
 
 import sqlite3
 import json
+import math
 import os
-from datetime import datetime
-from typing import Optional, List, Dict
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional, List, Dict, Iterator
 from contextlib import contextmanager
+from .metrics import REGISTRY
+
+
+# How long a connection waits on a locked database before giving up
+BUSY_TIMEOUT_MS = 10000
+
+# Number of prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 256
+
+# UPDATE ... RETURNING is available from SQLite 3.35 onwards
+SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+# Seconds a cached config snapshot is trusted before config_version is re-checked
+CONFIG_CHECK_INTERVAL = 1.0
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER (999 on older builds) for IN (...) lists
+MAX_SQL_VARIABLES = 500
+
+# Schema name under which a separate archive file is attached during gc
+ARCHIVE_SCHEMA = "archive"
+
+# Seconds the write-behind flusher waits before retrying a failed flush
+WRITE_BEHIND_RETRY = 1.0
+
+# Time spent waiting for the write lock; its _count is the number of immediate write transactions
+LOCK_WAIT = REGISTRY.histogram(
+    "queuectl_sqlite_lock_wait_seconds", "Time spent acquiring the SQLite write lock (BEGIN IMMEDIATE)"
+)
+
+
+def _create_base_schema(cursor: sqlite3.Cursor):
+    """Migration 1: jobs, config and workers tables"""
+    # Jobs table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            command TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            max_retries INTEGER DEFAULT 3,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            completed_at TEXT,
+            error_message TEXT,
+            next_retry_at TEXT
+        )
+    """)
+    
+    # Configuration table
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS config (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    
+    # Workers table (for tracking active workers)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            started_at TEXT NOT NULL,
+            last_heartbeat TEXT NOT NULL
+        )
+    """)
+    
+    # Initialize default config
+    cursor.execute("""
+        INSERT OR IGNORE INTO config (key, value) VALUES
+        ('max_retries', '3'),
+        ('backoff_base', '2')
+    """)
+
+
+def _add_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    """Add a column unless an unversioned database already has it"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row['name'] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _add_claim_columns(cursor: sqlite3.Cursor):
+    """Migration 2: record which worker claimed a job and when"""
+    _add_column(cursor, "jobs", "worker_id", "TEXT")
+    _add_column(cursor, "jobs", "claimed_at", "TEXT")
+
+
+def _create_job_indexes(cursor: sqlite3.Cursor):
+    """Migration 3: indexes for the claim, retry and stats queries"""
+    # Pending claim (state = ? ORDER BY created_at), list --state and GROUP BY state
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_state_created
+        ON jobs (state, created_at)
+    """)
+    # Retry sweep; only failed jobs are indexed, so it stays tiny
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_retry
+        ON jobs (state, next_retry_at)
+        WHERE state = 'failed'
+    """)
+
+
+def _add_lease_config(cursor: sqlite3.Cursor):
+    """Migration 4: default lease timeout for reclaiming jobs of dead workers"""
+    cursor.execute("""
+        INSERT OR IGNORE INTO config (key, value) VALUES ('lease_timeout', '30')
+    """)
+
+
+def _add_priority_and_queues(cursor: sqlite3.Cursor):
+    """Migration 5: job priorities and named queues"""
+    _add_column(cursor, "jobs", "priority", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(cursor, "jobs", "queue", "TEXT NOT NULL DEFAULT 'default'")
+    # Dispatch order, indexing only pending jobs so finished rows cost nothing
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_dispatch
+        ON jobs (priority DESC, created_at)
+        WHERE state = 'pending'
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_dispatch_queue
+        ON jobs (queue, priority DESC, created_at)
+        WHERE state = 'pending'
+    """)
+
+
+def _create_created_index(cursor: sqlite3.Cursor):
+    """Migration 6: keyset pagination over all jobs by creation time"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_created
+        ON jobs (created_at)
+    """)
+
+
+def _create_job_counts(cursor: sqlite3.Cursor):
+    """Migration 7: per-state job counters kept in sync by triggers"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_counts (
+            state TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("DELETE FROM job_counts")
+    cursor.execute("""
+        INSERT INTO job_counts (state, count)
+        SELECT state, COUNT(*) FROM jobs GROUP BY state
+    """)
+    
+    # Triggers fire inside the transaction that changes the job, so the
+    # counters can never disagree with committed data. Inserts are counted by
+    # create_job(s) once per batch instead: a per-row trigger would double the
+    # cost of bulk enqueue.
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_job_counts_update AFTER UPDATE OF state ON jobs
+        WHEN OLD.state IS NOT NEW.state
+        BEGIN
+            UPDATE job_counts SET count = count - 1 WHERE state = OLD.state;
+            INSERT OR IGNORE INTO job_counts (state, count) VALUES (NEW.state, 0);
+            UPDATE job_counts SET count = count + 1 WHERE state = NEW.state;
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_job_counts_delete AFTER DELETE ON jobs
+        BEGIN
+            UPDATE job_counts SET count = count - 1 WHERE state = OLD.state;
+        END
+    """)
+
+
+def _add_retention_config(cursor: sqlite3.Cursor):
+    """Migration 8: retention policy defaults (all disabled)"""
+    cursor.execute("""
+        INSERT OR IGNORE INTO config (key, value) VALUES
+        ('completed_ttl', '0'),
+        ('dlq_max', '0'),
+        ('gc_archive', 'none')
+    """)
+
+
+def _add_output_columns(cursor: sqlite3.Cursor):
+    """Migration 9: tail of each job's output and the path of its full log"""
+    _add_column(cursor, "jobs", "output_tail", "TEXT")
+    _add_column(cursor, "jobs", "log_path", "TEXT")
+    cursor.execute("""
+        INSERT OR IGNORE INTO config (key, value) VALUES ('log_compress', 'false')
+    """)
+
+
+def _add_limit_columns(cursor: sqlite3.Cursor):
+    """Migration 10: per-job resource limits and the usage recorded for each run"""
+    _add_column(cursor, "jobs", "timeout", "REAL")
+    _add_column(cursor, "jobs", "max_memory", "INTEGER")
+    _add_column(cursor, "jobs", "cpu_seconds", "INTEGER")
+    _add_column(cursor, "jobs", "nice", "INTEGER")
+    _add_column(cursor, "jobs", "peak_rss", "INTEGER")
+    _add_column(cursor, "jobs", "cpu_time", "REAL")
+    cursor.execute("""
+        INSERT OR IGNORE INTO config (key, value) VALUES ('job_timeout', '300')
+    """)
+
+
+def _create_job_attempts(cursor: sqlite3.Cursor):
+    """Migration 11: timing of every execution attempt, for `queuectl stats`"""
+    # When the job last became claimable (enqueue, retry due, requeue)
+    _add_column(cursor, "jobs", "queued_at", "TEXT")
+    cursor.execute("UPDATE jobs SET queued_at = created_at WHERE queued_at IS NULL")
+    
+    # Times are epoch seconds and the durations are stored precomputed, so
+    # window filters and percentiles are plain comparisons and ORDER BYs
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS job_attempts (
+            id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            attempt INTEGER NOT NULL,
+            worker_id TEXT,
+            queue TEXT,
+            outcome TEXT NOT NULL,
+            exit_code INTEGER,
+            queued_at REAL,
+            claimed_at REAL,
+            started_at REAL NOT NULL,
+            finished_at REAL NOT NULL,
+            wait_time REAL,
+            start_delay REAL,
+            run_time REAL NOT NULL
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_job_attempts_finished
+        ON job_attempts (finished_at)
+    """)
+
+
+def _add_heartbeat_config(cursor: sqlite3.Cursor):
+    """Migration 12: seconds between worker heartbeats"""
+    cursor.execute("""
+        INSERT OR IGNORE INTO config (key, value) VALUES ('heartbeat_interval', '5')
+    """)
+
+
+def _create_completed_index(cursor: sqlite3.Cursor):
+    """Migration 13: gc walks finished jobs by the time they finished"""
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_state_completed
+        ON jobs (state, completed_at)
+    """)
+
+
+# Schema migrations in order; PRAGMA user_version records how many have run
+MIGRATIONS = [
+    _create_base_schema,
+    _add_claim_columns,
+    _create_job_indexes,
+    _add_lease_config,
+    _add_priority_and_queues,
+    _create_created_index,
+    _create_job_counts,
+    _add_retention_config,
+    _add_output_columns,
+    _add_limit_columns,
+    _create_job_attempts,
+    _add_heartbeat_config,
+    _create_completed_index,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def _is_new_database(db_path: str) -> bool:
+    """True if opening db_path creates the database
+    
+    Only stat()s the file: opening and closing it here would drop the POSIX
+    locks SQLite holds on it for other connections in this process.
+    """
+    try:
+        return os.path.getsize(db_path) == 0
+    except OSError:
+        return True
+
+
+class _WriteBehind:
+    """Job updates and heartbeats held in memory and committed together
+    
+    The first write after a flush starts a window of window seconds; every
+    write made during it goes into the same transaction. Updates to the same
+    job are merged field by field, later values winning, and only the
+    latest heartbeat per worker is kept.
+    """
+    
+    def __init__(self, db: "Database", window: float):
+        self.db = db
+        self.window = window
+        # job_id -> (fields, job_attempts rows, owner)
+        self._jobs = {}
+        # worker_id -> last_heartbeat
+        self._heartbeats = {}
+        self._stopping = False
+        self._changed = threading.Condition()
+        # One flush at a time, so a failed batch is put back before the next is taken
+        self._flushing = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+    
+    def update_job(self, job_id: str, fields: Dict, attempt: Optional[Dict],
+                   owner: Optional[str] = None):
+        with self._changed:
+            entry = self._jobs.get(job_id)
+            if entry is None:
+                self._jobs[job_id] = (fields, [attempt] if attempt is not None else [], owner)
+            else:
+                entry[0].update(fields)
+                if attempt is not None:
+                    entry[1].append(attempt)
+                # The latest update decides whose lease the merged one needs
+                self._jobs[job_id] = (entry[0], entry[1], owner)
+            self._changed.notify()
+    
+    def heartbeat(self, worker_id: str, now: str):
+        with self._changed:
+            self._heartbeats[worker_id] = now
+            self._changed.notify()
+    
+    def flush(self):
+        """Commit everything buffered so far
+        
+        If the database is locked or busy the updates stay buffered and the
+        error is raised; otherwise they are retried one job at a time, and
+        updates that still fail are reported and dropped.
+        """
+        with self._flushing:
+            with self._changed:
+                jobs, self._jobs = self._jobs, {}
+                heartbeats, self._heartbeats = self._heartbeats, {}
+            if not jobs and not heartbeats:
+                return
+            try:
+                self.db._write_batch(jobs, heartbeats)
+            except sqlite3.OperationalError as e:
+                message = str(e)
+                if "locked" not in message and "busy" not in message:
+                    # Disk I/O, schema or read-only errors would fail every retry
+                    self._write_each(jobs, heartbeats)
+                    return
+                # Locked or busy: all of it goes into the next flush
+                with self._changed:
+                    self._restore(jobs, heartbeats)
+                raise
+            except Exception:
+                # One bad update must not hold back the others
+                self._write_each(jobs, heartbeats)
+    
+    def _write_each(self, jobs: Dict, heartbeats: Dict):
+        """Commit a batch one job at a time, dropping updates that fail"""
+        for job_id, entry in jobs.items():
+            try:
+                self.db._write_batch({job_id: entry}, {})
+            except Exception as e:
+                print(f"Dropped update of job {job_id}: {e}", file=sys.stderr)
+        self.db._write_batch({}, heartbeats)
+    
+    def _restore(self, jobs: Dict, heartbeats: Dict):
+        for job_id, (fields, attempts, owner) in jobs.items():
+            newer = self._jobs.get(job_id)
+            if newer is not None:
+                fields.update(newer[0])
+                attempts.extend(newer[1])
+                owner = newer[2]
+            self._jobs[job_id] = (fields, attempts, owner)
+        for worker_id, now in heartbeats.items():
+            self._heartbeats.setdefault(worker_id, now)
+    
+    def stop(self):
+        """Flush what is buffered and stop the flusher thread"""
+        with self._changed:
+            self._stopping = True
+            self._changed.notify()
+        self._thread.join()
+        # Anything a failed final flush left behind
+        self.flush()
+    
+    def _run(self):
+        while True:
+            with self._changed:
+                while not (self._jobs or self._heartbeats or self._stopping):
+                    self._changed.wait()
+                stopping = self._stopping
+            if not stopping:
+                # Let more writes join this transaction
+                time.sleep(self.window)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed, retrying: {e}", file=sys.stderr)
+                if stopping:
+                    break
+                time.sleep(WRITE_BEHIND_RETRY)
+                continue
+            if stopping:
+                break
+        self.db.close()
 
 
 class Database:
@@ -13,83 +417,171 @@ class Database:
     
     def __init__(self, db_path: str = "queuectl.db"):
         self.db_path = db_path
+        self._local = threading.local()
+        # Config snapshot, invalidated when set_config bumps config_version
+        self._config = None
+        self._config_version = None
+        self._config_checked_at = 0.0
+        # DatabaseProfiler, set by DatabaseProfiler.instrument(); None costs nothing
+        self.profiler = None
+        # _WriteBehind buffer while start_write_behind() is in effect
+        self._write_behind = None
+        # worker_id -> pid of the workers registered through this instance
+        self._registered = {}
         self._init_db()
     
     def _init_db(self):
-        """Initialize database schema"""
-        with self._get_connection() as conn:
+        """Initialize or upgrade the database schema"""
+        conn = self._connection()
+        if conn.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+            return
+        
+        with self._get_connection(immediate=True) as conn:
             cursor = conn.cursor()
-            
-            # Jobs table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS jobs (
-                    id TEXT PRIMARY KEY,
-                    command TEXT NOT NULL,
-                    state TEXT NOT NULL,
-                    attempts INTEGER DEFAULT 0,
-                    max_retries INTEGER DEFAULT 3,
-                    created_at TEXT NOT NULL,
-                    updated_at TEXT NOT NULL,
-                    completed_at TEXT,
-                    error_message TEXT,
-                    next_retry_at TEXT
-                )
-            """)
-            
-            # Configuration table
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS config (
-                    key TEXT PRIMARY KEY,
-                    value TEXT NOT NULL
-                )
-            """)
-            
-            # Workers table (for tracking active workers)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS workers (
-                    worker_id TEXT PRIMARY KEY,
-                    pid INTEGER NOT NULL,
-                    started_at TEXT NOT NULL,
-                    last_heartbeat TEXT NOT NULL
-                )
-            """)
-            
-            # Initialize default config
-            cursor.execute("""
-                INSERT OR IGNORE INTO config (key, value) VALUES
-                ('max_retries', '3'),
-                ('backoff_base', '2')
-            """)
-            
-            conn.commit()
+            # Re-read under the write lock in case another process just migrated
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for migration in MIGRATIONS[version:]:
+                migration(cursor)
+            cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     
-    @contextmanager
-    def _get_connection(self):
-        """Get database connection with proper transaction handling"""
-        conn = sqlite3.connect(self.db_path, timeout=10.0)
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection configured for concurrent access
+        
+        Every CLI call opens one, so auto_vacuum, which costs a schema read
+        and is a no-op on an existing database, is only set on new files.
+        """
+        is_new = _is_new_database(self.db_path)
+        # timeout sets SQLite's busy_timeout
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=STATEMENT_CACHE_SIZE
+        )
         conn.row_factory = sqlite3.Row
+        if is_new:
+            # Only takes effect on a new database, and must come before WAL writes
+            # the header; lets gc hand freed pages back without a full VACUUM
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL lets readers (status, list) run while a worker holds the write lock
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if self.profiler is not None:
+            self.profiler.attach(conn)
+        return conn
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Get the long-lived connection for the current thread and process"""
+        conn = getattr(self._local, "conn", None)
+        # A connection inherited across fork() must not be reused by the child
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._connect()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    @contextmanager
+    def _get_connection(self, immediate: bool = False):
+        """Get database connection with proper transaction handling
+        
+        With immediate=True the write lock is taken up front (BEGIN IMMEDIATE),
+        so a read-then-write transaction never fails on a lock upgrade.
+        """
+        conn = self._connection()
+        if immediate:
+            started = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            waited = time.perf_counter() - started
+            LOCK_WAIT.observe(waited)
+            if self.profiler is not None:
+                self.profiler.lock_wait(waited)
         try:
             yield conn
             conn.commit()
         except Exception:
             conn.rollback()
             raise
-        finally:
+    
+    def close(self):
+        """Close the connection held by the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
             conn.close()
+        self._local.conn = None
     
-    def create_job(self, job_id: str, command: str, max_retries: int = 3) -> Dict:
-        """Create a new job"""
+    def create_job(self, job_id: str, command: str, max_retries: int = 3,
+                   priority: int = 0, queue: str = "default",
+                   limits: Optional[Dict] = None) -> Dict:
+        """Create a new job
+        
+        limits optionally holds timeout, max_memory, cpu_seconds and nice.
+        """
         now = datetime.utcnow().isoformat() + "Z"
+        limits = limits or {}
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("""
-                INSERT INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (job_id, command, "pending", 0, max_retries, now, now))
+                INSERT INTO jobs (id, command, state, attempts, max_retries, priority, queue,
+                                  timeout, max_memory, cpu_seconds, nice, created_at, updated_at,
+                                  queued_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (job_id, command, "pending", 0, max_retries, priority, queue,
+                  limits.get('timeout'), limits.get('max_memory'), limits.get('cpu_seconds'),
+                  limits.get('nice'), now, now, now))
+            self._count_new_jobs(cursor, 1)
             conn.commit()
         
         return self.get_job(job_id)
     
+    def create_jobs(self, jobs: List[Dict]) -> List[str]:
+        """Create many jobs in one transaction
+        
+        Each job is a dict with 'id', 'command' and 'max_retries', and optionally
+        'priority', 'queue' and the limits taken by create_job(). Jobs whose id
+        already exists (in the table or earlier in the batch) are skipped and
+        their ids returned.
+        """
+        now = datetime.utcnow().isoformat() + "Z"
+        with self._get_connection(immediate=True) as conn:
+            cursor = conn.cursor()
+            
+            ids = [job['id'] for job in jobs]
+            seen = set()
+            for i in range(0, len(ids), MAX_SQL_VARIABLES):
+                chunk = ids[i:i + MAX_SQL_VARIABLES]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(f"SELECT id FROM jobs WHERE id IN ({placeholders})", chunk)
+                seen.update(row['id'] for row in cursor.fetchall())
+            
+            duplicates = []
+            rows = []
+            for job in jobs:
+                if job['id'] in seen:
+                    duplicates.append(job['id'])
+                    continue
+                seen.add(job['id'])
+                rows.append((
+                    job['id'], job['command'], "pending", 0, job['max_retries'],
+                    job.get('priority', 0), job.get('queue', "default"),
+                    job.get('timeout'), job.get('max_memory'), job.get('cpu_seconds'),
+                    job.get('nice'), now, now, now
+                ))
+            
+            cursor.executemany("""
+                INSERT INTO jobs (id, command, state, attempts, max_retries, priority, queue,
+                                  timeout, max_memory, cpu_seconds, nice, created_at, updated_at,
+                                  queued_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            self._count_new_jobs(cursor, len(rows))
+        
+        return duplicates
+    
+    @staticmethod
+    def _count_new_jobs(cursor: sqlite3.Cursor, count: int):
+        """Add newly inserted pending jobs to job_counts"""
+        cursor.execute("INSERT OR IGNORE INTO job_counts (state, count) VALUES ('pending', 0)")
+        cursor.execute("UPDATE job_counts SET count = count + ? WHERE state = 'pending'", (count,))
+    
     def get_job(self, job_id: str) -> Optional[Dict]:
         """Get job by ID"""
         with self._get_connection() as conn:
@@ -100,84 +592,514 @@ class Database:
                 return dict(row)
         return None
     
-    def update_job(self, job_id: str, **kwargs):
-        """Update job fields"""
+    def update_job(self, job_id: str, attempt: Optional[Dict] = None,
+                   owner: Optional[str] = None, **kwargs):
+        """Update job fields
+        
+        attempt, if given, is a job_attempts row recorded in the same transaction.
+        With owner, the update only applies while the job is still processing
+        under that worker: a worker whose lease was reaped must not overwrite
+        the state of a retry or of the job's next owner.
+        With write-behind on, the update is buffered and committed by the
+        next flush.
+        """
         now = datetime.utcnow().isoformat() + "Z"
         kwargs['updated_at'] = now
         
-        set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
-        values = list(kwargs.values()) + [job_id]
+        if self._write_behind is not None:
+            self._write_behind.update_job(job_id, kwargs, attempt, owner)
+            return
         
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(f"UPDATE jobs SET {set_clause} WHERE id = ?", values)
+            self._apply_job_update(cursor, job_id, kwargs,
+                                   [attempt] if attempt is not None else [], owner)
+            conn.commit()
+    
+    @staticmethod
+    def _apply_job_update(cursor: sqlite3.Cursor, job_id: str, fields: Dict, attempts: List[Dict],
+                          owner: Optional[str] = None):
+        set_clause = ", ".join([f"{k} = ?" for k in fields.keys()])
+        if owner is None:
+            cursor.execute(f"UPDATE jobs SET {set_clause} WHERE id = ?", list(fields.values()) + [job_id])
+        else:
+            cursor.execute(f"""
+                UPDATE jobs SET {set_clause}
+                WHERE id = ? AND state = 'processing' AND worker_id = ?
+            """, list(fields.values()) + [job_id, owner])
+            if cursor.rowcount == 0:
+                # The reaper already counted this run as a failed attempt
+                print(f"Discarded result of job {job_id}: {owner} no longer holds its lease",
+                      file=sys.stderr)
+                return
+        for attempt in attempts:
+            columns = ", ".join(attempt)
+            placeholders = ", ".join("?" * len(attempt))
+            cursor.execute(
+                f"INSERT INTO job_attempts (job_id, {columns}) VALUES (?, {placeholders})",
+                [job_id] + list(attempt.values())
+            )
+    
+    def start_write_behind(self, flush_ms: float):
+        """Buffer update_job() and heartbeats, committing them together every flush_ms
+        
+        Trades durability for write throughput: a crash loses the updates of
+        the last flush_ms, and the jobs involved are run again once their
+        lease expires. Call stop_write_behind() (or flush()) before relying
+        on the database reflecting every update.
+        """
+        if self._write_behind is None:
+            self._write_behind = _WriteBehind(self, flush_ms / 1000.0)
+    
+    def stop_write_behind(self):
+        """Flush buffered writes and go back to committing each one"""
+        write_behind, self._write_behind = self._write_behind, None
+        if write_behind is not None:
+            write_behind.stop()
+    
+    def flush(self):
+        """Commit buffered write-behind updates now; a no-op without write-behind"""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+    
+    def _write_batch(self, jobs: Dict, heartbeats: Dict):
+        """One transaction for a write-behind flush"""
+        with self._get_connection(immediate=True) as conn:
+            cursor = conn.cursor()
+            for job_id, (fields, attempts, owner) in jobs.items():
+                self._apply_job_update(cursor, job_id, fields, attempts, owner)
+            for worker_id, now in heartbeats.items():
+                self._touch_worker(cursor, worker_id, now)
             conn.commit()
     
-    def get_pending_job(self) -> Optional[Dict]:
-        """Get next pending job (with locking)"""
+    def get_pending_job(self, worker_id: Optional[str] = None) -> Optional[Dict]:
+        """Atomically claim the next pending job for a worker"""
+        jobs = self.claim_jobs(worker_id, 1)
+        return jobs[0] if jobs else None
+    
+    def claim_jobs(self, worker_id: Optional[str], limit: int,
+                   queue: Optional[str] = None) -> List[Dict]:
+        """Atomically claim up to `limit` pending jobs for a worker
+        
+        Jobs are taken highest priority first, then oldest first, from the
+        named queue or from all queues when queue is None. A claim that
+        returns jobs has also refreshed the worker's heartbeat.
+        """
         now = datetime.utcnow().isoformat() + "Z"
-        with self._get_connection() as conn:
+        # Pin the partial dispatch indexes; the planner would otherwise pick
+        # (state, created_at) and sort every pending row by priority
+        if queue is None:
+            index, where, params = "idx_jobs_dispatch", "state = 'pending'", []
+        else:
+            index, where, params = "idx_jobs_dispatch_queue", "state = 'pending' AND queue = ?", [queue]
+        
+        # An empty queue is answered by a read, so idle polling never takes the write lock
+        conn = self._connection()
+        if conn.execute(f"SELECT 1 FROM jobs WHERE {where} LIMIT 1", params).fetchone() is None:
+            return []
+        
+        with self._get_connection(immediate=True) as conn:
+            cursor = conn.cursor()
+            if worker_id is not None:
+                # The claim doubles as a heartbeat, saving the worker a transaction of its own
+                self._touch_worker(cursor, worker_id, now)
+            if SUPPORTS_RETURNING:
+                # Select and lock the jobs in a single statement
+                cursor.execute(f"""
+                    UPDATE jobs
+                    SET state = 'processing', worker_id = ?, claimed_at = ?, updated_at = ?
+                    WHERE id IN (
+                        SELECT id FROM jobs INDEXED BY {index}
+                        WHERE {where}
+                        ORDER BY priority DESC, created_at ASC
+                        LIMIT ?
+                    )
+                    RETURNING *
+                """, [worker_id, now, now] + params + [limit])
+                jobs = [dict(row) for row in cursor.fetchall()]
+                # RETURNING does not guarantee row order
+                jobs.sort(key=lambda job: (-job['priority'], job['created_at']))
+                return jobs
+            
+            # Older SQLite: the IMMEDIATE transaction keeps SELECT + UPDATE atomic
+            cursor.execute(f"""
+                SELECT id FROM jobs INDEXED BY {index}
+                WHERE {where}
+                ORDER BY priority DESC, created_at ASC
+                LIMIT ?
+            """, params + [limit])
+            ids = [row['id'] for row in cursor.fetchall()]
+            if not ids:
+                return []
+            placeholders = ", ".join("?" * len(ids))
+            cursor.execute(f"""
+                UPDATE jobs
+                SET state = 'processing', worker_id = ?, claimed_at = ?, updated_at = ?
+                WHERE id IN ({placeholders})
+            """, [worker_id, now, now] + ids)
+            cursor.execute(f"""
+                SELECT * FROM jobs WHERE id IN ({placeholders})
+                ORDER BY priority DESC, created_at ASC
+            """, ids)
+            return [dict(row) for row in cursor.fetchall()]
+    
+    def promote_due_retries(self) -> int:
+        """Move failed jobs whose retry time has passed back to pending"""
+        now = datetime.utcnow().isoformat() + "Z"
+        with self._get_connection(immediate=True) as conn:
             cursor = conn.cursor()
-            # First, move failed jobs back to pending if retry time has passed
             cursor.execute("""
                 UPDATE jobs 
-                SET state = 'pending', next_retry_at = NULL
+                SET state = 'pending', queued_at = next_retry_at, next_retry_at = NULL
                 WHERE state = 'failed' 
                 AND next_retry_at IS NOT NULL 
                 AND next_retry_at <= ?
             """, (now,))
-            
-            # Use row-level locking to prevent duplicate processing
+            return cursor.rowcount
+    
+    def get_next_retry_time(self) -> Optional[datetime]:
+        """Earliest next_retry_at among failed jobs, or None"""
+        with self._get_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                SELECT * FROM jobs 
-                WHERE state = 'pending' 
-                ORDER BY created_at ASC
-                LIMIT 1
+                SELECT MIN(next_retry_at) AS next_retry_at FROM jobs
+                WHERE state = 'failed' AND next_retry_at IS NOT NULL
             """)
-            row = cursor.fetchone()
-            if row:
-                job = dict(row)
-                # Lock the job by updating state
-                cursor.execute("""
-                    UPDATE jobs SET state = 'processing' WHERE id = ?
-                """, (job['id'],))
-                conn.commit()
-                return job
-        return None
+            value = cursor.fetchone()['next_retry_at']
+        if value is None:
+            return None
+        return datetime.fromisoformat(value.rstrip("Z"))
+    
+    def release_jobs(self, worker_id: Optional[str], job_ids: List[str]):
+        """Return claimed but unstarted jobs to pending"""
+        now = datetime.utcnow().isoformat() + "Z"
+        with self._get_connection(immediate=True) as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(job_ids), MAX_SQL_VARIABLES):
+                chunk = job_ids[i:i + MAX_SQL_VARIABLES]
+                placeholders = ", ".join("?" * len(chunk))
+                # Only touch jobs this worker still holds
+                cursor.execute(f"""
+                    UPDATE jobs
+                    SET state = 'pending', worker_id = NULL, claimed_at = NULL, updated_at = ?
+                    WHERE state = 'processing' AND worker_id IS ? AND id IN ({placeholders})
+                """, [now, worker_id] + chunk)
     
     def list_jobs(self, state: Optional[str] = None) -> List[Dict]:
         """List jobs, optionally filtered by state"""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            if state:
-                cursor.execute("SELECT * FROM jobs WHERE state = ? ORDER BY created_at DESC", (state,))
-            else:
-                cursor.execute("SELECT * FROM jobs ORDER BY created_at DESC")
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+        return [job for job in self.iter_jobs(state)]
+    
+    def iter_jobs(self, state: Optional[str] = None, limit: Optional[int] = None,
+                  after: Optional[str] = None, since: Optional[str] = None,
+                  until: Optional[str] = None) -> Iterator[Dict]:
+        """Yield jobs newest first without loading the whole table
+        
+        Pagination is keyset-based: `after` is the id of the last job of the
+        previous page, and the next page starts right behind it in
+        (created_at, rowid) order, which the created_at indexes already provide.
+        `since`/`until` bound created_at as [since, until).
+        """
+        conditions = []
+        params = []
+        if state:
+            conditions.append("state = ?")
+            params.append(state)
+        if since:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until:
+            conditions.append("created_at < ?")
+            params.append(until)
+        
+        conn = self._connection()
+        if after is not None:
+            row = conn.execute("SELECT created_at, rowid FROM jobs WHERE id = ?", (after,)).fetchone()
+            if row is None:
+                raise ValueError(f"Job '{after}' not found")
+            conditions.append("(created_at < ? OR (created_at = ? AND rowid < ?))")
+            params.extend([row['created_at'], row['created_at'], row['rowid']])
+        
+        sql = "SELECT * FROM jobs"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY created_at DESC, rowid DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        
+        return self._iter_rows(conn.execute(sql, params))
+    
+    @staticmethod
+    def _iter_rows(cursor: sqlite3.Cursor) -> Iterator[Dict]:
+        """Pull rows from SQLite one at a time as the caller iterates"""
+        try:
+            for row in cursor:
+                yield dict(row)
+        finally:
+            cursor.close()
     
     def get_job_stats(self) -> Dict:
         """Get statistics about job states"""
+        # Maintained by triggers, so this is a handful of rows whatever the table size
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT state, COUNT(*) as count 
-                FROM jobs 
-                GROUP BY state
-            """)
+            cursor.execute("SELECT state, count FROM job_counts WHERE count != 0")
             rows = cursor.fetchall()
             stats = {row['state']: row['count'] for row in rows}
             return stats
     
+    def rebuild_job_counts(self) -> Dict:
+        """Recount jobs per state and return {state: (old, new)} for any that drifted"""
+        with self._get_connection(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT state, count FROM job_counts")
+            old = {row['state']: row['count'] for row in cursor.fetchall()}
+            cursor.execute("SELECT state, COUNT(*) AS count FROM jobs GROUP BY state")
+            new = {row['state']: row['count'] for row in cursor.fetchall()}
+            
+            cursor.execute("DELETE FROM job_counts")
+            cursor.executemany(
+                "INSERT INTO job_counts (state, count) VALUES (?, ?)", new.items()
+            )
+        
+        return {
+            state: (old.get(state, 0), new.get(state, 0))
+            for state in set(old) | set(new)
+            if old.get(state, 0) != new.get(state, 0)
+        }
+    
+    def purge_jobs(self, state: str, before: Optional[str] = None, keep: int = 0,
+                   batch_size: int = 1000, archive: Optional[str] = None) -> Dict[str, Any]:
+        """Delete or archive finished jobs of one state, first finished first
+        
+        Jobs finished before `before` are removed, sparing the `keep` of the
+        state that finished last. With archive='table' rows are copied to jobs_archive in this
+        database; any other archive value is the path of a separate SQLite file
+        that receives them. Each batch commits on its own, so workers are only
+        held off for one batch at a time. Returns {"removed", "log_paths"},
+        the latter listing spilled logs of deleted (not archived) jobs, which
+        the caller may remove.
+        """
+        conditions = ["state = ?"]
+        params = [state]
+        if before is not None:
+            conditions.append("completed_at < ?")
+            params.append(before)
+        where = " AND ".join(conditions)
+        
+        conn = self._connection()
+        remaining = None
+        if keep:
+            total = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE {where}", params).fetchone()[0]
+            remaining = max(0, total - keep)
+            if not remaining:
+                return {"removed": 0, "log_paths": []}
+        
+        schema = None
+        if archive is not None:
+            schema = "main" if archive == "table" else ARCHIVE_SCHEMA
+            if schema == ARCHIVE_SCHEMA:
+                # ATTACH is not allowed inside a transaction
+                conn.execute(f"ATTACH DATABASE ? AS {ARCHIVE_SCHEMA}", (archive,))
+        
+        try:
+            columns = None
+            if schema is not None:
+                columns = self._prepare_archive(conn, schema)
+            
+            removed = 0
+            log_paths = []
+            while remaining is None or remaining > 0:
+                limit = batch_size if remaining is None else min(batch_size, remaining)
+                # (state, completed_at) index walk, so `keep` spares the jobs
+                # that finished last; rowid keeps the order stable between the
+                # copy and the delete
+                batch = f"""
+                    SELECT rowid FROM jobs WHERE {where}
+                    ORDER BY completed_at, rowid LIMIT ?
+                """
+                with self._get_connection(immediate=True) as conn:
+                    cursor = conn.cursor()
+                    if columns is not None:
+                        column_list = ", ".join(columns)
+                        cursor.execute(f"""
+                            INSERT INTO {schema}.jobs_archive ({column_list}, archived_at)
+                            SELECT {column_list}, ? FROM jobs WHERE rowid IN ({batch})
+                        """, [datetime.utcnow().isoformat() + "Z"] + params + [limit])
+                    else:
+                        cursor.execute(f"""
+                            SELECT log_path FROM jobs
+                            WHERE rowid IN ({batch}) AND log_path IS NOT NULL
+                        """, params + [limit])
+                        log_paths.extend(row['log_path'] for row in cursor.fetchall())
+                    # The delete trigger keeps job_counts in step
+                    cursor.execute(f"DELETE FROM jobs WHERE rowid IN ({batch})", params + [limit])
+                    deleted = cursor.rowcount
+                
+                removed += deleted
+                if remaining is not None:
+                    remaining -= deleted
+                if deleted < limit:
+                    break
+        finally:
+            if schema == ARCHIVE_SCHEMA:
+                conn.execute(f"DETACH DATABASE {ARCHIVE_SCHEMA}")
+        
+        return {"removed": removed, "log_paths": log_paths}
+    
+    @staticmethod
+    def _prepare_archive(conn: sqlite3.Connection, schema: str) -> List[str]:
+        """Create or widen jobs_archive to match jobs; return the shared columns"""
+        columns = [
+            (row['name'], row['type'])
+            for row in conn.execute("PRAGMA main.table_info(jobs)").fetchall()
+        ]
+        definitions = ", ".join(f"{name} {type_}" for name, type_ in columns)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.jobs_archive (
+                {definitions},
+                archived_at TEXT NOT NULL
+            )
+        """)
+        # Columns added to jobs by later migrations
+        existing = {
+            row['name']
+            for row in conn.execute(f"PRAGMA {schema}.table_info(jobs_archive)").fetchall()
+        }
+        for name, type_ in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {schema}.jobs_archive ADD COLUMN {name} {type_}")
+        conn.commit()
+        return [name for name, _ in columns]
+    
+    def vacuum(self, pages: Optional[int] = None, convert: bool = False) -> Dict:
+        """Hand free pages back to the filesystem
+        
+        Runs an incremental vacuum of up to `pages` pages (all when None).
+        A database created before incremental auto-vacuum was enabled needs
+        one full VACUUM to switch over; that only happens with convert=True,
+        since it rewrites the whole file. Returns {"freed", "converted"}.
+        """
+        conn = self._connection()
+        before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        converted = False
+        
+        # 2 = INCREMENTAL
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not convert:
+                return {"freed": 0, "converted": False}
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+            converted = True
+        elif before:
+            # executescript steps the pragma to completion; execute() frees one page
+            count = "" if pages is None else f"({int(pages)})"
+            conn.executescript(f"PRAGMA incremental_vacuum{count}")
+        
+        after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return {"freed": before - after, "converted": converted}
+    
+    def get_attempt_stats(self, since: float, queue: Optional[str] = None) -> Dict:
+        """Throughput and latency percentiles of attempts finished since an epoch time
+        
+        Returns {"attempts", "outcomes": {outcome: n}, "workers", "first", "last",
+        "wait_time"/"start_delay"/"run_time": {"p50", "p95", "p99", "avg", "max"}}.
+        Percentiles are nearest-rank, read from one sort per metric.
+        """
+        where = "finished_at >= ?"
+        params = [since]
+        if queue is not None:
+            where += " AND queue = ?"
+            params.append(queue)
+        
+        conn = self._connection()
+        cursor = conn.execute(f"""
+            SELECT outcome, COUNT(*) AS count FROM job_attempts WHERE {where} GROUP BY outcome
+        """, params)
+        outcomes = {row['outcome']: row['count'] for row in cursor.fetchall()}
+        row = conn.execute(f"""
+            SELECT COUNT(DISTINCT worker_id) AS workers, MIN(finished_at) AS first,
+                   MAX(finished_at) AS last
+            FROM job_attempts WHERE {where}
+        """, params).fetchone()
+        stats = {
+            "attempts": sum(outcomes.values()),
+            "outcomes": outcomes,
+            "workers": row['workers'],
+            "first": row['first'],
+            "last": row['last']
+        }
+        
+        for metric in ("wait_time", "start_delay", "run_time"):
+            row = conn.execute(f"""
+                SELECT COUNT({metric}) AS n, AVG({metric}) AS avg, MAX({metric}) AS max
+                FROM job_attempts WHERE {where}
+            """, params).fetchone()
+            ranks = {name: max(1, math.ceil(fraction * row['n']))
+                     for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))}
+            values = {}
+            if row['n']:
+                cursor = conn.execute(f"""
+                    SELECT rank, value FROM (
+                        SELECT {metric} AS value, ROW_NUMBER() OVER (ORDER BY {metric}) AS rank
+                        FROM job_attempts WHERE {where} AND {metric} IS NOT NULL
+                    ) WHERE rank IN (?, ?, ?)
+                """, params + list(ranks.values()))
+                values = {ranked['rank']: ranked['value'] for ranked in cursor.fetchall()}
+            stats[metric] = {"avg": row['avg'], "max": row['max'],
+                             **{name: values.get(rank) for name, rank in ranks.items()}}
+        
+        return stats
+    
+    def get_load(self, since: float) -> Dict:
+        """Backlog and drain since an epoch time, cheap enough to poll
+        
+        Returns {"pending", "attempts": finished since `since`, "wait_time":
+        their average time from ready to claimed, or None}. Unlike
+        get_attempt_stats this reads one counter row and one index range.
+        """
+        conn = self._connection()
+        row = conn.execute("SELECT count FROM job_counts WHERE state = 'pending'").fetchone()
+        pending = row['count'] if row else 0
+        row = conn.execute("""
+            SELECT COUNT(*) AS attempts, AVG(wait_time) AS wait_time
+            FROM job_attempts WHERE finished_at >= ?
+        """, (since,)).fetchone()
+        return {"pending": pending, "attempts": row['attempts'], "wait_time": row['wait_time']}
+    
+    def purge_attempts(self, before: float, batch_size: int = 1000) -> int:
+        """Delete attempt records finished before an epoch time, in batches"""
+        removed = 0
+        while True:
+            with self._get_connection(immediate=True) as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM job_attempts WHERE id IN (
+                        SELECT id FROM job_attempts WHERE finished_at < ?
+                        ORDER BY finished_at LIMIT ?
+                    )
+                """, (before, batch_size))
+                deleted = cursor.rowcount
+            removed += deleted
+            if deleted < batch_size:
+                return removed
+    
     def get_config(self, key: str, default: str = None) -> str:
         """Get configuration value"""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT value FROM config WHERE key = ?", (key,))
-            row = cursor.fetchone()
-            if row:
-                return row['value']
-        return default
+        now = time.monotonic()
+        if self._config is None or now >= self._config_checked_at:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT value FROM config WHERE key = 'config_version'")
+                row = cursor.fetchone()
+                version = row['value'] if row else None
+                # Reload everything only when some process has changed the config
+                if self._config is None or version != self._config_version:
+                    cursor.execute("SELECT key, value FROM config")
+                    self._config = {row['key']: row['value'] for row in cursor.fetchall()}
+                    self._config_version = version
+            self._config_checked_at = now + CONFIG_CHECK_INTERVAL
+        return self._config.get(key, default)
     
     def set_config(self, key: str, value: str):
         """Set configuration value"""
@@ -186,7 +1108,13 @@ class Database:
             cursor.execute("""
                 INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)
             """, (key, value))
+            # Tell other processes their cached config is stale
+            cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES ('config_version', '0')")
+            cursor.execute("""
+                UPDATE config SET value = CAST(value AS INTEGER) + 1 WHERE key = 'config_version'
+            """)
             conn.commit()
+        self._config = None
     
     def register_worker(self, worker_id: str, pid: int):
         """Register a worker"""
@@ -198,17 +1126,33 @@ class Database:
                 VALUES (?, ?, ?, ?)
             """, (worker_id, pid, now, now))
             conn.commit()
+        self._registered[worker_id] = pid
     
     def update_worker_heartbeat(self, worker_id: str):
         """Update worker heartbeat"""
         now = datetime.utcnow().isoformat() + "Z"
+        if self._write_behind is not None:
+            self._write_behind.heartbeat(worker_id, now)
+            return
         with self._get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE workers SET last_heartbeat = ? WHERE worker_id = ?
-            """, (now, worker_id))
+            self._touch_worker(cursor, worker_id, now)
             conn.commit()
     
+    def _touch_worker(self, cursor: sqlite3.Cursor, worker_id: str, now: str):
+        """Refresh a heartbeat, restoring the row of a registered worker if it was reaped
+        
+        A worker that stalled past the lease loses its row; without it every
+        job the worker claims afterwards would be requeued while it runs.
+        """
+        cursor.execute("UPDATE workers SET last_heartbeat = ? WHERE worker_id = ?", (now, worker_id))
+        pid = self._registered.get(worker_id)
+        if cursor.rowcount == 0 and pid is not None:
+            cursor.execute("""
+                INSERT OR IGNORE INTO workers (worker_id, pid, started_at, last_heartbeat)
+                VALUES (?, ?, ?, ?)
+            """, (worker_id, pid, now, now))
+    
     def get_active_workers(self) -> List[Dict]:
         """Get list of active workers"""
         with self._get_connection() as conn:
@@ -219,8 +1163,62 @@ class Database:
     
     def remove_worker(self, worker_id: str):
         """Remove a worker"""
+        self._registered.pop(worker_id, None)
         with self._get_connection() as conn:
             cursor = conn.cursor()
             cursor.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
             conn.commit()
-
+    
+    def reap_stale_jobs(self, lease_timeout: float) -> Dict:
+        """Recover jobs held by workers whose heartbeat has expired
+        
+        A processing job's lease lasts as long as its worker keeps heartbeating.
+        Once the worker has been silent for lease_timeout seconds (or is gone from
+        the workers table), the job is counted as a failed attempt and returned
+        to pending, or moved to the DLQ if it has no retries left. Expired worker
+        rows are removed.
+        """
+        now = datetime.utcnow().isoformat() + "Z"
+        cutoff = (datetime.utcnow() - timedelta(seconds=lease_timeout)).isoformat() + "Z"
+        
+        # Jobs whose worker has no fresh heartbeat and that were not claimed just now
+        stale_jobs = """
+            state = 'processing'
+            AND COALESCE(claimed_at, updated_at) < :cutoff
+            AND (worker_id IS NULL OR worker_id NOT IN (
+                SELECT worker_id FROM workers WHERE last_heartbeat >= :cutoff
+            ))
+        """
+        params = {"now": now, "cutoff": cutoff, "error": "Worker lease expired"}
+        
+        # Cheap read first, so routine reaping does not take the write lock
+        conn = self._connection()
+        found_jobs = conn.execute(f"SELECT 1 FROM jobs WHERE {stale_jobs} LIMIT 1", params).fetchone()
+        found_workers = conn.execute(
+            "SELECT 1 FROM workers WHERE last_heartbeat < :cutoff LIMIT 1", params
+        ).fetchone()
+        if not found_jobs and not found_workers:
+            return {"requeued": 0, "dead": 0, "workers": 0}
+        
+        with self._get_connection(immediate=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                UPDATE jobs
+                SET state = 'dead', attempts = attempts + 1, error_message = :error,
+                    worker_id = NULL, claimed_at = NULL, completed_at = :now, updated_at = :now
+                WHERE {stale_jobs} AND attempts + 1 >= max_retries
+            """, params)
+            dead = cursor.rowcount
+            
+            cursor.execute(f"""
+                UPDATE jobs
+                SET state = 'pending', attempts = attempts + 1, error_message = :error,
+                    worker_id = NULL, claimed_at = NULL, updated_at = :now, queued_at = :now
+                WHERE {stale_jobs}
+            """, params)
+            requeued = cursor.rowcount
+            
+            cursor.execute("DELETE FROM workers WHERE last_heartbeat < :cutoff", params)
+            workers = cursor.rowcount
+        
+        return {"requeued": requeued, "dead": dead, "workers": workers}
@@ -0,0 +1,121 @@
+"""Resource limits and usage accounting for job processes"""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+from typing import Callable, Dict, Optional
+
+try:
+    import resource
+except ImportError:
+    # Windows: no rlimits, jobs only get the timeout
+    resource = None
+
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+# Seconds past the soft CPU limit (SIGXCPU) before the kernel sends SIGKILL
+CPU_KILL_GRACE = 5
+
+# Whether a job's limits have been reported as unsupported yet, so a queue
+# of limited jobs on Windows warns once rather than per job
+_warned_unsupported = False
+
+
+def child_setup(max_memory: Optional[int] = None, cpu_seconds: Optional[int] = None,
+                nice: Optional[int] = None) -> Optional[Callable[[], None]]:
+    """Build a preexec_fn applying a job's limits, or None if it has none
+    
+    preexec_fn forces a plain fork() and is not safe in general alongside
+    threads, so jobs without limits are spawned without one. The function
+    itself only makes system calls and allocates nothing. Where rlimits are
+    unavailable (Windows) the limits are ignored with a warning, since
+    Popen rejects preexec_fn there.
+    """
+    global _warned_unsupported
+    if max_memory is None and cpu_seconds is None and not nice:
+        return None
+    if os.name == "nt" or resource is None:
+        if not _warned_unsupported:
+            _warned_unsupported = True
+            print("Warning: max_memory, cpu_seconds and nice are not supported on this "
+                  "platform; jobs run with their timeout only", file=sys.stderr)
+        return None
+    
+    def apply_limits():
+        if max_memory is not None:
+            resource.setrlimit(resource.RLIMIT_AS, (max_memory, max_memory))
+        if cpu_seconds is not None:
+            resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + CPU_KILL_GRACE))
+        if nice:
+            os.nice(nice)
+    
+    return apply_limits
+
+
+def kill_group(process: subprocess.Popen):
+    """Kill a job and everything it started
+    
+    Jobs run in their own session, so their process group id is their pid.
+    """
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except OSError:
+        # Already exited
+        pass
+
+
+def wait_process(process: subprocess.Popen, timeout: float) -> Dict:
+    """Wait for a job process, killing its process group after timeout seconds
+    
+    Returns {"timed_out", "peak_rss", "cpu_time"}: peak resident memory in
+    bytes and user + system CPU seconds of the process and the children it
+    waited for, or None where wait4() is unavailable. Sets
+    process.returncode.
+    """
+    if not hasattr(os, "wait4"):
+        try:
+            process.wait(timeout=timeout)
+            return {"timed_out": False, "peak_rss": None, "cpu_time": None}
+        except subprocess.TimeoutExpired:
+            kill_group(process)
+            process.wait()
+            return {"timed_out": True, "peak_rss": None, "cpu_time": None}
+    
+    expired = threading.Event()
+    
+    def expire():
+        expired.set()
+        kill_group(process)
+    
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        # Reaping ourselves is what yields the rusage; Popen.wait() discards it
+        _, status, usage = os.wait4(process.pid, 0)
+    finally:
+        timer.cancel()
+    
+    process.returncode = _exit_code(status)
+    return {
+        "timed_out": expired.is_set(),
+        "peak_rss": usage.ru_maxrss * RSS_UNIT,
+        "cpu_time": round(usage.ru_utime + usage.ru_stime, 3)
+    }
+
+
+def _exit_code(status: int) -> int:
+    """Return code as Popen reports it: negative signal number if killed"""
+    if hasattr(os, "waitstatus_to_exitcode"):
+        return os.waitstatus_to_exitcode(status)
+    # Python < 3.9
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
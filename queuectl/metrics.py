@@ -0,0 +1,265 @@
+"""In-process metrics and an OpenMetrics HTTP exporter"""
+
+import copy
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Sequence
+
+
+# Upper bounds (seconds) of the default histogram buckets, +Inf is implied
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0, 60.0, 300.0)
+
+# Content type of the OpenMetrics text exposition format
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+class _Metric:
+    """Base for metrics keyed by a tuple of label values"""
+    
+    type = None
+    
+    def __init__(self, registry: "Registry", name: str, help_text: str, labelnames: Sequence[str]):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = registry._lock
+        self._values = {}
+    
+    def _key(self, labels: Dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def _snapshot(self) -> Dict:
+        return {
+            "type": self.type,
+            "help": self.help,
+            "labelnames": self.labelnames,
+            "values": copy.deepcopy(self._values)
+        }
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+    
+    type = "counter"
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+    
+    type = "gauge"
+    
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+    
+    type = "histogram"
+    
+    def __init__(self, registry: "Registry", name: str, help_text: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+    
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (not cumulative) counts, the last one for +Inf; then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+    
+    def _snapshot(self) -> Dict:
+        snapshot = super()._snapshot()
+        snapshot["buckets"] = self.buckets
+        return snapshot
+
+
+class Registry:
+    """Collection of metrics belonging to one process"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+    
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+    
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, help_text, labelnames))
+    
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, help_text, labelnames))
+    
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, help_text, labelnames, buckets))
+    
+    def snapshot(self) -> Dict:
+        """Picklable copy of every metric, cumulative since the process started"""
+        with self._lock:
+            return {name: metric._snapshot() for name, metric in self._metrics.items()}
+
+
+# Metrics of the current process; workers ship snapshots of it to the exporter
+REGISTRY = Registry()
+
+
+def merge_snapshots(snapshots: Iterable[Dict]) -> Dict:
+    """Add up snapshots from several processes, label set by label set"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                merged[name] = copy.deepcopy(metric)
+                continue
+            for key, value in metric["values"].items():
+                current = target["values"].get(key)
+                if current is None:
+                    target["values"][key] = copy.deepcopy(value)
+                elif metric["type"] == "histogram":
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+                else:
+                    target["values"][key] = current + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def render(snapshot: Dict) -> str:
+    """Format a snapshot in the OpenMetrics text format"""
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        names = metric["labelnames"]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key in sorted(metric["values"]):
+            value = metric["values"][key]
+            if metric["type"] == "counter":
+                lines.append(f"{name}_total{_labels(names, key)} {_number(value)}")
+            elif metric["type"] == "gauge":
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+            else:
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="' + _number(bound) + '"'
+                    lines.append(f"{name}_bucket{_labels(names, key, le)} {cumulative}")
+                lines.append(f"{name}_sum{_labels(names, key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(names, key)} {cumulative}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def database_snapshot(db) -> Dict:
+    """Gauges read at scrape time from the small job_counts and workers tables"""
+    registry = Registry()
+    jobs = registry.gauge("queuectl_jobs", "Jobs currently in each state", ["state"])
+    for state in ("pending", "processing", "failed", "completed", "dead"):
+        jobs.set(0, state=state)
+    for state, count in db.get_job_stats().items():
+        jobs.set(count, state=state)
+    
+    workers = db.get_active_workers()
+    registry.gauge("queuectl_workers", "Registered workers").set(len(workers))
+    age = registry.gauge("queuectl_worker_heartbeat_age_seconds",
+                         "Seconds since each worker last heartbeated", ["worker"])
+    now = time.time()
+    for worker in workers:
+        last = _epoch(worker['last_heartbeat'])
+        age.set(round(max(0.0, now - last), 3), worker=worker['worker_id'])
+    return registry.snapshot()
+
+
+def _epoch(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
+
+
+class MetricsServer:
+    """Serve OpenMetrics text at /metrics from a background thread
+    
+    collect() is called on every scrape and returns the exposition text.
+    Port 0 picks a free port, available as .port once started.
+    """
+    
+    def __init__(self, collect: Callable[[], str], port: int = 0, host: str = "127.0.0.1"):
+        self.collect = collect
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+    
+    def start(self):
+        # Imported here: every CLI invocation loads this module, few serve HTTP
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        
+        collect = self.collect
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                try:
+                    body = collect().encode()
+                except Exception as e:
+                    self.send_error(500, str(e))
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                # Scrapes every few seconds would flood the terminal
+                pass
+        
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
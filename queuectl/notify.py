@@ -0,0 +1,161 @@
+"""Local wakeup notifications from enqueue to idle workers"""
+
+import hashlib
+import os
+import select
+import socket
+import stat
+import sys
+import tempfile
+import threading
+
+
+# Unix datagram sockets are not available on Windows; workers fall back to polling
+SUPPORTED = hasattr(socket, "AF_UNIX") and os.name != "nt"
+
+
+def socket_dir(db_path: str) -> str:
+    """Directory holding the wakeup sockets for a database
+    
+    Derived from the absolute database path and kept under the temp dir, so
+    the socket paths stay short enough for AF_UNIX.
+    """
+    digest = hashlib.sha1(os.path.abspath(db_path).encode()).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"queuectl-{digest}")
+
+
+def private_dir(directory: str, create: bool = False) -> bool:
+    """Whether directory belongs to this user alone, creating it first if asked
+    
+    The socket paths are predictable: another local user who created the
+    directory first would receive every wakeup and enqueue sent into it. It
+    is only used if it is a real directory owned by this user with mode 0700.
+    """
+    if create:
+        try:
+            os.mkdir(directory, 0o700)
+        except OSError:
+            # Most likely it exists already; the checks below decide
+            pass
+    try:
+        st = os.lstat(directory)
+    except OSError:
+        return False
+    return (stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid()
+            and stat.S_IMODE(st.st_mode) == 0o700)
+
+
+def server_address(db_path: str) -> str:
+    """Stream socket of `queuectl serve` for a database
+    
+    Named without the .sock suffix so notify_workers() does not take it for
+    a worker.
+    """
+    return os.path.join(socket_dir(db_path), "serve.socket")
+
+
+class WakeupListener:
+    """Socket an idle worker blocks on until new work is announced"""
+    
+    def __init__(self, db_path: str, name: str):
+        self.path = None
+        self.sock = None
+        # In-process wakeups (shutdown, finished jobs) when sockets are unavailable
+        self._event = threading.Event()
+        if not SUPPORTED:
+            return
+        
+        directory = socket_dir(db_path)
+        if not private_dir(directory, create=True):
+            print(f"Not listening for wakeups: {directory} is not private to this user "
+                  f"(owner and mode 0700); polling instead", file=sys.stderr)
+            return
+        self.path = os.path.join(directory, f"{name}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        self.sock.setblocking(False)
+    
+    def wait(self, timeout: float) -> bool:
+        """Block for up to timeout seconds; True if a wakeup arrived"""
+        if self.sock is None:
+            woken = self._event.wait(timeout)
+            self._event.clear()
+            return woken
+        
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        
+        # Several enqueues may have piled up; one poll of the queue covers them all
+        while True:
+            try:
+                self.sock.recv(16)
+            except OSError:
+                # BlockingIOError once the socket is drained
+                break
+        return True
+    
+    def wake(self):
+        """Interrupt a wait() in progress, e.g. on shutdown"""
+        if self.path is not None:
+            _send(self.path)
+        else:
+            self._event.set()
+    
+    def close(self):
+        """Close the socket and remove it from the directory"""
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+def _send(path: str) -> bool:
+    """Send a wakeup datagram; False if nobody is listening on path"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.setblocking(False)
+        sock.sendto(b"\0", path)
+    except BlockingIOError:
+        # Receive buffer is full, so a wakeup is already pending
+        pass
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    except OSError:
+        pass
+    finally:
+        sock.close()
+    return True
+
+
+def notify_workers(db_path: str):
+    """Wake every idle worker listening on this database"""
+    if not SUPPORTED:
+        return
+    
+    directory = socket_dir(db_path)
+    if not private_dir(directory):
+        return
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    
+    for name in names:
+        if not name.endswith(".sock"):
+            continue
+        path = os.path.join(directory, name)
+        if not _send(path):
+            # Left behind by a worker that was killed; clean it up
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
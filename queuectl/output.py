@@ -0,0 +1,131 @@
+"""Bounded capture of job output with spill-to-file logs"""
+
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import threading
+from typing import Optional
+
+
+# Bytes of output kept in memory per job, and stored in jobs.output_tail.
+# Output that fits is never written to disk; anything larger spills to a log file.
+OUTPUT_TAIL_BYTES = 4096
+
+# Bytes read from a pipe at a time
+READ_CHUNK_BYTES = 65536
+
+# Seconds to wait for the readers once the command has exited; a background
+# process that inherited the pipes could otherwise hold them open forever
+READER_JOIN_TIMEOUT = 5.0
+
+
+def log_file_path(log_dir: str, job_id: str) -> str:
+    """Path of the (uncompressed) log file for a job"""
+    name = re.sub(r"[^A-Za-z0-9._-]", "_", job_id)
+    if name != job_id:
+        # Keep ids that sanitize to the same name apart
+        name += "-" + hashlib.sha1(job_id.encode()).hexdigest()[:8]
+    return os.path.join(log_dir, f"{name}.log")
+
+
+class _Tail:
+    """Ring buffer holding the last `size` bytes written to it"""
+    
+    def __init__(self, size: int):
+        self.size = size
+        self.data = bytearray()
+    
+    def write(self, chunk: bytes):
+        self.data += chunk[-self.size:]
+        if len(self.data) > self.size:
+            del self.data[:len(self.data) - self.size]
+    
+    def text(self) -> str:
+        return self.data.decode("utf-8", errors="replace")
+
+
+class OutputCapture:
+    """Drain a command's stdout and stderr on reader threads
+    
+    Memory stays bounded by the tail buffers whatever the command prints.
+    Output is held in memory until it outgrows OUTPUT_TAIL_BYTES, then the
+    whole stream (both pipes, interleaved as read) is written to log_path.
+    """
+    
+    def __init__(self, log_path: str, compress: bool = False, tail_bytes: int = OUTPUT_TAIL_BYTES):
+        self.live_path = log_path
+        self.compress = compress
+        self.tail_bytes = tail_bytes
+        self.tail = _Tail(tail_bytes)
+        self.stderr_tail = _Tail(tail_bytes)
+        # Everything read so far, until the first spill
+        self._head = bytearray()
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._threads = []
+    
+    def start(self, stdout, stderr):
+        """Start one reader thread per pipe"""
+        for stream, is_stderr in ((stdout, False), (stderr, True)):
+            thread = threading.Thread(target=self._drain, args=(stream, is_stderr), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+    
+    def _drain(self, stream, is_stderr: bool):
+        """Copy one pipe into the buffers until EOF"""
+        try:
+            while True:
+                chunk = stream.read1(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                self._write(chunk, is_stderr)
+        except (OSError, ValueError):
+            # Pipe closed underneath us after a timeout
+            pass
+        finally:
+            stream.close()
+    
+    def _write(self, chunk: bytes, is_stderr: bool):
+        with self._lock:
+            if self._closed:
+                # A reader outlived finish(); drop what it still gets
+                return
+            self.tail.write(chunk)
+            if is_stderr:
+                self.stderr_tail.write(chunk)
+            
+            if self._file is not None:
+                self._file.write(chunk)
+                return
+            
+            self._head += chunk
+            if len(self._head) > self.tail_bytes:
+                os.makedirs(os.path.dirname(self.live_path) or ".", exist_ok=True)
+                self._file = open(self.live_path, "wb")
+                self._file.write(self._head)
+                self._head = None
+    
+    def finish(self) -> Optional[str]:
+        """Wait for the readers and close the log; return its path, or None if nothing spilled"""
+        for thread in self._threads:
+            thread.join(timeout=READER_JOIN_TIMEOUT)
+        
+        with self._lock:
+            self._closed = True
+            if self._file is None:
+                return None
+            self._file.close()
+            self._file = None
+            
+            if not self.compress:
+                return self.live_path
+            
+            # Written plain while running so `logs --follow` can read it
+            path = self.live_path + ".gz"
+            with open(self.live_path, "rb") as src, gzip.open(path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.unlink(self.live_path)
+            return path
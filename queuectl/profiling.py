@@ -0,0 +1,235 @@
+"""Opt-in profiling of the Database layer and of worker processes
+
+Nothing here is active unless a profiler is attached: a Database without
+one runs no trace callback and no method wrappers.
+"""
+
+import cProfile
+import json
+import pstats
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, TextIO
+
+
+# Statements and calls kept in the report, slowest total first
+REPORT_TOP = 50
+
+# From Python 3.12 cProfile runs on sys.monitoring: one enabled profiler sees
+# every thread, and enabling a second one raises ValueError
+PROFILER_SEES_ALL_THREADS = sys.version_info >= (3, 12)
+
+# Literals replaced by ? so that statements differing only in values aggregate
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?(?![\w.])", re.IGNORECASE)
+_PLACEHOLDER_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """Collapse whitespace and literals: "IN ('a', 'b')" -> "IN (?, ...)" """
+    text = _STRING_LITERAL.sub("?", statement)
+    text = _NUMBER_LITERAL.sub("?", text)
+    text = _PLACEHOLDER_LIST.sub("?, ...", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class _Timings:
+    """Call count, total and max seconds per key"""
+    
+    def __init__(self):
+        self.values = {}
+    
+    def add(self, key: str, seconds: float):
+        entry = self.values.get(key)
+        if entry is None:
+            self.values[key] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+    
+    def summary(self, key_name: str, top: int = REPORT_TOP) -> List[Dict]:
+        rows = sorted(self.values.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        return [{
+            key_name: key,
+            "calls": calls,
+            "total": round(total, 6),
+            "avg": round(total / calls, 6),
+            "max": round(longest, 6)
+        } for key, (calls, total, longest) in rows]
+
+
+class DatabaseProfiler:
+    """Time Database methods, SQL statements and write-lock waits
+    
+    Statements are timed with sqlite3 trace callbacks: a statement runs from
+    its trace event until the next one on the same connection or until the
+    Database method that issued it returns, so its time includes stepping
+    through its rows and any wait in SQLite's busy handler. Triggers and the
+    implicit BEGIN/COMMIT show up as statements of their own.
+    
+    Statements slower than slow_statement_ms and methods slower than
+    slow_call_ms are written to slow_log as they happen.
+    """
+    
+    def __init__(self, slow_statement_ms: Optional[float] = None,
+                 slow_call_ms: Optional[float] = None, slow_log: Optional[TextIO] = None):
+        self.slow_statement = slow_statement_ms / 1000.0 if slow_statement_ms is not None else None
+        self.slow_call = slow_call_ms / 1000.0 if slow_call_ms is not None else None
+        self.slow_log = slow_log or sys.stderr
+        self.methods = _Timings()
+        self.statements = _Timings()
+        self.lock_waits = _Timings()
+        self.slow = 0
+        self._lock = threading.Lock()
+        # Statement currently open on this thread's connection: (sql, started)
+        self._local = threading.local()
+    
+    def instrument(self, db) -> "DatabaseProfiler":
+        """Start profiling a Database: wrap its public methods and trace its connections"""
+        db.profiler = self
+        for name in dir(type(db)):
+            if name.startswith("_"):
+                continue
+            method = getattr(db, name)
+            if callable(method):
+                setattr(db, name, self._wrap(name, method))
+        # Connections opened before now have no trace callback yet
+        db.close()
+        return self
+    
+    def _wrap(self, name: str, method: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self._close_statement()
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    self.methods.add(name, elapsed)
+                if self.slow_call is not None and elapsed >= self.slow_call:
+                    self._log_slow("call", elapsed, name)
+        
+        timed.__name__ = name
+        timed.__doc__ = method.__doc__
+        return timed
+    
+    def attach(self, conn):
+        """Trace the statements run on a new connection"""
+        conn.set_trace_callback(self._trace)
+    
+    def _trace(self, statement: str):
+        now = time.perf_counter()
+        self._close_statement(now)
+        self._local.current = (statement, now)
+    
+    def _close_statement(self, now: Optional[float] = None):
+        current = getattr(self._local, "current", None)
+        if current is None:
+            return
+        self._local.current = None
+        statement, started = current
+        elapsed = (now or time.perf_counter()) - started
+        with self._lock:
+            self.statements.add(normalize_sql(statement), elapsed)
+        if self.slow_statement is not None and elapsed >= self.slow_statement:
+            # The expanded statement, with its parameter values
+            self._log_slow("statement", elapsed, _WHITESPACE.sub(" ", statement).strip())
+    
+    def lock_wait(self, seconds: float):
+        """Record time spent in BEGIN IMMEDIATE waiting for the write lock"""
+        with self._lock:
+            self.lock_waits.add("BEGIN IMMEDIATE", seconds)
+    
+    def _log_slow(self, kind: str, seconds: float, text: str):
+        line = f"{datetime.utcnow().isoformat()}Z slow {kind} {seconds * 1000:.1f}ms {text}\n"
+        with self._lock:
+            self.slow += 1
+            try:
+                self.slow_log.write(line)
+                self.slow_log.flush()
+            except (OSError, ValueError):
+                # Log closed while stopping
+                pass
+    
+    def report(self) -> Dict:
+        """Aggregated timings, in seconds, slowest total first"""
+        with self._lock:
+            waits = self.lock_waits.values.get("BEGIN IMMEDIATE", [0, 0.0, 0.0])
+            return {
+                "methods": self.methods.summary("method"),
+                "statements": self.statements.summary("sql"),
+                "lock_wait": {"count": waits[0], "total": round(waits[1], 6), "max": round(waits[2], 6)},
+                "slow": self.slow
+            }
+    
+    def dump(self, path: str):
+        """Write report() to a JSON file"""
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+class ThreadProfiles:
+    """cProfile for a multi-threaded process
+    
+    Before Python 3.12 cProfile only sees the thread that enabled it, so
+    every thread to be profiled calls start() (or runs through run()); dump()
+    merges them into one pstats file. From 3.12 the first profiler covers
+    every thread and later start() calls add nothing.
+    """
+    
+    def __init__(self):
+        self._profiles = []
+        self._lock = threading.Lock()
+    
+    def start(self) -> Optional[cProfile.Profile]:
+        """Profile the calling thread from now on
+        
+        Returns None if the thread is already covered, or if another tool
+        (a debugger, coverage) holds the profiler hook; profiling never stops
+        the caller.
+        """
+        with self._lock:
+            if PROFILER_SEES_ALL_THREADS and self._profiles:
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                print(f"Not profiling thread {threading.current_thread().name}: {e}",
+                      file=sys.stderr)
+                return None
+            self._profiles.append(profile)
+        return profile
+    
+    def run(self, fn: Callable, *args, **kwargs):
+        """Call fn in the current thread under a profiler"""
+        profile = self.start()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+    
+    def dump(self, path: str):
+        """Stop all profilers and write the merged stats (load with pstats.Stats(path))"""
+        with self._lock:
+            profiles = list(self._profiles)
+        for profile in profiles:
+            profile.disable()
+        stats = None
+        for profile in profiles:
+            profile.create_stats()
+            if not profile.stats:
+                continue
+            if stats is None:
+                stats = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+        if stats is not None:
+            stats.dump_stats(path)
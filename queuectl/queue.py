@@ -1,11 +1,104 @@
 """Job queue manager with state management and retry logic"""
 
+import codecs
+import gzip
+import math
+import signal
+import sqlite3
 import subprocess
 import time
 import os
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Iterable, Iterator, List, Tuple
 from .database import Database
+from .notify import notify_workers
+from .output import OutputCapture, log_file_path
+from .limits import child_setup, wait_process
+from .metrics import REGISTRY
+
+
+# Seconds between re-reading the earliest retry deadline, which picks up
+# retries scheduled by other workers
+RETRY_REFRESH_INTERVAL = 1.0
+
+# Jobs deleted or archived per gc transaction
+GC_BATCH_SIZE = 1000
+
+# Seconds between checks for new output in `logs --follow`
+LOG_FOLLOW_INTERVAL = 0.5
+
+# In-process telemetry, exported by `worker start --metrics-port`
+JOBS_CLAIMED = REGISTRY.counter("queuectl_jobs_claimed", "Jobs claimed by workers")
+CLAIM_SECONDS = REGISTRY.histogram("queuectl_claim_seconds", "Duration of a claim round-trip")
+JOB_ATTEMPTS = REGISTRY.counter(
+    "queuectl_job_attempts", "Job attempts finished, by outcome (failed = retry scheduled, dead = DLQ)",
+    ["outcome"]
+)
+JOB_WAIT = REGISTRY.histogram("queuectl_job_wait_seconds", "Time jobs waited between ready and claimed")
+JOB_DURATION = REGISTRY.histogram("queuectl_job_duration_seconds", "Job run time, by outcome", ["outcome"])
+
+# Suffixes accepted by parse_duration, in seconds
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+# Suffixes accepted by parse_size, in bytes
+SIZE_UNITS = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+# Optional per-job resource limits accepted in the job JSON
+LIMIT_FIELDS = ("timeout", "max_memory", "cpu_seconds", "nice")
+
+
+def parse_duration(value: str) -> float:
+    """Parse '90', '30s', '15m', '6h', '7d' or '2w' into seconds"""
+    text = str(value).strip().lower()
+    unit = DURATION_UNITS.get(text[-1:]) if text else None
+    try:
+        seconds = float(text[:-1]) * unit if unit else float(text)
+    except ValueError:
+        raise ValueError(f"Invalid duration '{value}' (e.g. 90, 30s, 15m, 6h, 7d)")
+    if seconds < 0:
+        raise ValueError(f"Invalid duration '{value}': must not be negative")
+    return seconds
+
+
+def parse_size(value) -> int:
+    """Parse 1048576, '512K', '256M' or '2G' (also '2GB') into bytes"""
+    text = str(value).strip().lower().rstrip("b")
+    unit = SIZE_UNITS.get(text[-1:]) if text else None
+    try:
+        size = int(float(text[:-1]) * unit) if unit else int(text)
+    except ValueError:
+        raise ValueError(f"Invalid size '{value}' (e.g. 1048576, 512M, 2G)")
+    if size <= 0:
+        raise ValueError(f"Invalid size '{value}': must be positive")
+    return size
+
+
+def parse_limits(job: Dict) -> Dict:
+    """Validate the resource limits of a job dict; unset limits are None"""
+    limits = dict.fromkeys(LIMIT_FIELDS)
+    if job.get('timeout') is not None:
+        limits['timeout'] = parse_duration(job['timeout'])
+        if not limits['timeout']:
+            raise ValueError("'timeout' must be positive")
+    if job.get('max_memory') is not None:
+        limits['max_memory'] = parse_size(job['max_memory'])
+    if job.get('cpu_seconds') is not None:
+        # RLIMIT_CPU counts whole seconds
+        limits['cpu_seconds'] = math.ceil(parse_duration(job['cpu_seconds']))
+        if not limits['cpu_seconds']:
+            raise ValueError("'cpu_seconds' must be positive")
+    if job.get('nice') is not None:
+        if not isinstance(job['nice'], int) or not -20 <= job['nice'] <= 19:
+            raise ValueError("'nice' must be an integer from -20 to 19")
+        limits['nice'] = job['nice']
+    return limits
+
+
+def _epoch(timestamp: Optional[str]) -> Optional[float]:
+    """Convert a stored UTC timestamp ('...Z') to epoch seconds"""
+    if not timestamp:
+        return None
+    return datetime.fromisoformat(timestamp.rstrip("Z")).replace(tzinfo=timezone.utc).timestamp()
 
 
 class JobQueue:
@@ -13,72 +106,355 @@ class JobQueue:
     
     def __init__(self, db_path: str = "queuectl.db"):
         self.db = Database(db_path)
+        # Earliest known next_retry_at among failed jobs (UTC), None if none
+        self._next_retry = None
+        self._retry_refresh_at = 0.0
     
-    def enqueue(self, job_id: str, command: str, max_retries: Optional[int] = None) -> Dict:
-        """Enqueue a new job"""
+    def enqueue(self, job_id: str, command: str, max_retries: Optional[int] = None,
+                priority: int = 0, queue: str = "default",
+                limits: Optional[Dict] = None) -> Dict:
+        """Enqueue a new job
+        
+        limits may set any of LIMIT_FIELDS; invalid values raise ValueError.
+        """
+        if not isinstance(command, str):
+            raise ValueError(f"Job '{job_id}': 'command' must be a string")
         if max_retries is None:
             max_retries = int(self.db.get_config("max_retries", "3"))
+        limits = parse_limits(limits or {})
         
-        # Check if job already exists
-        existing = self.db.get_job(job_id)
-        if existing:
+        # The primary key rejects duplicates, no need for a separate lookup
+        try:
+            job = self.db.create_job(job_id, command, max_retries, priority, queue, limits)
+        except sqlite3.IntegrityError:
             raise ValueError(f"Job with id '{job_id}' already exists")
         
-        return self.db.create_job(job_id, command, max_retries)
+        notify_workers(self.db.db_path)
+        return job
     
-    def get_next_job(self) -> Optional[Dict]:
-        """Get next job to process"""
-        return self.db.get_pending_job()
+    def enqueue_many(self, jobs: Iterable[Dict]) -> Dict:
+        """Enqueue a batch of jobs in a single transaction
+        
+        Invalid jobs and duplicate ids are reported rather than raised, so one
+        bad entry does not abort the rest of the batch.
+        """
+        valid, errors = self.prepare_jobs(jobs)
+        duplicates = self.db.create_jobs(valid) if valid else []
+        enqueued = len(valid) - len(duplicates)
+        if enqueued:
+            notify_workers(self.db.db_path)
+        
+        return {
+            "enqueued": enqueued,
+            "duplicates": duplicates,
+            "errors": errors
+        }
+    
+    def prepare_jobs(self, jobs: Iterable[Dict]) -> Tuple[List[Dict], List[Tuple]]:
+        """Validate job dicts and fill in defaults for create_jobs()
+        
+        Returns the normalized jobs and (id, message) for each invalid one.
+        """
+        default_max_retries = None
+        valid = []
+        errors = []
+        
+        for job in jobs:
+            if not isinstance(job, dict) or not job.get('id') or not job.get('command'):
+                errors.append((job.get('id') if isinstance(job, dict) else None,
+                               "'id' and 'command' are required fields"))
+                continue
+            if not isinstance(job['command'], str):
+                errors.append((job['id'], "'command' must be a string"))
+                continue
+            
+            max_retries = job.get('max_retries')
+            if max_retries is None:
+                if default_max_retries is None:
+                    default_max_retries = int(self.db.get_config("max_retries", "3"))
+                max_retries = default_max_retries
+            
+            try:
+                max_retries = int(max_retries)
+            except (TypeError, ValueError):
+                errors.append((job['id'], "'max_retries' must be an integer"))
+                continue
+            
+            priority = job.get('priority')
+            if priority is None:
+                priority = 0
+            if not isinstance(priority, int) or isinstance(priority, bool):
+                errors.append((job['id'], "'priority' must be an integer"))
+                continue
+            
+            queue = job.get('queue') or "default"
+            if not isinstance(queue, str):
+                errors.append((job['id'], "'queue' must be a string"))
+                continue
+            
+            try:
+                limits = parse_limits(job)
+            except ValueError as e:
+                errors.append((job['id'], str(e)))
+                continue
+            
+            valid.append({
+                "id": str(job['id']),
+                "command": job['command'],
+                "max_retries": max_retries,
+                "priority": priority,
+                "queue": queue,
+                **limits
+            })
+        
+        return valid, errors
+    
+    def get_next_job(self, worker_id: Optional[str] = None) -> Optional[Dict]:
+        """Claim the next job to process"""
+        self._schedule_retries()
+        return self.db.get_pending_job(worker_id)
+    
+    def get_next_jobs(self, worker_id: Optional[str], limit: int,
+                      queues: Optional[List[str]] = None) -> List[Dict]:
+        """Claim up to `limit` jobs in one round-trip
+        
+        With `queues`, they are drained in the given order: later queues only
+        fill whatever the earlier ones could not.
+        """
+        self._schedule_retries()
+        started = time.perf_counter()
+        if not queues:
+            jobs = self.db.claim_jobs(worker_id, limit)
+        else:
+            jobs = []
+            for queue in queues:
+                jobs.extend(self.db.claim_jobs(worker_id, limit - len(jobs), queue))
+                if len(jobs) >= limit:
+                    break
+        
+        CLAIM_SECONDS.observe(time.perf_counter() - started)
+        if jobs:
+            JOBS_CLAIMED.inc(len(jobs))
+        return jobs
+    
+    def _schedule_retries(self):
+        """Promote failed jobs to pending once their backoff has elapsed
+        
+        The earliest retry deadline is kept in memory and refreshed with a
+        cheap indexed read, so the promoting UPDATE only runs when a retry is
+        actually due rather than on every poll.
+        """
+        now = time.monotonic()
+        if now >= self._retry_refresh_at:
+            self._next_retry = self.db.get_next_retry_time()
+            self._retry_refresh_at = now + RETRY_REFRESH_INTERVAL
+        
+        if self._next_retry is not None and self._next_retry <= datetime.utcnow():
+            self.db.promote_due_retries()
+            self._next_retry = self.db.get_next_retry_time()
+    
+    def next_retry_delay(self) -> Optional[float]:
+        """Seconds until the earliest known retry is due, None if none is scheduled"""
+        if self._next_retry is None:
+            return None
+        return max(0.0, (self._next_retry - datetime.utcnow()).total_seconds())
+    
+    def release_jobs(self, worker_id: Optional[str], job_ids: List[str]):
+        """Hand claimed jobs that were never started back to the queue"""
+        if job_ids:
+            self.db.release_jobs(worker_id, job_ids)
+            notify_workers(self.db.db_path)
     
     def execute_job(self, job: Dict) -> bool:
         """Execute a job and return True if successful"""
         job_id = job['id']
         command = job['command']
         
+        # Output is streamed into bounded buffers rather than held in memory whole
+        capture = OutputCapture(
+            log_file_path(self.log_dir(), job_id),
+            compress=self.db.get_config("log_compress", "false") == "true"
+        )
+        started_at = time.time()
         try:
-            # Execute the command
-            result = subprocess.run(
+            # A session of its own lets a timeout kill the job's whole process tree
+            process = subprocess.Popen(
                 command,
                 shell=True,
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minute timeout
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=os.name == "posix",
+                preexec_fn=child_setup(job.get('max_memory'), job.get('cpu_seconds'), job.get('nice'))
             )
-            
-            if result.returncode == 0:
-                # Success
-                self.db.update_job(
-                    job_id,
-                    state="completed",
-                    completed_at=datetime.utcnow().isoformat() + "Z"
-                )
-                return True
-            else:
-                # Failure
-                self._handle_job_failure(job, result.stderr or result.stdout or "Command failed")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            self._handle_job_failure(job, "Command execution timed out")
+        except Exception as e:
+            self._handle_job_failure(job, str(e))
             return False
+        
+        capture.start(process.stdout, process.stderr)
+        timeout = job.get('timeout') or float(self.db.get_config("job_timeout", "300"))
+        usage = wait_process(process, timeout)
+        finished_at = time.time()
+        
+        try:
+            fields = self._finish_output(job, capture)
         except Exception as e:
             self._handle_job_failure(job, str(e))
             return False
+        fields['peak_rss'] = usage['peak_rss']
+        fields['cpu_time'] = usage['cpu_time']
+        fields['attempt'] = self._attempt_timing(job, started_at, finished_at, process.returncode)
+        
+        if usage['timed_out']:
+            self._handle_job_failure(job, f"Command execution timed out after {timeout:g}s", **fields)
+            return False
+        
+        if process.returncode == 0:
+            # Success
+            self.db.update_job(
+                job_id,
+                owner=job.get('worker_id'),
+                state="completed",
+                completed_at=datetime.utcnow().isoformat() + "Z",
+                **fields
+            )
+            self._observe_attempt(fields['attempt'])
+            return True
+        else:
+            # Failure
+            error = capture.stderr_tail.text() or capture.tail.text()
+            if not error and process.returncode < 0:
+                # e.g. SIGXCPU from the cpu_seconds limit
+                error = f"Command killed by {signal.Signals(-process.returncode).name}"
+            self._handle_job_failure(job, error or "Command failed", **fields)
+            return False
+    
+    @staticmethod
+    def _attempt_timing(job: Dict, started_at: float, finished_at: float,
+                        exit_code: Optional[int]) -> Dict:
+        """job_attempts row for this run; the outcome is filled in once it is known"""
+        queued_at = _epoch(job.get('queued_at') or job['created_at'])
+        claimed_at = _epoch(job.get('claimed_at'))
+        return {
+            "attempt": job['attempts'] + 1,
+            "worker_id": job.get('worker_id'),
+            "queue": job.get('queue'),
+            "outcome": "completed",
+            "exit_code": exit_code,
+            "queued_at": queued_at,
+            "claimed_at": claimed_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+            "wait_time": claimed_at - queued_at if claimed_at is not None else None,
+            "start_delay": started_at - claimed_at if claimed_at is not None else None,
+            "run_time": finished_at - started_at
+        }
+    
+    @staticmethod
+    def _observe_attempt(attempt: Dict):
+        """Count a finished attempt in the in-process metrics"""
+        JOB_ATTEMPTS.inc(outcome=attempt['outcome'])
+        JOB_DURATION.observe(attempt['run_time'], outcome=attempt['outcome'])
+        if attempt['wait_time'] is not None:
+            JOB_WAIT.observe(attempt['wait_time'])
+    
+    @staticmethod
+    def _finish_output(job: Dict, capture: OutputCapture) -> Dict:
+        """Close the capture and return the output columns for the job row"""
+        log_path = capture.finish()
+        # A log left by an earlier attempt would no longer match this one
+        previous = job.get('log_path')
+        if previous and previous != log_path:
+            try:
+                os.unlink(previous)
+            except OSError:
+                pass
+        return {"output_tail": capture.tail.text(), "log_path": log_path}
+    
+    def log_dir(self) -> str:
+        """Directory for spilled job logs: config log_dir, or <db name>-logs beside the database"""
+        log_dir = self.db.get_config("log_dir")
+        if log_dir:
+            return log_dir
+        return os.path.splitext(self.db.db_path)[0] + "-logs"
+    
+    def iter_log(self, job_id: str, follow: bool = False) -> Iterator[str]:
+        """Yield a job's output: the full log if it spilled, otherwise its tail
+        
+        With follow, output of a running job is streamed as the worker writes
+        it (once it has outgrown the in-memory tail), until the job finishes.
+        Raises ValueError if the job does not exist.
+        """
+        if self.db.get_job(job_id) is None:
+            raise ValueError(f"Job '{job_id}' not found")
+        return self._follow_log(job_id, follow)
+    
+    def _follow_log(self, job_id: str, follow: bool) -> Iterator[str]:
+        live_path = log_file_path(self.log_dir(), job_id)
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        offset = 0
+        
+        while True:
+            job = self.db.get_job(job_id)
+            if job is None:
+                return
+            
+            if job['state'] not in ("pending", "processing"):
+                # Finished: read the stored log, skipping what was already shown
+                path = job.get('log_path')
+                if path and os.path.exists(path):
+                    opener = gzip.open if path.endswith(".gz") else open
+                    with opener(path, "rb") as f:
+                        f.seek(offset)
+                        while True:
+                            chunk = f.read(65536)
+                            if not chunk:
+                                break
+                            yield decoder.decode(chunk)
+                    yield decoder.decode(b"", final=True)
+                elif offset == 0 and job.get('output_tail'):
+                    yield job['output_tail']
+                return
+            
+            if job['state'] == "processing" and os.path.exists(live_path):
+                try:
+                    with open(live_path, "rb") as f:
+                        f.seek(offset)
+                        chunk = f.read()
+                except OSError:
+                    # Compressed or removed as the job finished
+                    chunk = b""
+                if chunk:
+                    offset += len(chunk)
+                    yield decoder.decode(chunk)
+            
+            if not follow:
+                return
+            time.sleep(LOG_FOLLOW_INTERVAL)
     
-    def _handle_job_failure(self, job: Dict, error_message: str):
-        """Handle job failure with retry logic"""
+    def _handle_job_failure(self, job: Dict, error_message: str, **fields):
+        """Handle job failure with retry logic; fields are stored on the job as well
+        
+        Like a completion, the update is dropped if the claiming worker has
+        lost its lease on the job in the meantime.
+        """
         job_id = job['id']
         attempts = job['attempts'] + 1
         max_retries = job['max_retries']
         
+        if fields.get('attempt') is not None:
+            fields['attempt']['outcome'] = "dead" if attempts >= max_retries else "failed"
+            self._observe_attempt(fields['attempt'])
+        
         if attempts >= max_retries:
             # Move to DLQ
             self.db.update_job(
                 job_id,
+                owner=job.get('worker_id'),
                 state="dead",
                 attempts=attempts,
                 error_message=error_message,
-                completed_at=datetime.utcnow().isoformat() + "Z"
+                completed_at=datetime.utcnow().isoformat() + "Z",
+                **fields
             )
         else:
             # Schedule retry with exponential backoff
@@ -88,15 +464,16 @@ class JobQueue:
             
             self.db.update_job(
                 job_id,
+                owner=job.get('worker_id'),
                 state="failed",
                 attempts=attempts,
                 error_message=error_message,
-                next_retry_at=next_retry.isoformat() + "Z"
+                next_retry_at=next_retry.isoformat() + "Z",
+                **fields
             )
-            
-            # After backoff delay, move back to pending
-            time.sleep(0.1)  # Small delay to ensure DB update
             # The job will be picked up again when next_retry_at is reached
+            if self._next_retry is None or next_retry < self._next_retry:
+                self._next_retry = next_retry
     
     def retry_dead_job(self, job_id: str) -> bool:
         """Retry a job from DLQ"""
@@ -114,10 +491,79 @@ class JobQueue:
             attempts=0,
             error_message=None,
             next_retry_at=None,
-            completed_at=None
+            completed_at=None,
+            queued_at=datetime.utcnow().isoformat() + "Z"
         )
+        notify_workers(self.db.db_path)
         return True
     
+    def reap_stale_jobs(self, lease_timeout: Optional[float] = None) -> Dict:
+        """Return jobs from dead workers to the queue"""
+        if lease_timeout is None:
+            lease_timeout = float(self.db.get_config("lease_timeout", "30"))
+        
+        result = self.db.reap_stale_jobs(lease_timeout)
+        if result['requeued']:
+            notify_workers(self.db.db_path)
+        return result
+    
+    def gc(self, completed_ttl: Optional[float] = None, dlq_max: Optional[int] = None,
+           archive: Optional[str] = None, batch_size: int = GC_BATCH_SIZE) -> Dict:
+        """Apply the retention policy to finished jobs
+        
+        Completed jobs (and attempt timings) older than completed_ttl seconds
+        are removed, and the DLQ is trimmed to the dlq_max jobs that were
+        dead-lettered last; 0 disables either rule.
+        archive is 'none' to delete, 'table' for jobs_archive, or the path of
+        an archive database. Unset arguments come from config.
+        """
+        if completed_ttl is None:
+            completed_ttl = parse_duration(self.db.get_config("completed_ttl", "0"))
+        if dlq_max is None:
+            dlq_max = int(self.db.get_config("dlq_max", "0"))
+        if archive is None:
+            archive = self.db.get_config("gc_archive", "none")
+        target = None if archive in ("", "none") else archive
+        
+        completed = 0
+        if completed_ttl > 0:
+            cutoff = (datetime.utcnow() - timedelta(seconds=completed_ttl)).isoformat() + "Z"
+            result = self.db.purge_jobs("completed", before=cutoff,
+                                        batch_size=batch_size, archive=target)
+            completed = result['removed']
+            self._remove_logs(result['log_paths'])
+            # Timing history ages out with the jobs it describes
+            self.db.purge_attempts(time.time() - completed_ttl, batch_size)
+        
+        dead = 0
+        if dlq_max > 0:
+            result = self.db.purge_jobs("dead", keep=dlq_max, batch_size=batch_size, archive=target)
+            dead = result['removed']
+            self._remove_logs(result['log_paths'])
+        
+        return {"completed": completed, "dead": dead, "archived": bool(target)}
+    
+    @staticmethod
+    def _remove_logs(paths: List[str]):
+        """Delete the spilled logs of jobs that gc removed"""
+        for path in paths:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    
+    def vacuum(self, pages: Optional[int] = None, convert: bool = False) -> Dict:
+        """Return space freed by gc to the filesystem"""
+        return self.db.vacuum(pages, convert)
+    
+    def get_attempt_stats(self, window: float, queue: Optional[str] = None) -> Dict:
+        """Throughput and latency percentiles over the last `window` seconds"""
+        stats = self.db.get_attempt_stats(time.time() - window, queue)
+        completed = stats['outcomes'].get('completed', 0)
+        stats['window'] = window
+        stats['throughput'] = completed / window if window else 0.0
+        return stats
+    
     def get_stats(self) -> Dict:
         """Get queue statistics"""
         stats = self.db.get_job_stats()
@@ -129,10 +575,20 @@ class JobQueue:
             "worker_details": workers
         }
     
+    def reconcile_stats(self) -> Dict:
+        """Rebuild the per-state counters from the jobs table"""
+        return self.db.rebuild_job_counts()
+    
     def list_jobs(self, state: Optional[str] = None) -> list:
         """List jobs, optionally filtered by state"""
         return self.db.list_jobs(state)
     
+    def iter_jobs(self, state: Optional[str] = None, limit: Optional[int] = None,
+                  after: Optional[str] = None, since: Optional[str] = None,
+                  until: Optional[str] = None) -> Iterator[Dict]:
+        """Stream jobs newest first, one page at a time"""
+        return self.db.iter_jobs(state, limit, after, since, until)
+    
     def get_dlq_jobs(self) -> list:
         """Get all jobs in DLQ"""
         return self.db.list_jobs("dead")
@@ -0,0 +1,472 @@
+"""Enqueue daemon: a warm JobQueue served over a Unix domain socket
+
+Every message, in both directions, is a 4-byte big-endian length followed
+by that many bytes of UTF-8 JSON. Requests name an op:
+    
+    {"op": "enqueue", "jobs": [{"id": "job1", "command": "..."}, ...]}
+    {"op": "get", "id": "job1"}
+    {"op": "status"}
+    {"op": "list", "state": ..., "limit": ..., "after": ..., "since": ..., "until": ...}
+    {"op": "ping"}
+
+Replies are {"ok": true, ...} or {"ok": false, "error": "..."} and come back
+in request order, so a client may pipeline requests without waiting for
+each reply. enqueue replies with the counts of JobQueue.enqueue_many();
+enqueues from every connection that arrive while a transaction commits are
+inserted together in the next one.
+"""
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+from queue import Empty, Queue
+from typing import Dict, List, Optional
+
+from .notify import SUPPORTED, notify_workers, private_dir, server_address
+from .queue import JobQueue
+
+
+# Length prefix of every message
+HEADER = struct.Struct(">I")
+
+# Largest message either side accepts
+MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+# Upper bound on jobs inserted per group commit
+GROUP_COMMIT_MAX_JOBS = 10000
+
+# Bytes read from a connection at a time
+RECV_BYTES = 256 * 1024
+
+# Chunks of requests a connection may have unanswered before the server stops reading from it
+MAX_PENDING_CHUNKS = 64
+
+# Rows returned by one list request; page with "after"
+LIST_MAX_LIMIT = 1000
+
+# Seconds a client waits for a reply before giving up
+CLIENT_TIMEOUT = 30
+
+
+class ProtocolError(Exception):
+    """Malformed message on the socket"""
+
+
+def encode_message(message: Dict) -> bytes:
+    """Length-prefixed JSON for one message"""
+    body = json.dumps(message, separators=(",", ":")).encode()
+    return HEADER.pack(len(body)) + body
+
+
+def send_message(sock: socket.socket, message: Dict):
+    """Write one message"""
+    sock.sendall(encode_message(message))
+
+
+def recv_message(stream) -> Optional[Dict]:
+    """Read one message from a binary file object; None at end of stream"""
+    header = stream.read(HEADER.size)
+    if not header:
+        return None
+    if len(header) < HEADER.size:
+        raise ProtocolError("Truncated message header")
+    
+    (length,) = HEADER.unpack(header)
+    _check_length(length)
+    body = stream.read(length)
+    if len(body) < length:
+        raise ProtocolError("Truncated message body")
+    return _decode(body)
+
+
+def split_messages(buffer: bytearray) -> List[Dict]:
+    """Remove and decode every complete message at the start of buffer"""
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= HEADER.size:
+        (length,) = HEADER.unpack_from(buffer, offset)
+        _check_length(length)
+        end = offset + HEADER.size + length
+        if end > len(buffer):
+            break
+        messages.append(_decode(bytes(buffer[offset + HEADER.size:end])))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+def _check_length(length: int):
+    if length > MAX_MESSAGE_BYTES:
+        raise ProtocolError(f"Message of {length} bytes exceeds {MAX_MESSAGE_BYTES}")
+
+
+def _decode(body: bytes) -> Dict:
+    try:
+        message = json.loads(body)
+    except ValueError:
+        raise ProtocolError("Invalid JSON format")
+    if not isinstance(message, dict):
+        raise ProtocolError("Message must be a JSON object")
+    return message
+
+
+class _Pending:
+    """Consecutive enqueue requests from one connection, committed together"""
+    
+    __slots__ = ("requests", "valid", "replies", "done")
+    
+    def __init__(self):
+        # Job lists, one per request
+        self.requests = []
+        self.valid = []
+        self.replies = []
+        self.done = threading.Event()
+
+
+class GroupCommitter:
+    """Single writer thread inserting enqueue requests in shared transactions
+    
+    Requests queue up while a transaction commits and the next one takes all
+    of them, up to max_jobs, so the commit cost is shared by however many
+    requests are waiting rather than paid per request.
+    """
+    
+    def __init__(self, queue: JobQueue, max_jobs: int = GROUP_COMMIT_MAX_JOBS):
+        self.queue = queue
+        self.max_jobs = max_jobs
+        self._requests = Queue()
+        self._thread = None
+    
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+    
+    def submit(self, pending: _Pending):
+        """Queue requests for the next commit; pending.done is set once replied"""
+        self._requests.put(pending)
+    
+    def stop(self):
+        """Commit what is already queued, then stop the writer"""
+        self._requests.put(None)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            pending = self._requests.get()
+            if pending is None:
+                break
+            batch = [pending]
+            size = sum(len(jobs) for jobs in pending.requests)
+            while size < self.max_jobs:
+                try:
+                    pending = self._requests.get_nowait()
+                except Empty:
+                    break
+                if pending is None:
+                    stopping = True
+                    break
+                batch.append(pending)
+                size += sum(len(jobs) for jobs in pending.requests)
+            self._commit(batch)
+        self.queue.db.close()
+    
+    def _commit(self, batch: List[_Pending]):
+        jobs = self._prepare(batch)
+        try:
+            existing = set(self.queue.db.create_jobs(jobs)) if jobs else set()
+        except Exception:
+            # Whatever broke the shared transaction only fails its own request
+            self._commit_each(batch)
+            return
+        
+        self._reply(batch, existing)
+        if len(jobs) > len(existing):
+            notify_workers(self.queue.db.db_path)
+    
+    def _commit_each(self, batch: List[_Pending]):
+        """Insert a batch one request per transaction, failing only the requests that raise"""
+        existing = set()
+        inserted = 0
+        for pending in batch:
+            for i, valid in enumerate(pending.valid):
+                if not valid:
+                    continue
+                try:
+                    duplicates = self.queue.db.create_jobs(valid)
+                except Exception as e:
+                    pending.replies[i] = {"ok": False, "error": str(e)}
+                    pending.valid[i] = []
+                    continue
+                existing.update(duplicates)
+                inserted += len(valid) - len(duplicates)
+        
+        self._reply(batch, existing)
+        if inserted:
+            notify_workers(self.queue.db.db_path)
+    
+    @staticmethod
+    def _reply(batch: List[_Pending], existing: set):
+        """Fill in the counts of every successful request and release its waiter"""
+        for pending in batch:
+            for reply, valid in zip(pending.replies, pending.valid):
+                if not reply['ok']:
+                    continue
+                duplicates = [job['id'] for job in valid if job['id'] in existing]
+                reply['duplicates'].extend(duplicates)
+                reply['enqueued'] = len(valid) - len(duplicates)
+            pending.done.set()
+    
+    def _prepare(self, batch: List[_Pending]) -> List[Dict]:
+        """Validate every request in the batch; returns the jobs to insert"""
+        jobs = []
+        seen = set()
+        for pending in batch:
+            for request in pending.requests:
+                try:
+                    valid, errors = self.queue.prepare_jobs(request)
+                except Exception as e:
+                    pending.replies.append({"ok": False, "error": str(e)})
+                    pending.valid.append([])
+                    continue
+                reply = {"ok": True, "enqueued": 0, "duplicates": [], "errors": errors}
+                unique = []
+                for job in valid:
+                    # Repeated ids are told apart here, so each request gets its own answer
+                    if job['id'] in seen:
+                        reply['duplicates'].append(job['id'])
+                        continue
+                    seen.add(job['id'])
+                    unique.append(job)
+                pending.replies.append(reply)
+                pending.valid.append(unique)
+                jobs.extend(unique)
+        return jobs
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One client connection: reads requests, a second thread writes replies
+    
+    Every message already received is handled as one chunk, so pipelined
+    enqueues reach the group commit together instead of one at a time.
+    """
+    
+    def handle(self):
+        replies = Queue(MAX_PENDING_CHUNKS)
+        writer = threading.Thread(target=self._write_replies, args=(replies,), daemon=True)
+        writer.start()
+        buffer = bytearray()
+        try:
+            while True:
+                data = self.request.recv(RECV_BYTES)
+                if not data:
+                    break
+                buffer += data
+                try:
+                    messages = split_messages(buffer)
+                except ProtocolError as e:
+                    replies.put([{"ok": False, "error": str(e)}])
+                    break
+                if messages:
+                    replies.put(self.server.queuectl.dispatch(messages))
+        except OSError:
+            # Client went away
+            pass
+        finally:
+            replies.put(None)
+            writer.join()
+    
+    def _write_replies(self, replies: Queue):
+        broken = False
+        try:
+            while True:
+                chunk = replies.get()
+                if chunk is None:
+                    return
+                out = []
+                for reply in chunk:
+                    if isinstance(reply, _Pending):
+                        reply.done.wait()
+                        out.extend(encode_message(each) for each in reply.replies)
+                        continue
+                    if callable(reply):
+                        # Reads run here, after the writes queued before them committed
+                        reply = self.server.queuectl.run_read(reply)
+                    out.append(encode_message(reply))
+                if broken:
+                    # Keep draining so the reader never blocks on a full queue
+                    continue
+                try:
+                    self.request.sendall(b"".join(out))
+                except OSError:
+                    broken = True
+        finally:
+            # The reads opened this thread's connection
+            self.server.queuectl.queue.db.close()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class QueueServer:
+    """`queuectl serve`: enqueue, status and list for local clients"""
+    
+    def __init__(self, db_path: str = "queuectl.db", path: Optional[str] = None):
+        self.queue = JobQueue(db_path)
+        self.path = path or server_address(db_path)
+        self.committer = GroupCommitter(self.queue)
+        self._server = None
+        self._thread = None
+    
+    def start(self):
+        """Bind the socket and serve in background threads
+        
+        Raises RuntimeError if sockets are unsupported or another server is
+        already listening on this database.
+        """
+        if not SUPPORTED:
+            raise RuntimeError("queuectl serve needs Unix domain sockets")
+        
+        directory = os.path.dirname(self.path)
+        if not private_dir(directory, create=True):
+            raise RuntimeError(f"{directory} is not private to this user (owner and mode 0700)")
+        if os.path.exists(self.path):
+            running = Client.connect_path(self.path)
+            if running is not None:
+                running.close()
+                raise RuntimeError(f"A server is already listening on {self.path}")
+            # Left behind by a server that was killed
+            os.unlink(self.path)
+        
+        self._server = _UnixServer(self.path, _Handler)
+        self._server.queuectl = self
+        self.committer.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """Stop accepting connections and commit the enqueues already received"""
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self.committer.stop()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self._server = None
+    
+    def dispatch(self, messages: List[Dict]) -> List:
+        """Replies for a chunk of requests, in order
+        
+        Each entry is a reply, a _Pending for a run of enqueues or a read to
+        run once the writes before it have committed.
+        """
+        replies = []
+        pending = None
+        for message in messages:
+            op = message.get("op")
+            if op == "enqueue" and isinstance(message.get("jobs"), list):
+                if pending is None:
+                    pending = _Pending()
+                    replies.append(pending)
+                pending.requests.append(message["jobs"])
+                continue
+            pending = None
+            replies.append(self._dispatch_one(op, message))
+        
+        for reply in replies:
+            if isinstance(reply, _Pending):
+                self.committer.submit(reply)
+        return replies
+    
+    def _dispatch_one(self, op: Optional[str], message: Dict):
+        if op == "enqueue":
+            return {"ok": False, "error": "'jobs' must be a list"}
+        if op == "get":
+            return lambda: {"ok": True, "job": self.queue.db.get_job(str(message.get("id")))}
+        if op == "status":
+            return lambda: {"ok": True, **self.queue.get_stats()}
+        if op == "list":
+            return lambda: {"ok": True, "jobs": self._list(message)}
+        if op == "ping":
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown op '{op}'"}
+    
+    def _list(self, message: Dict) -> List[Dict]:
+        limit = message.get("limit") or LIST_MAX_LIMIT
+        if not isinstance(limit, int) or limit < 1:
+            raise ValueError("'limit' must be a positive integer")
+        jobs = self.queue.iter_jobs(
+            message.get("state"), min(limit, LIST_MAX_LIMIT), message.get("after"),
+            message.get("since"), message.get("until")
+        )
+        return [dict(job) for job in jobs]
+    
+    def run_read(self, read) -> Dict:
+        try:
+            return read()
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+
+class Client:
+    """Connection to a running `queuectl serve`"""
+    
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.stream = sock.makefile("rb")
+    
+    @classmethod
+    def connect(cls, db_path: str = "queuectl.db") -> Optional["Client"]:
+        """Connect to the server for db_path; None if none is running"""
+        if not SUPPORTED:
+            return None
+        return cls.connect_path(server_address(db_path))
+    
+    @classmethod
+    def connect_path(cls, path: str) -> Optional["Client"]:
+        # Whoever else could create the directory could also be listening in it
+        if not private_dir(os.path.dirname(path)):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(CLIENT_TIMEOUT)
+        try:
+            sock.connect(path)
+        except OSError:
+            sock.close()
+            return None
+        return cls(sock)
+    
+    def send(self, message: Dict):
+        """Send a request without waiting for its reply"""
+        send_message(self.sock, message)
+    
+    def receive(self) -> Dict:
+        """Read the reply to the oldest request still unanswered"""
+        reply = recv_message(self.stream)
+        if reply is None:
+            raise ConnectionError("Server closed the connection")
+        return reply
+    
+    def request(self, message: Dict) -> Dict:
+        self.send(message)
+        return self.receive()
+    
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+    
+    def __enter__(self) -> "Client":
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
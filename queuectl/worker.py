@@ -1,30 +1,113 @@
 """Worker process implementation with graceful shutdown"""
 
+import itertools
+import math
 import os
 import signal
 import sys
 import time
 import threading
 import platform
-from typing import Optional
+import random
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, List, Tuple
 from .queue import JobQueue
+from .notify import WakeupListener, SUPPORTED as WAKEUPS_SUPPORTED
+from .metrics import REGISTRY, MetricsServer, database_snapshot, merge_snapshots, render
+from .profiling import DatabaseProfiler, ThreadProfiles
+
+
+# Idle polling backs off from IDLE_WAIT_MIN to IDLE_WAIT_MAX seconds. Enqueue
+# wakes sleeping workers directly when local sockets are available, and idle
+# waits are cut short when a known retry falls due.
+IDLE_WAIT_MIN = 0.05
+IDLE_WAIT_MAX = 5.0 if WAKEUPS_SUPPORTED else 1.0
+
+# Seconds between sweeps for jobs stranded by crashed workers
+REAP_INTERVAL = 10.0
+
+# Seconds between applying the retention policy (completed-ttl, dlq-max), and
+# pages handed back to the filesystem after each run that removed jobs
+GC_INTERVAL = 300.0
+GC_VACUUM_PAGES = 1000
+
+# Seconds between metric snapshots sent from a worker to the exporter
+METRICS_PUSH_INTERVAL = 5.0
+
+# A lease must outlive at least this many heartbeat intervals
+HEARTBEATS_PER_LEASE = 2
+
+# Autoscaling: seconds between decisions, and the window over which the drain
+# rate and the recent queue wait are measured
+SCALE_INTERVAL = 5.0
+SCALE_WINDOW = 30.0
+
+# Hysteresis: consecutive decisions above the target wait before workers are
+# added, and below SCALE_DOWN_RATIO of it before one is retired
+SCALE_UP_TICKS = 2
+SCALE_DOWN_TICKS = 6
+SCALE_DOWN_RATIO = 0.5
+
+# Default --target-wait, in seconds
+DEFAULT_TARGET_WAIT = 5.0
+
+# A worker that fails within QUICK_CRASH seconds of starting crashed quickly.
+# Its slot is restarted after RESTART_BACKOFF_MIN seconds, doubling with each
+# quick crash in a row up to RESTART_BACKOFF_MAX, and supervision gives up
+# after MAX_QUICK_CRASHES of them
+QUICK_CRASH = 10.0
+RESTART_BACKOFF_MIN = 1.0
+RESTART_BACKOFF_MAX = 60.0
+MAX_QUICK_CRASHES = 5
+
+RUNNING_JOBS = REGISTRY.gauge("queuectl_worker_running_jobs", "Jobs executing on each worker",
+                              ["worker"])
 
 
 class Worker:
     """Worker process that processes jobs from the queue"""
     
-    def __init__(self, worker_id: str, db_path: str = "queuectl.db"):
+    def __init__(self, worker_id: str, db_path: str = "queuectl.db", prefetch: int = 1,
+                 concurrency: int = 1, queues: Optional[List[Tuple[str, Optional[float]]]] = None,
+                 metrics_queue=None, profiler: Optional[DatabaseProfiler] = None,
+                 profiles: Optional[ThreadProfiles] = None, flush_ms: float = 0):
         self.worker_id = worker_id
         self.queue = JobQueue(db_path)
+        if profiler is not None:
+            profiler.instrument(self.queue.db)
+        # cProfile for the work loop and job threads; the caller profiles the main thread
+        self.profiles = profiles
+        self.prefetch = max(1, prefetch)
+        self.concurrency = max(1, concurrency)
+        # (name, weight) pairs; None serves every queue by priority alone
+        self.queues = queues
         self.running = False
-        self.current_job = None
+        # Jobs currently executing, keyed by job id
+        self.current_jobs = {}
+        # Jobs claimed in the last round-trip but not started yet
+        self.buffer = deque()
         self.thread = None
+        self.listener = None
+        # multiprocessing.Queue to the WorkerManager's exporter, if metrics are on
+        self.metrics_queue = metrics_queue
+        # Write-behind window for job updates and heartbeats; 0 commits each at once
+        self.flush_ms = flush_ms
+        # Seconds between heartbeats (config heartbeat-interval), set by start()
+        self.heartbeat_interval = None
+        # time.monotonic() of the last heartbeat written, by a claim or on its own
+        self.heartbeat_at = 0.0
         self.pid = os.getpid()
     
     def start(self):
         """Start the worker"""
         self.running = True
         self.queue.db.register_worker(self.worker_id, self.pid)
+        self.heartbeat_at = time.monotonic()
+        self.heartbeat_interval = self._heartbeat_interval()
+        if self.flush_ms:
+            self.queue.db.start_write_behind(self.flush_ms)
+        self.listener = WakeupListener(self.queue.db.db_path, self.worker_id)
         
         # Setup signal handlers for graceful shutdown
         signal.signal(signal.SIGINT, self._signal_handler)
@@ -37,12 +120,80 @@ class Worker:
         
         try:
             # Keep main thread alive
+            next_reap = time.monotonic()
+            # Spread the workers out so they do not all collect at once
+            next_gc = time.monotonic() + random.uniform(0, GC_INTERVAL)
+            next_push = time.monotonic()
             while self.running:
-                time.sleep(1)
-                self.queue.db.update_worker_heartbeat(self.worker_id)
+                time.sleep(min(1.0, self.heartbeat_interval))
+                # Busy workers rarely get here: every claim refreshes the heartbeat
+                if time.monotonic() - self.heartbeat_at >= self.heartbeat_interval:
+                    self._heartbeat()
+                if time.monotonic() >= next_reap:
+                    self._reap()
+                    next_reap = time.monotonic() + REAP_INTERVAL
+                if time.monotonic() >= next_gc:
+                    self._gc()
+                    next_gc = time.monotonic() + GC_INTERVAL
+                if self.metrics_queue is not None and time.monotonic() >= next_push:
+                    self._push_metrics()
+                    next_push = time.monotonic() + METRICS_PUSH_INTERVAL
         except KeyboardInterrupt:
             self.stop()
     
+    def _heartbeat_interval(self) -> float:
+        """Configured heartbeat interval, kept well inside the lease"""
+        interval = float(self.queue.db.get_config("heartbeat_interval", "5"))
+        lease_timeout = float(self.queue.db.get_config("lease_timeout", "30"))
+        return min(interval, lease_timeout / HEARTBEATS_PER_LEASE)
+    
+    def _heartbeat(self):
+        """Tell the reaper this worker is alive"""
+        try:
+            self.queue.db.update_worker_heartbeat(self.worker_id)
+        except Exception as e:
+            print(f"Worker {self.worker_id} heartbeat error: {e}", file=sys.stderr)
+            return
+        self.heartbeat_at = time.monotonic()
+    
+    def _reap(self):
+        """Recover jobs whose worker stopped heartbeating"""
+        try:
+            result = self.queue.reap_stale_jobs()
+        except Exception as e:
+            print(f"Worker {self.worker_id} reaper error: {e}", file=sys.stderr)
+            return
+        if result['requeued'] or result['dead']:
+            print(
+                f"Worker {self.worker_id} recovered {result['requeued']} job(s), "
+                f"{result['dead']} moved to DLQ",
+                file=sys.stderr
+            )
+    
+    def _gc(self):
+        """Apply the configured retention policy, a no-op unless one is set"""
+        try:
+            result = self.queue.gc()
+            if result['completed'] or result['dead']:
+                self.queue.vacuum(GC_VACUUM_PAGES)
+        except Exception as e:
+            print(f"Worker {self.worker_id} gc error: {e}", file=sys.stderr)
+            return
+        if result['completed'] or result['dead']:
+            print(
+                f"Worker {self.worker_id} removed {result['completed']} completed job(s), "
+                f"{result['dead']} from DLQ",
+                file=sys.stderr
+            )
+    
+    def _push_metrics(self):
+        """Send this process's cumulative metrics to the exporter"""
+        RUNNING_JOBS.set(len(self.current_jobs), worker=self.worker_id)
+        try:
+            self.metrics_queue.put_nowait((self.worker_id, REGISTRY.snapshot()))
+        except Exception as e:
+            print(f"Worker {self.worker_id} failed to push metrics: {e}", file=sys.stderr)
+    
     def _signal_handler(self, signum, frame):
         """Handle shutdown signals"""
         self.stop()
@@ -53,35 +204,181 @@ class Worker:
             return
         
         self.running = False
+        if self.listener:
+            self.listener.wake()
         
-        # Wait for current job to finish (with timeout)
-        if self.thread and self.thread.is_alive():
-            self.thread.join(timeout=30)
+        # Wait for the running jobs to finish, heartbeating meanwhile: a
+        # worker that went quiet or lost its row would have them requeued
+        # and run a second time while they are still running here
+        interval = self.heartbeat_interval or 1.0
+        while self.thread and self.thread.is_alive():
+            self.thread.join(timeout=min(1.0, interval))
+            if time.monotonic() - self.heartbeat_at >= interval:
+                self._heartbeat()
         
         # Cleanup
+        try:
+            # Results of the last jobs, before the worker row goes away
+            self.queue.db.stop_write_behind()
+        except Exception as e:
+            print(f"Worker {self.worker_id} failed to flush updates: {e}", file=sys.stderr)
+        if self.listener:
+            self.listener.close()
+        if self.metrics_queue is not None:
+            # Final counts, including the jobs finished while stopping
+            self._push_metrics()
         self.queue.db.remove_worker(self.worker_id)
+        self.queue.db.close()
     
     def _work_loop(self):
         """Main worker loop"""
-        while self.running:
-            try:
-                # Get next job
-                job = self.queue.get_next_job()
+        if self.profiles is not None:
+            self.profiles.start()
+        idle_wait = IDLE_WAIT_MIN
+        # Leaving the with-block waits for jobs that are still running
+        initializer = self.profiles.start if self.profiles is not None else None
+        with ThreadPoolExecutor(max_workers=self.concurrency, initializer=initializer) as pool:
+            while self.running:
+                try:
+                    free = self.concurrency - len(self.current_jobs)
+                    
+                    # Refill the local buffer, claiming at least one job per free slot
+                    if free and not self.buffer:
+                        claimed = self.queue.get_next_jobs(
+                            self.worker_id, max(self.prefetch, free), self._queue_order()
+                        )
+                        if claimed:
+                            self.heartbeat_at = time.monotonic()
+                        self.buffer.extend(claimed)
+                    
+                    started = 0
+                    while started < free and self.buffer:
+                        self._start_job(pool, self.buffer.popleft())
+                        started += 1
+                    
+                    if started:
+                        idle_wait = IDLE_WAIT_MIN
+                    elif self.listener.wait(self._idle_timeout(idle_wait)):
+                        # Woken by an enqueue or a finished job, poll again straight away
+                        idle_wait = IDLE_WAIT_MIN
+                    else:
+                        # No jobs available, back off before the next poll
+                        idle_wait = min(idle_wait * 2, IDLE_WAIT_MAX)
                 
-                if job:
-                    self.current_job = job
-                    self.queue.execute_job(job)
-                    self.current_job = None
-                else:
-                    # No jobs available, wait a bit
+                except Exception as e:
+                    print(f"Worker {self.worker_id} error: {e}", file=sys.stderr)
                     time.sleep(1)
-                
-                # Update heartbeat
-                self.queue.db.update_worker_heartbeat(self.worker_id)
-                
-            except Exception as e:
-                print(f"Worker {self.worker_id} error: {e}", file=sys.stderr)
-                time.sleep(1)
+        
+        # Jobs claimed but never started go back to pending for other workers
+        try:
+            self.queue.release_jobs(self.worker_id, [job['id'] for job in self.buffer])
+            self.buffer.clear()
+        except Exception as e:
+            print(f"Worker {self.worker_id} failed to release jobs: {e}", file=sys.stderr)
+        
+        # Release this thread's database connection
+        self.queue.db.close()
+    
+    def _queue_order(self) -> Optional[List[str]]:
+        """Order in which to drain the worker's queues for the next claim
+        
+        Without weights the configured order is a strict priority. With
+        weights, each claim draws a fresh order in which a queue comes first
+        with probability proportional to its weight.
+        """
+        if not self.queues:
+            return None
+        if all(weight is None for _, weight in self.queues):
+            return [name for name, _ in self.queues]
+        
+        # Weighted shuffle: sort by u ** (1 / weight), largest first
+        keys = []
+        for name, weight in self.queues:
+            weight = weight if weight is not None else 1.0
+            keys.append((random.random() ** (1.0 / weight), name))
+        return [name for _, name in sorted(keys, reverse=True)]
+    
+    def _idle_timeout(self, idle_wait: float) -> float:
+        """Cap the idle wait at the time left until the next retry is due"""
+        retry_delay = self.queue.next_retry_delay()
+        if retry_delay is None:
+            return idle_wait
+        return max(IDLE_WAIT_MIN, min(idle_wait, retry_delay))
+    
+    def _start_job(self, pool: ThreadPoolExecutor, job: dict):
+        """Run a job on the pool, freeing its slot when it finishes"""
+        self.current_jobs[job['id']] = job
+        pool.submit(self._run_job, job)
+    
+    def _run_job(self, job: dict):
+        """Execute one job on a pool thread"""
+        try:
+            self.queue.execute_job(job)
+        except Exception as e:
+            print(f"Worker {self.worker_id} error running job {job['id']}: {e}", file=sys.stderr)
+        finally:
+            self.current_jobs.pop(job['id'], None)
+            # A slot is free; let the work loop claim more
+            self.listener.wake()
+
+
+class Autoscaler:
+    """Pool size from queue load, with hysteresis
+    
+    The expected wait of a new job is the larger of the backlog divided by the
+    recent drain rate and the average wait of recently claimed jobs. Above
+    target_wait for SCALE_UP_TICKS decisions in a row the pool grows in
+    proportion; below SCALE_DOWN_RATIO of it for SCALE_DOWN_TICKS decisions
+    one worker is retired.
+    """
+    
+    def __init__(self, min_workers: int, max_workers: int,
+                 target_wait: float = DEFAULT_TARGET_WAIT):
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_wait = target_wait
+        self.above = 0
+        self.below = 0
+    
+    @staticmethod
+    def estimate_wait(load: Dict, window: float = SCALE_WINDOW) -> float:
+        """Seconds a job enqueued now would wait, from a Database.get_load() sample"""
+        recent = load['wait_time'] or 0.0
+        if not load['pending']:
+            return recent
+        if not load['attempts']:
+            # Nothing drained: the backlog is not moving at all
+            return math.inf
+        return max(recent, load['pending'] * window / load['attempts'])
+    
+    def decide(self, current: int, load: Dict, window: float = SCALE_WINDOW) -> int:
+        """Desired pool size, given the current size and a get_load() sample"""
+        if current < self.min_workers:
+            return self.min_workers
+        if current == 0 and load['pending']:
+            # Nobody to measure a drain rate with
+            return 1
+        
+        wait = self.estimate_wait(load, window)
+        if wait > self.target_wait:
+            self.above += 1
+            self.below = 0
+            if self.above >= SCALE_UP_TICKS and current < self.max_workers:
+                self.above = 0
+                if math.isinf(wait):
+                    return min(self.max_workers, current * 2)
+                return min(self.max_workers,
+                           max(current + 1, math.ceil(current * wait / self.target_wait)))
+        elif wait < self.target_wait * SCALE_DOWN_RATIO:
+            self.below += 1
+            self.above = 0
+            if self.below >= SCALE_DOWN_TICKS and current > self.min_workers:
+                self.below = 0
+                return current - 1
+        else:
+            self.above = 0
+            self.below = 0
+        return current
 
 
 class WorkerManager:
@@ -90,33 +387,245 @@ class WorkerManager:
     def __init__(self, db_path: str = "queuectl.db"):
         self.db_path = db_path
         self.workers = {}
+        self.metrics_server = None
+        self.metrics_queue = None
+        # Latest cumulative snapshot from each running worker, and the
+        # counters and histograms of workers that have exited
+        self.worker_metrics = {}
+        self.exited_metrics = {}
+        self.metrics_lock = threading.Lock()
+        # Arguments every new worker process is started with
+        self.worker_args = None
+        self.worker_ids = itertools.count()
+        # Workers sent SIGTERM by the autoscaler and not yet exited
+        self.retiring = {}
+        # Per worker: when it started and the quick crashes of its slot so far
+        self.started = {}
+        # Crashed slots waiting out their backoff: (due, quick crashes)
+        self.restarts = []
+        self.autoscaler = None
+        self.next_scale = 0.0
+        self.db = None
+    
+    def start_workers(self, count: int, prefetch: int = 1, concurrency: int = 1,
+                      queues: Optional[List[Tuple[str, Optional[float]]]] = None,
+                      metrics_port: Optional[int] = None, metrics_host: str = "127.0.0.1",
+                      profile_dir: Optional[str] = None, slow_query_ms: Optional[float] = None,
+                      slow_call_ms: Optional[float] = None, flush_ms: float = 0):
+        """Start multiple worker processes
+        
+        With metrics_port, an OpenMetrics endpoint is served from this process
+        at http://metrics_host:metrics_port/metrics.
+        
+        With profile_dir, each worker writes <worker_id>.prof (pstats) and
+        <worker_id>-db.json (Database timings) there when it stops. Statements
+        and Database calls slower than slow_query_ms / slow_call_ms are logged
+        to <worker_id>-slow.log, or stderr without profile_dir.
+        
+        With flush_ms, each worker commits job updates and heartbeats in
+        batches every flush_ms (see Database.start_write_behind).
+        """
+        if metrics_port is not None:
+            self.start_metrics_server(metrics_port, metrics_host)
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+        profile = (profile_dir, slow_query_ms, slow_call_ms)
+        self.worker_args = (prefetch, concurrency, queues, profile, flush_ms)
+        
+        return [self._spawn_worker() for _ in range(count)]
     
-    def start_workers(self, count: int):
-        """Start multiple worker processes"""
+    def _spawn_worker(self, crashes: int = 0):
+        """Start one worker process with the arguments given to start_workers"""
         import multiprocessing
         
-        processes = []
-        for i in range(count):
-            worker_id = f"worker-{os.getpid()}-{i}"
-            p = multiprocessing.Process(
-                target=self._worker_process,
-                args=(worker_id, self.db_path)
-            )
-            p.start()
-            processes.append(p)
-            self.workers[worker_id] = p
+        prefetch, concurrency, queues, profile, flush_ms = self.worker_args
+        worker_id = f"worker-{os.getpid()}-{next(self.worker_ids)}"
+        p = multiprocessing.Process(
+            target=self._worker_process,
+            args=(worker_id, self.db_path, prefetch, concurrency, queues, self.metrics_queue,
+                  profile, flush_ms)
+        )
+        p.start()
+        self.workers[worker_id] = p
+        self.started[worker_id] = (time.monotonic(), crashes)
+        return p
+    
+    def _retire_worker(self):
+        """Drain the newest worker
+        
+        On SIGTERM a worker stops claiming, hands back prefetched jobs and
+        finishes the running ones, heartbeating meanwhile, before it removes
+        its row (Worker.stop); supervise() then joins it.
+        """
+        worker_id, p = self.workers.popitem()
+        self.retiring[worker_id] = p
+        try:
+            os.kill(p.pid, signal.SIGTERM)
+        except (ProcessLookupError, OSError):
+            pass
+    
+    def autoscale(self, min_workers: int, max_workers: int,
+                  target_wait: float = DEFAULT_TARGET_WAIT):
+        """Let supervise() size the pool between min_workers and max_workers
         
-        return processes
+        Call after start_workers(min_workers, ...), which sets the arguments
+        new workers are started with.
+        """
+        from .database import Database
+        
+        self.autoscaler = Autoscaler(min_workers, max_workers, target_wait)
+        self.db = Database(self.db_path)
+        self.next_scale = time.monotonic() + SCALE_INTERVAL
+    
+    def supervise(self):
+        """One round of supervision, to be called about once a second
+        
+        Exited workers are joined and their metrics retired. With autoscaling,
+        workers that crashed are replaced after a backoff that grows while
+        they keep crashing on startup; RuntimeError is raised once a slot has
+        crashed quickly MAX_QUICK_CRASHES times in a row. A worker that exited
+        cleanly without being retired was stopped from outside (`queuectl
+        worker stop`), so supervision ends there rather than fight it. Every
+        SCALE_INTERVAL the autoscaler adjusts the pool to the queue load.
+        """
+        for worker_id, p in list(self.retiring.items()):
+            if not p.is_alive():
+                p.join()
+                del self.retiring[worker_id]
+                self._forget_worker(worker_id)
+        
+        for worker_id, p in list(self.workers.items()):
+            if p.is_alive():
+                continue
+            p.join()
+            del self.workers[worker_id]
+            started, crashes = self._forget_worker(worker_id)
+            if self.autoscaler is None:
+                continue
+            if p.exitcode == 0:
+                print(f"Worker {worker_id} was stopped; autoscaling ends", file=sys.stderr)
+                self.autoscaler = None
+                self.restarts.clear()
+                return
+            crashes = crashes + 1 if time.monotonic() - started < QUICK_CRASH else 0
+            if crashes >= MAX_QUICK_CRASHES:
+                raise RuntimeError(f"Worker {worker_id} exited with code {p.exitcode}; "
+                                   f"{crashes} workers in a row failed on startup")
+            delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_MIN * 2 ** max(0, crashes - 1))
+            print(f"Worker {worker_id} exited with code {p.exitcode}, restarting in {delay:g}s",
+                  file=sys.stderr)
+            self.restarts.append((time.monotonic() + delay, crashes))
+        
+        if self.autoscaler is None:
+            return
+        
+        now = time.monotonic()
+        for restart in [restart for restart in self.restarts if restart[0] <= now]:
+            self.restarts.remove(restart)
+            self._spawn_worker(restart[1])
+        
+        if now < self.next_scale:
+            return
+        self.next_scale = time.monotonic() + SCALE_INTERVAL
+        try:
+            load = self.db.get_load(time.time() - SCALE_WINDOW)
+        except Exception as e:
+            print(f"Autoscaler failed to read queue load: {e}", file=sys.stderr)
+            return
+        
+        # Slots waiting to restart count as workers, or a crashing pool would grow
+        current = len(self.workers) + len(self.restarts)
+        desired = self.autoscaler.decide(current, load)
+        if desired != current:
+            print(f"Scaling workers {current} -> {desired} ({load['pending']} pending)",
+                  file=sys.stderr)
+        while len(self.workers) + len(self.restarts) < desired:
+            self._spawn_worker()
+        while self.restarts and len(self.workers) + len(self.restarts) > desired:
+            self.restarts.pop()
+        while len(self.workers) > desired:
+            self._retire_worker()
+    
+    def _forget_worker(self, worker_id: str) -> Tuple[float, int]:
+        """Drop the state of an exited worker; returns its start time and crash count
+        
+        Its gauges (running jobs) describe a process that is gone and are
+        dropped, while its counters and histograms are kept in exited_metrics
+        so totals never go backwards.
+        """
+        with self.metrics_lock:
+            snapshot = self.worker_metrics.pop(worker_id, None)
+            if snapshot is not None:
+                totals = {name: metric for name, metric in snapshot.items()
+                          if metric["type"] != "gauge"}
+                self.exited_metrics = merge_snapshots([self.exited_metrics, totals])
+            return self.started.pop(worker_id, (time.monotonic(), 0))
+    
+    def start_metrics_server(self, port: int, host: str = "127.0.0.1") -> MetricsServer:
+        """Serve worker and queue metrics; port 0 picks a free port"""
+        import multiprocessing
+        from .database import Database
+        
+        self.metrics_queue = multiprocessing.Queue()
+        db = Database(self.db_path)
+        
+        def drain():
+            # Read snapshots as they arrive rather than on scrapes: a queue
+            # nobody reads fills its pipe, and workers then grow their send
+            # buffers without bound
+            while True:
+                worker_id, snapshot = self.metrics_queue.get()
+                with self.metrics_lock:
+                    # A snapshot read after its worker was reaped would
+                    # resurrect its gauges; its last counts are dropped instead
+                    if worker_id in self.started:
+                        self.worker_metrics[worker_id] = snapshot
+        
+        threading.Thread(target=drain, name="metrics-drain", daemon=True).start()
+        
+        def collect():
+            with self.metrics_lock:
+                snapshots = [self.exited_metrics] + list(self.worker_metrics.values())
+            return render(merge_snapshots([database_snapshot(db)] + snapshots))
+        
+        self.metrics_server = MetricsServer(collect, port, host)
+        self.metrics_server.start()
+        return self.metrics_server
     
     @staticmethod
-    def _worker_process(worker_id: str, db_path: str):
+    def _worker_process(worker_id: str, db_path: str, prefetch: int = 1, concurrency: int = 1,
+                        queues: Optional[List[Tuple[str, Optional[float]]]] = None,
+                        metrics_queue=None, profile: Tuple = (None, None, None),
+                        flush_ms: float = 0):
         """Worker process entry point"""
-        worker = Worker(worker_id, db_path)
+        if metrics_queue is not None:
+            # Never block exit flushing snapshots the exporter has stopped reading
+            metrics_queue.cancel_join_thread()
+        profile_dir, slow_query_ms, slow_call_ms = profile
+        profiler = None
+        profiles = ThreadProfiles() if profile_dir else None
+        slow_log = None
+        if profile_dir or slow_query_ms is not None or slow_call_ms is not None:
+            if profile_dir and (slow_query_ms is not None or slow_call_ms is not None):
+                slow_log = open(os.path.join(profile_dir, f"{worker_id}-slow.log"), "a")
+            profiler = DatabaseProfiler(slow_query_ms, slow_call_ms, slow_log)
+        
+        worker = Worker(worker_id, db_path, prefetch, concurrency, queues, metrics_queue,
+                        profiler, profiles, flush_ms)
         try:
-            worker.start()
+            if profiles is not None:
+                profiles.run(worker.start)
+            else:
+                worker.start()
         except Exception as e:
             print(f"Worker {worker_id} failed: {e}", file=sys.stderr)
             sys.exit(1)
+        finally:
+            if profiles is not None:
+                profiles.dump(os.path.join(profile_dir, f"{worker_id}.prof"))
+                profiler.dump(os.path.join(profile_dir, f"{worker_id}-db.json"))
+            if slow_log is not None:
+                slow_log.close()
     
     def stop_workers(self):
         """Stop all workers gracefully"""
@@ -135,14 +644,18 @@ class WorkerManager:
                     os.kill(pid, signal.SIGTERM if hasattr(signal, 'SIGTERM') else signal.SIGINT)
                 else:
                     os.kill(pid, signal.SIGTERM)
-            except (ProcessLookupError, OSError, AttributeError):
-                # Process already dead or signal not available
+            except ProcessLookupError:
+                # Clean up the record of a worker that is already dead; live
+                # workers keep theirs until their running jobs have finished
+                db.remove_worker(worker_info['worker_id'])
+            except (OSError, AttributeError):
+                # Signal not available
                 pass
         
-        # Clean up worker records
-        for worker_info in active_workers:
-            db.remove_worker(worker_info['worker_id'])
-        
         # Wait a bit for graceful shutdown
         time.sleep(2)
+        
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
 
@@ -8,7 +8,16 @@ import time
 import os
 import sys
 import json
+import csv
+import io
+import shutil
+import signal
+import socket
 import sqlite3
+import tempfile
+import threading
+import urllib.request
+from datetime import datetime, timedelta
 from pathlib import Path
 
 
@@ -29,9 +38,16 @@ def run_command(cmd, check=True):
 
 def cleanup():
     """Clean up test database"""
-    db_file = Path("queuectl.db")
-    if db_file.exists():
-        db_file.unlink()
+    # WAL mode keeps -wal and -shm files next to the database
+    for name in ("queuectl.db", "queuectl.db-wal", "queuectl.db-shm"):
+        db_file = Path(name)
+        if db_file.exists():
+            db_file.unlink()
+    # Spilled job output
+    shutil.rmtree("queuectl-logs", ignore_errors=True)
+    shutil.rmtree("queuectl-profile", ignore_errors=True)
+    # Written by test_priority_and_queues
+    Path("order.txt").unlink(missing_ok=True)
     print("✓ Cleaned up test database")
 
 
@@ -50,9 +66,47 @@ def test_basic_enqueue():
         return False
 
 
+def test_bulk_enqueue():
+    """Test 2: Bulk enqueue from an NDJSON file"""
+    print("\n=== Test 2: Bulk Enqueue ===")
+    
+    jobs_file = Path("bulk_jobs.ndjson")
+    with open(jobs_file, "w") as f:
+        for i in range(50):
+            f.write(json.dumps({"id": f"test-bulk-{i}", "command": "true"}) + "\n")
+        f.write("not json\n")
+        f.write(json.dumps({"id": "test-bulk-0", "command": "true"}) + "\n")
+        f.write(json.dumps({"id": "test-bulk-argv", "command": ["ls", "-l"]}) + "\n")
+        # Rejected the same way as a single enqueue
+        for i, priority in enumerate(["7", 2.9, True]):
+            f.write(json.dumps({"id": f"test-bulk-priority-{i}", "command": "true",
+                                "priority": priority}) + "\n")
+    
+    stdout, stderr, code = run_command(
+        f"python -m queuectl.cli enqueue --file {jobs_file} --batch-size 20", check=False
+    )
+    jobs_file.unlink()
+    
+    single_codes = []
+    for i, priority in enumerate(["7", 2.9, True]):
+        job_data = json.dumps({"id": f"test-single-priority-{i}", "command": "true", "priority": priority})
+        _, _, single_code = run_command(f"python -m queuectl.cli enqueue '{job_data}'", check=False)
+        single_codes.append(single_code)
+    
+    output = stdout + stderr
+    if "Enqueued 50 job(s) (1 duplicates, 5 errors)" in stdout and code != 0 \
+            and "test-bulk-argv" in output \
+            and output.count("'priority' must be an integer") == 3 and single_codes == [1, 1, 1]:
+        print("✓ Bulk enqueue loaded valid jobs and reported rejects")
+        return True
+    else:
+        print(f"✗ Failed: {stdout} {stderr}")
+        return False
+
+
 def test_job_completion():
-    """Test 2: Job completes successfully"""
-    print("\n=== Test 2: Job Completion ===")
+    """Test 3: Job completes successfully"""
+    print("\n=== Test 3: Job Completion ===")
     
     # Enqueue a simple job
     job_data = json.dumps({"id": "test-job-2", "command": "echo 'Success'"})
@@ -83,9 +137,119 @@ def test_job_completion():
         return False
 
 
+def test_job_logs():
+    """Test 4: Large output spills to a log file"""
+    print("\n=== Test 4: Job Logs ===")
+    
+    # Far more output than the tail kept in the database
+    job_data = json.dumps({"id": "test-job-logs", "command": "seq 1 20000"})
+    run_command(f"python -m queuectl.cli enqueue '{job_data}'")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(3)
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    stdout, stderr, code = run_command("python -m queuectl.cli logs test-job-logs")
+    lines = stdout.split()
+    
+    conn = sqlite3.connect("queuectl.db")
+    tail = conn.execute("SELECT output_tail FROM jobs WHERE id = 'test-job-logs'").fetchone()[0]
+    conn.close()
+    
+    if code == 0 and len(lines) == 20000 and lines[-1] == "20000" and tail and len(tail) <= 4096:
+        print("✓ Full output in log file, bounded tail in database")
+        return True
+    else:
+        print(f"✗ Failed: {len(lines)} line(s) of output: {stderr}")
+        return False
+
+
+def test_job_limits():
+    """Test 5: Per-job timeout kills the process group and usage is recorded"""
+    print("\n=== Test 5: Job Limits ===")
+    
+    # The background sleep would outlive a plain kill of the shell
+    jobs = [
+        {"id": "test-job-timeout", "command": "sleep 30 & sleep 30", "timeout": "1s",
+         "max_retries": 1},
+        {"id": "test-job-usage", "command": "echo done", "max_memory": "256M", "nice": 5},
+    ]
+    for job in jobs:
+        run_command(f"python -m queuectl.cli enqueue '{json.dumps(job)}'")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1", "--concurrency", "2"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(4)
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    conn = sqlite3.connect("queuectl.db")
+    timed_out = conn.execute(
+        "SELECT state, error_message FROM jobs WHERE id = 'test-job-timeout'"
+    ).fetchone()
+    usage = conn.execute(
+        "SELECT state, peak_rss, cpu_time FROM jobs WHERE id = 'test-job-usage'"
+    ).fetchone()
+    conn.close()
+    
+    if (timed_out[0] == "dead" and "timed out" in timed_out[1]
+            and usage[0] == "completed" and usage[1] and usage[2] is not None):
+        print("✓ Timed-out job killed, peak RSS and CPU time recorded")
+        return True
+    else:
+        print(f"✗ Failed: {timed_out} {usage}")
+        return False
+
+
+def test_limits_unsupported():
+    """Test 6: Without rlimits a limited job still runs, with its timeout only"""
+    print("\n=== Test 6: Limits Without rlimits ===")
+    
+    # A running worker would run the job before this test claims it
+    run_command("python -m queuectl.cli worker stop")
+    
+    job = {"id": "test-job-nolimits", "command": "echo ran", "max_memory": "256M",
+           "cpu_seconds": 10, "nice": 5, "queue": "nolimits"}
+    run_command(f"python -m queuectl.cli enqueue '{json.dumps(job)}'")
+    
+    import queuectl.limits
+    from queuectl.queue import JobQueue
+    # As on Windows, where the resource module does not exist
+    saved = queuectl.limits.resource
+    queuectl.limits.resource = None
+    queue = JobQueue()
+    try:
+        # Popen rejects any preexec_fn on Windows, so none may be built
+        setup = queuectl.limits.child_setup(1 << 28, 10, 5)
+        claimed = queue.get_next_jobs("test-worker-nolimits", 1, ["nolimits"])
+        ran = bool(claimed) and queue.execute_job(claimed[0])
+    finally:
+        queuectl.limits.resource = saved
+        queue.db.close()
+    
+    conn = sqlite3.connect("queuectl.db")
+    state = conn.execute("SELECT state FROM jobs WHERE id = 'test-job-nolimits'").fetchone()
+    conn.close()
+    
+    if setup is None and ran and state == ("completed",):
+        print("✓ Limited job ran without rlimits")
+        return True
+    else:
+        print(f"✗ Failed: preexec_fn={setup} ran={ran} state={state}")
+        return False
+
+
 def test_failed_job_retry():
-    """Test 3: Failed job retries with backoff"""
-    print("\n=== Test 3: Failed Job Retry ===")
+    """Test 7: Failed job retries with backoff"""
+    print("\n=== Test 7: Failed Job Retry ===")
     
     # Enqueue a job that will fail
     job_data = json.dumps({
@@ -120,9 +284,55 @@ def test_failed_job_retry():
         return False
 
 
+def test_retry_without_writes():
+    """Test 8: Idle polls wait for a retry in memory, then promote and claim it"""
+    print("\n=== Test 8: Retry Promotion ===")
+    from queuectl.database import LOCK_WAIT
+    from queuectl.metrics import REGISTRY
+    from queuectl.queue import JobQueue
+    
+    def transactions():
+        # BEGIN IMMEDIATE transactions this process has opened
+        state = REGISTRY.snapshot()[LOCK_WAIT.name]["values"].get((), [[0], 0.0])
+        return sum(state[0])
+    
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "queuectl.db")
+    queue = JobQueue(db_path)
+    queue.db.set_config("backoff_base", "2")
+    queue.enqueue("test-job-backoff", "exit 1", max_retries=3)
+    # Fails once and is scheduled to retry in 2 ** 1 seconds
+    queue.execute_job(queue.get_next_jobs("test-worker-backoff", 1)[0])
+    
+    # data_version moves whenever another connection commits
+    observer = sqlite3.connect(db_path)
+    before = observer.execute("PRAGMA data_version").fetchone()[0]
+    opened = transactions()
+    early = []
+    while queue.next_retry_delay() > 0.3:
+        early.extend(queue.get_next_jobs("test-worker-backoff", 1))
+        time.sleep(0.05)
+    writes = observer.execute("PRAGMA data_version").fetchone()[0] - before
+    opened = transactions() - opened
+    
+    time.sleep(queue.next_retry_delay() + 0.05)
+    claimed = queue.get_next_jobs("test-worker-backoff", 1)
+    observer.close()
+    queue.db.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    
+    if not early and writes == 0 and opened == 0 and [job['id'] for job in claimed] == ["test-job-backoff"] \
+            and claimed[0]['attempts'] == 1:
+        print("✓ Polls before the retry was due wrote nothing; it was claimed once due")
+        return True
+    else:
+        print(f"✗ Failed: early={early} writes={writes} transactions={opened} claimed={claimed}")
+        return False
+
+
 def test_multiple_workers():
-    """Test 4: Multiple workers process jobs without overlap"""
-    print("\n=== Test 4: Multiple Workers ===")
+    """Test 9: Multiple workers process jobs without overlap"""
+    print("\n=== Test 9: Multiple Workers ===")
     
     # Enqueue multiple jobs
     for i in range(5):
@@ -161,9 +371,196 @@ def test_multiple_workers():
         return False
 
 
+def test_no_duplicate_processing():
+    """Test 10: Concurrent workers never run the same job twice"""
+    print("\n=== Test 10: No Duplicate Processing ===")
+    
+    output_file = Path("claims.txt")
+    if output_file.exists():
+        output_file.unlink()
+    
+    for i in range(10):
+        job_data = json.dumps({
+            "id": f"test-job-claim-{i}",
+            "command": f"echo claim-{i} >> {output_file}"
+        })
+        run_command(f"python -m queuectl.cli enqueue '{job_data}'")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "3"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(5)
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    lines = output_file.read_text().split() if output_file.exists() else []
+    if output_file.exists():
+        output_file.unlink()
+    
+    conn = sqlite3.connect("queuectl.db")
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM jobs WHERE id LIKE 'test-job-claim-%' AND worker_id IS NOT NULL")
+    claimed = cursor.fetchone()[0]
+    conn.close()
+    
+    if len(lines) == 10 and len(set(lines)) == 10 and claimed == 10:
+        print("✓ Each job ran exactly once and recorded its worker")
+        return True
+    else:
+        print(f"✗ Failed: {len(lines)} runs, {len(set(lines))} distinct, {claimed} claimed")
+        return False
+
+
+def test_worker_concurrency():
+    """Test 11: One worker runs several jobs in parallel"""
+    print("\n=== Test 11: Worker Concurrency ===")
+    
+    for i in range(6):
+        job_data = json.dumps({"id": f"test-job-conc-{i}", "command": "sleep 2"})
+        run_command(f"python -m queuectl.cli enqueue '{job_data}'")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1", "--concurrency", "6"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    # Run serially these jobs would take 12 seconds
+    time.sleep(5)
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    conn = sqlite3.connect("queuectl.db")
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM jobs WHERE id LIKE 'test-job-conc-%' AND state = 'completed'")
+    completed = cursor.fetchone()[0]
+    conn.close()
+    
+    if completed == 6:
+        print("✓ Worker ran jobs concurrently")
+        return True
+    else:
+        print(f"✗ Failed: only {completed} of 6 jobs completed")
+        return False
+
+
+def test_prefetch_release():
+    """Test 12: A stopping worker hands its prefetched jobs back to pending"""
+    print("\n=== Test 12: Prefetch Release ===")
+    
+    # Workers orphaned by earlier tests would claim the jobs too
+    run_command("python -m queuectl.cli worker stop")
+    
+    ndjson = "".join(
+        json.dumps({"id": f"test-prefetch-{i}", "command": "sleep 3", "queue": "prefetch"}) + "\n"
+        for i in range(5)
+    )
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=ndjson, capture_output=True, text=True)
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1",
+         "--prefetch", "5", "--queues", "prefetch"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    
+    def states():
+        conn = sqlite3.connect("queuectl.db")
+        rows = conn.execute("""
+            SELECT id, state, worker_id IS NOT NULL FROM jobs
+            WHERE id LIKE 'test-prefetch-%' ORDER BY id
+        """).fetchall()
+        conn.close()
+        return rows
+    
+    # One job runs while the other four wait in the worker's buffer
+    claimed = []
+    for _ in range(50):
+        claimed = states()
+        if all(state == "processing" and held for _, state, held in claimed):
+            break
+        time.sleep(0.2)
+    
+    run_command("python -m queuectl.cli worker stop")
+    released = []
+    for _ in range(50):
+        released = states()
+        if not any(state == "processing" for _, state, _ in released):
+            break
+        time.sleep(0.2)
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    conn = sqlite3.connect("queuectl.db")
+    conn.execute("DELETE FROM jobs WHERE id LIKE 'test-prefetch-%'")
+    conn.commit()
+    conn.close()
+    
+    expected = [("test-prefetch-0", "completed", 1)] + [
+        (f"test-prefetch-{i}", "pending", 0) for i in range(1, 5)
+    ]
+    if len(claimed) == 5 and all(state == "processing" for _, state, _ in claimed) and released == expected:
+        print("✓ Worker prefetched jobs and released the unstarted ones on stop")
+        return True
+    else:
+        print(f"✗ Failed: claimed {claimed}, after stop {released}")
+        return False
+
+
+def test_priority_and_queues():
+    """Test 13: Higher priority runs first and workers only serve their queues"""
+    print("\n=== Test 13: Priorities and Queues ===")
+    
+    output_file = Path("order.txt")
+    if output_file.exists():
+        output_file.unlink()
+    
+    # Workers left over from earlier tests serve every queue
+    run_command("python -m queuectl.cli worker stop")
+    
+    jobs = [
+        {"id": "test-prio-low-1", "command": f"echo low-1 >> {output_file}"},
+        {"id": "test-prio-low-2", "command": f"echo low-2 >> {output_file}"},
+        {"id": "test-prio-high", "command": f"echo high >> {output_file}", "priority": 10},
+        {"id": "test-prio-other", "command": f"echo other >> {output_file}", "queue": "other"},
+    ]
+    for job in jobs:
+        run_command(f"python -m queuectl.cli enqueue --queue prio '{json.dumps(job)}'")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1", "--queues", "prio"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(3)
+    run_command("python -m queuectl.cli worker stop")
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    lines = output_file.read_text().split() if output_file.exists() else []
+    if output_file.exists():
+        output_file.unlink()
+    
+    # The job on the other queue must not run in a later test either
+    conn = sqlite3.connect("queuectl.db")
+    other = conn.execute("SELECT state FROM jobs WHERE id = 'test-prio-other'").fetchone()
+    conn.execute("DELETE FROM jobs WHERE id = 'test-prio-other'")
+    conn.commit()
+    conn.close()
+    
+    if lines == ["high", "low-1", "low-2"] and other == ("pending",):
+        print("✓ Jobs ran by priority and other queues were left alone")
+        return True
+    else:
+        print(f"✗ Failed: execution order {lines}")
+        return False
+
+
 def test_persistence():
-    """Test 5: Job data persists across restarts"""
-    print("\n=== Test 5: Data Persistence ===")
+    """Test 14: Job data persists across restarts"""
+    print("\n=== Test 14: Data Persistence ===")
     
     # Enqueue a job
     job_data = json.dumps({"id": "test-job-5", "command": "echo 'Persist'"})
@@ -184,9 +581,158 @@ def test_persistence():
         return False
 
 
+def test_schema_upgrade():
+    """Test 15: A database from the first release upgrades without losing jobs"""
+    print("\n=== Test 15: Schema Upgrade ===")
+    
+    workdir = tempfile.mkdtemp()
+    conn = sqlite3.connect(os.path.join(workdir, "queuectl.db"))
+    # The schema as the first release created it, with user_version 0
+    conn.executescript("""
+        CREATE TABLE jobs (
+            id TEXT PRIMARY KEY,
+            command TEXT NOT NULL,
+            state TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            max_retries INTEGER DEFAULT 3,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL,
+            completed_at TEXT,
+            error_message TEXT,
+            next_retry_at TEXT
+        );
+        CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE workers (
+            worker_id TEXT PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            started_at TEXT NOT NULL,
+            last_heartbeat TEXT NOT NULL
+        );
+        INSERT INTO config (key, value) VALUES ('max_retries', '5'), ('backoff_base', '2');
+    """)
+    old_jobs = [
+        ("old-pending", "echo a", "pending", 0, None),
+        ("old-completed", "echo b", "completed", 1, None),
+        ("old-failed", "exit 1", "failed", 1, "exit code 1"),
+        ("old-dead", "exit 2", "dead", 3, "exit code 2"),
+    ]
+    conn.executemany("""
+        INSERT INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at, error_message)
+        VALUES (?, ?, ?, ?, 3, '2020-01-01T00:00:00Z', '2020-01-01T00:00:00Z', ?)
+    """, old_jobs)
+    conn.commit()
+    conn.close()
+    
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    
+    def cli(*args):
+        return subprocess.run(["python", "-m", "queuectl.cli", *args], cwd=workdir, env=env,
+                              capture_output=True, text=True)
+    
+    status = cli("status", "--format", "json")
+    reconcile = cli("reconcile")
+    
+    conn = sqlite3.connect(os.path.join(workdir, "queuectl.db"))
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    jobs = conn.execute("""
+        SELECT id, command, state, attempts, error_message FROM jobs ORDER BY rowid
+    """).fetchall()
+    queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE queued_at = created_at").fetchone()[0]
+    max_retries = conn.execute("SELECT value FROM config WHERE key = 'max_retries'").fetchone()[0]
+    conn.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    
+    from queuectl.database import SCHEMA_VERSION
+    counts = json.loads(status.stdout)["jobs"] if status.returncode == 0 else None
+    if (version == SCHEMA_VERSION and jobs == old_jobs
+            and counts == {"pending": 1, "completed": 1, "failed": 1, "dead": 1}
+            and "in sync" in reconcile.stdout and queued == 4 and max_retries == "5"):
+        print(f"✓ Upgraded a first-release database to schema {version} with its jobs and counters")
+        return True
+    else:
+        print(f"✗ Failed: version {version}, jobs {jobs}, counts {counts}, "
+              f"{status.stderr} {reconcile.stdout} {reconcile.stderr}")
+        return False
+
+
+def test_wakeup():
+    """Test 16: Enqueue wakes an idle worker instead of waiting for its next poll"""
+    print("\n=== Test 16: Idle Worker Wakeup ===")
+    from queuectl.notify import WakeupListener, private_dir
+    from queuectl.worker import IDLE_WAIT_MAX
+    
+    run_command("python -m queuectl.cli worker stop")
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1", "--queues", "wakeup"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    # Long enough for the idle backoff to reach IDLE_WAIT_MAX between polls
+    time.sleep(8)
+    job = {"id": "test-job-wakeup", "command": "true", "queue": "wakeup"}
+    run_command(f"python -m queuectl.cli enqueue '{json.dumps(job)}'")
+    enqueued = time.monotonic()
+    latency = None
+    while latency is None and time.monotonic() - enqueued < IDLE_WAIT_MAX + 1:
+        time.sleep(0.1)
+        conn = sqlite3.connect("queuectl.db")
+        row = conn.execute("""
+            SELECT (julianday(claimed_at) - julianday(created_at)) * 86400 FROM jobs
+            WHERE id = 'test-job-wakeup' AND claimed_at IS NOT NULL
+        """).fetchone()
+        conn.close()
+        if row:
+            latency = row[0]
+    run_command("python -m queuectl.cli worker stop")
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    # A listener is woken by an enqueue from another process, not by its timeout
+    listener = WakeupListener("queuectl.db", "test-listener")
+    woken = []
+    waiter = threading.Thread(target=lambda: woken.append((listener.wait(30), time.monotonic())))
+    waiter.start()
+    job = {"id": "test-job-wakeup-2", "command": "true", "queue": "wakeup"}
+    started = time.monotonic()
+    run_command(f"python -m queuectl.cli enqueue '{json.dumps(job)}'")
+    waiter.join(timeout=35)
+    listener.close()
+    woken = [(flag, at - started) for flag, at in woken]
+    conn = sqlite3.connect("queuectl.db")
+    conn.execute("DELETE FROM jobs WHERE id LIKE 'test-job-wakeup%'")
+    conn.commit()
+    conn.close()
+    
+    # Sockets are only used from a directory private to this user
+    directory = tempfile.mkdtemp()
+    private = private_dir(directory)
+    os.chmod(directory, 0o755)
+    shared = private_dir(directory)
+    os.chmod(directory, 0o700)
+    link = directory + "-link"
+    os.symlink(directory, link)
+    linked = private_dir(link)
+    os.unlink(link)
+    foreign = False
+    if os.getuid() == 0:
+        # Only root can hand the directory to another user
+        os.chown(directory, 12345, -1)
+        foreign = private_dir(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    
+    if (latency is not None and latency < 1.0 and woken and woken[0][0] and woken[0][1] < 5
+            and private and not shared and not linked and not foreign):
+        print(f"✓ Idle worker claimed a new job after {latency:.2f}s; unsafe socket dirs refused")
+        return True
+    else:
+        print(f"✗ Failed: latency={latency} woken={woken} private={private} shared={shared} "
+              f"linked={linked} foreign={foreign}")
+        return False
+
+
 def test_dlq_retry():
-    """Test 6: Retry job from DLQ"""
-    print("\n=== Test 6: DLQ Retry ===")
+    """Test 17: Retry job from DLQ"""
+    print("\n=== Test 17: DLQ Retry ===")
     
     # First, create a job in DLQ (by enqueueing and letting it fail)
     job_data = json.dumps({
@@ -217,9 +763,717 @@ def test_dlq_retry():
         return False
 
 
+def test_job_stats():
+    """Test 18: Attempt timings feed the latency report"""
+    print("\n=== Test 18: Job Stats ===")
+    
+    stdout, stderr, code = run_command("python -m queuectl.cli stats --window 1h --format json")
+    try:
+        result = json.loads(stdout)
+    except json.JSONDecodeError:
+        print(f"✗ Failed: {stdout} {stderr}")
+        return False
+    
+    run_time = result['run_time']
+    if (code == 0 and result['outcomes'].get('completed') and result['outcomes'].get('dead')
+            and run_time['p50'] is not None and run_time['p50'] <= run_time['p99'] <= run_time['max']):
+        print(f"✓ {result['attempts']} attempts timed, p50 run time {run_time['p50']:.3f}s")
+        return True
+    else:
+        print(f"✗ Failed: {result}")
+        return False
+
+
+def test_list_paging():
+    """Test 19: list pages through ties, filters by time and streams json/csv"""
+    print("\n=== Test 19: List Paging ===")
+    
+    # A running worker would complete the jobs while they are listed
+    run_command("python -m queuectl.cli worker stop")
+    
+    ndjson = "".join(json.dumps({"id": f"test-list-{i}", "command": "true"}) + "\n" for i in range(5))
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=ndjson, capture_output=True, text=True)
+    # Three jobs share a created_at, so pages must break ties on rowid
+    created = ["2001-01-01T00:00:00.000000Z"] * 3 + ["2001-01-02T00:00:00.000000Z",
+                                                      "2001-01-03T00:00:00.000000Z"]
+    conn = sqlite3.connect("queuectl.db")
+    conn.executemany("UPDATE jobs SET created_at = ? WHERE id = ?",
+                     [(created_at, f"test-list-{i}") for i, created_at in enumerate(created)])
+    conn.commit()
+    conn.close()
+    
+    window = "--since 2001-01-01 --until 2001-01-03"
+    pages = []
+    after = ""
+    while len(pages) < 5:
+        stdout, stderr, code = run_command(
+            f"python -m queuectl.cli list {window} --limit 2 --format json {after}", check=False
+        )
+        page = [json.loads(line)["id"] for line in stdout.splitlines()]
+        if code != 0 or not page:
+            break
+        pages.append(page)
+        after = f"--after {page[-1]}"
+    
+    stdout, stderr, code = run_command(
+        "python -m queuectl.cli list --since '2001-01-03 00:00:00' --until 2001-01-04 --format csv",
+        check=False
+    )
+    rows = [row for row in csv.DictReader(io.StringIO(stdout))]
+    
+    # Tables are paged even without --limit, dlq list included
+    ndjson = "".join(json.dumps({"id": f"test-list-pad-{i}", "command": "true"}) + "\n"
+                     for i in range(101))
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=ndjson, capture_output=True, text=True)
+    conn = sqlite3.connect("queuectl.db")
+    conn.execute("""
+        UPDATE jobs SET created_at = '2002-01-01T00:00:00.000000Z', state = 'dead'
+        WHERE id LIKE 'test-list-pad-%'
+    """)
+    conn.commit()
+    conn.close()
+    table, _, _ = run_command("python -m queuectl.cli list --since 2002-01-01 --until 2002-01-02")
+    dlq, _, _ = run_command("python -m queuectl.cli dlq list")
+    table_rows = sum(line.startswith("| test-list-pad-") for line in table.splitlines())
+    # Less the header row
+    dlq_rows = sum(line.startswith("| ") for line in dlq.splitlines()) - 1
+    
+    conn = sqlite3.connect("queuectl.db")
+    conn.execute("DELETE FROM jobs WHERE id LIKE 'test-list-%'")
+    conn.commit()
+    conn.close()
+    
+    expected = [["test-list-3", "test-list-2"], ["test-list-1", "test-list-0"]]
+    if (pages == expected and code == 0 and [row["id"] for row in rows] == ["test-list-4"]
+            and rows[0]["state"] == "pending" and rows[0]["created_at"] == created[4]
+            and table_rows == 100 and "Next page: --after test-list-pad-1\n" in table
+            and dlq_rows == 100 and "Next page: --after" in dlq):
+        print("✓ Paged through tied jobs, filtered by time and parsed json/csv output")
+        return True
+    else:
+        print(f"✗ Failed: pages {pages}, csv {rows}, {table_rows} table rows, "
+              f"{dlq_rows} dlq rows: {stderr}")
+        return False
+
+
+def test_gc():
+    """Test 20: Archive old completed jobs"""
+    print("\n=== Test 20: Garbage Collection ===")
+    
+    conn = sqlite3.connect("queuectl.db")
+    completed = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'completed'").fetchone()[0]
+    conn.close()
+    if not completed:
+        print("✗ Failed: no completed jobs left by earlier tests")
+        return False
+    
+    time.sleep(1)
+    stdout, stderr, code = run_command(
+        "python -m queuectl.cli gc --completed-ttl 1s --archive table --vacuum"
+    )
+    
+    conn = sqlite3.connect("queuectl.db")
+    remaining = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'completed'").fetchone()[0]
+    archived = conn.execute("SELECT COUNT(*) FROM jobs_archive WHERE state = 'completed'").fetchone()[0]
+    # The DLQ cap keeps the jobs dead-lettered last, however old they are
+    now = datetime.utcnow()
+    conn.executemany("""
+        INSERT INTO jobs (id, command, state, attempts, max_retries, created_at, updated_at, completed_at)
+        VALUES (?, 'false', 'dead', 3, 3, ?, ?, ?)
+    """, [
+        ("test-dlq-old", "2000-01-01T00:00:00Z", now.isoformat() + "Z", now.isoformat() + "Z"),
+        ("test-dlq-new", now.isoformat() + "Z", now.isoformat() + "Z",
+         (now - timedelta(seconds=1)).isoformat() + "Z"),
+    ])
+    # create_jobs counts inserts, not a trigger
+    conn.execute("INSERT OR IGNORE INTO job_counts (state, count) VALUES ('dead', 0)")
+    conn.execute("UPDATE job_counts SET count = count + 2 WHERE state = 'dead'")
+    conn.commit()
+    conn.close()
+    
+    _, dlq_stderr, dlq_code = run_command("python -m queuectl.cli gc --dlq-max 1")
+    conn = sqlite3.connect("queuectl.db")
+    dead = [row[0] for row in conn.execute("SELECT id FROM jobs WHERE state = 'dead'")]
+    conn.close()
+    
+    if code == 0 and remaining == 0 and archived == completed and dlq_code == 0 and dead == ["test-dlq-old"]:
+        print(f"✓ Archived {archived} completed job(s); DLQ cap kept the last dead-lettered job")
+        return True
+    else:
+        print(f"✗ Failed: {remaining} left, {archived} archived of {completed}, DLQ {dead}: "
+              f"{stdout} {stderr} {dlq_stderr}")
+        return False
+
+
+def test_job_counters():
+    """Test 21: Status counters match the jobs table"""
+    print("\n=== Test 21: Job Counters ===")
+    
+    # After every test above has moved jobs around, nothing should need fixing
+    stdout, stderr, code = run_command("python -m queuectl.cli reconcile")
+    
+    if code == 0 and "in sync" in stdout:
+        print("✓ Job counters match the jobs table")
+        return True
+    else:
+        print(f"✗ Failed: {stdout} {stderr}")
+        return False
+
+
+def test_metrics_endpoint():
+    """Test 22: OpenMetrics exporter answers a plain HTTP client"""
+    print("\n=== Test 22: Metrics Endpoint ===")
+    
+    # Let the OS pick a free port
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    
+    server = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "metrics", "serve", "--port", str(port)],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    body = ""
+    try:
+        for _ in range(20):
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=2) as response:
+                    body = response.read().decode()
+                break
+            except OSError:
+                time.sleep(0.25)
+    finally:
+        server.terminate()
+        server.wait(timeout=5)
+    
+    if 'queuectl_jobs{state="pending"}' in body and body.endswith("# EOF\n"):
+        print("✓ Metrics served in OpenMetrics format")
+        return True
+    else:
+        print(f"✗ Failed: {body!r}")
+        return False
+
+
+def test_worker_profile():
+    """Test 23: --profile leaves cProfile stats and Database timings per worker"""
+    print("\n=== Test 23: Worker Profiling ===")
+    
+    profile_dir = Path("queuectl-profile")
+    shutil.rmtree(profile_dir, ignore_errors=True)
+    run_command("python -m queuectl.cli worker stop")
+    
+    job_data = json.dumps({"id": "test-job-profile", "command": "true"})
+    run_command(f"python -m queuectl.cli enqueue '{job_data}'")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1",
+         "--profile", str(profile_dir), "--slow-query-ms", "0"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(3)
+    # Workers write their profiles as they shut down
+    run_command("python -m queuectl.cli worker stop")
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    stats = sorted(profile_dir.glob("*.prof"))
+    reports = sorted(profile_dir.glob("*-db.json"))
+    slow_logs = sorted(profile_dir.glob("*-slow.log"))
+    if not (stats and reports and slow_logs):
+        print(f"✗ Failed: found {[path.name for path in profile_dir.glob('*')]}")
+        return False
+    
+    import pstats
+    pstats.Stats(str(stats[0]))
+    report = json.loads(reports[0].read_text())
+    methods = {entry['method'] for entry in report['methods']}
+    
+    if "claim_jobs" in methods and report['statements'] and "slow statement" in slow_logs[0].read_text():
+        print(f"✓ Profiled {len(methods)} Database methods, {len(report['statements'])} statements")
+        return True
+    else:
+        print(f"✗ Failed: {report}")
+        return False
+
+
+def test_serve():
+    """Test 24: enqueue and status go through `queuectl serve` while it runs"""
+    print("\n=== Test 24: Enqueue Server ===")
+    from queuectl.notify import server_address
+    from queuectl.server import Client
+    
+    server = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "serve"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    try:
+        path = server_address("queuectl.db")
+        for _ in range(20):
+            if os.path.exists(path):
+                break
+            time.sleep(0.25)
+        listening = os.path.exists(path)
+        
+        job_data = json.dumps({"id": "test-job-serve", "command": "echo served", "priority": 3})
+        single, _, _ = run_command(f"python -m queuectl.cli enqueue '{job_data}'")
+        _, duplicate, code = run_command(f"python -m queuectl.cli enqueue '{job_data}'", check=False)
+        
+        lines = "".join(json.dumps({"id": f"test-job-serve-{i}", "command": "true"}) + "\n"
+                        for i in range(500))
+        bulk = subprocess.run(
+            ["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+            input=lines, capture_output=True, text=True
+        )
+        stdout, _, _ = run_command("python -m queuectl.cli status --format json")
+        status = json.loads(stdout)
+        
+        # Pipelined, so they share a group commit; the middle one overflows SQLite INTEGER
+        with Client.connect("queuectl.db") as client:
+            for i, priority in enumerate((0, 10 ** 30, 0)):
+                client.send({"op": "enqueue", "jobs": [
+                    {"id": f"test-job-serve-group-{i}", "command": "true", "priority": priority}
+                ]})
+            group = [client.receive() for _ in range(3)]
+    finally:
+        server.terminate()
+        server.wait(timeout=5)
+    
+    # Jobs committed by the server are in the database once it has stopped
+    stdout, _, _ = run_command("python -m queuectl.cli list --format json --state pending")
+    ids = {json.loads(line)['id'] for line in stdout.splitlines()}
+    
+    # A socket directory others can enter is neither served from nor connected to
+    directory = os.path.dirname(path)
+    os.chmod(directory, 0o755)
+    try:
+        _, refused, refused_code = run_command("python -m queuectl.cli serve", check=False)
+        untrusted_client = Client.connect("queuectl.db")
+    finally:
+        os.chmod(directory, 0o700)
+    
+    # A server that hangs up without replying leaves status to the database
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as dying:
+        dying.bind(path)
+        dying.listen(1)
+        hang_up = threading.Thread(target=lambda: dying.accept()[0].close())
+        hang_up.start()
+        fallback, fallback_warning, fallback_code = run_command(
+            "python -m queuectl.cli status --format json", check=False
+        )
+        hang_up.join(timeout=5)
+    os.unlink(path)
+    
+    if (listening and "Priority: 3" in single
+            and code != 0 and "already exists" in duplicate
+            and "Enqueued 500 job(s)" in bulk.stdout
+            and status['jobs'].get('pending', 0) >= 501
+            and {"test-job-serve", "test-job-serve-499"} <= ids
+            and [reply['ok'] for reply in group] == [True, False, True]
+            and {"test-job-serve-group-0", "test-job-serve-group-2"} <= ids
+            and refused_code != 0 and "not private" in refused and untrusted_client is None
+            and fallback_code == 0 and "reading the database" in fallback_warning
+            and json.loads(fallback)['jobs'].get('pending', 0) >= 503 and not os.path.exists(path)):
+        print("✓ Server enqueued 501 jobs and removed its socket on stop")
+        return True
+    else:
+        print(f"✗ Failed: {single!r} {duplicate!r} {bulk.stdout!r} {status!r} {group!r} {refused!r} "
+              f"{fallback_warning!r}")
+        return False
+
+
+def test_worker_flush():
+    """Test 25: --flush-ms commits batched job results by the time the worker stops"""
+    print("\n=== Test 25: Write-Behind Flush ===")
+    
+    run_command("python -m queuectl.cli worker stop")
+    lines = "".join(json.dumps({"id": f"test-job-flush-{i}", "command": "true"}) + "\n"
+                    for i in range(30))
+    lines += json.dumps({"id": "test-job-flush-dead", "command": "exit 3", "max_retries": 1}) + "\n"
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=lines, capture_output=True, text=True)
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1",
+         "--concurrency", "4", "--flush-ms", "50"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(4)
+    run_command("python -m queuectl.cli worker stop")
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    
+    conn = sqlite3.connect("queuectl.db")
+    states = dict(conn.execute("""
+        SELECT state, COUNT(*) FROM jobs WHERE id LIKE 'test-job-flush-%' GROUP BY state
+    """).fetchall())
+    attempts = conn.execute(
+        "SELECT COUNT(*) FROM job_attempts WHERE job_id LIKE 'test-job-flush-%'"
+    ).fetchone()[0]
+    conn.close()
+    
+    # An update that can never commit (no such column) must not hold back the rest
+    from queuectl.database import Database
+    db = Database("queuectl.db")
+    db.start_write_behind(20)
+    db.update_job("test-job-flush-0", error_message="flushed")
+    db.update_job("test-job-flush-1", no_such_column=1)
+    try:
+        db.stop_write_behind()
+        persistent = None
+    except sqlite3.OperationalError as e:
+        persistent = e
+    db.close()
+    conn = sqlite3.connect("queuectl.db")
+    flushed = conn.execute(
+        "SELECT error_message FROM jobs WHERE id = 'test-job-flush-0'"
+    ).fetchone()[0]
+    conn.close()
+    
+    if states == {"completed": 30, "dead": 1} and attempts == 31 \
+            and persistent is None and flushed == "flushed":
+        print("✓ 31 batched results committed, with their attempts; a broken update was dropped")
+        return True
+    else:
+        print(f"✗ Failed: {states} {attempts} attempts, flushed={flushed!r} error={persistent}")
+        return False
+
+
+def test_heartbeat_interval():
+    """Test 26: Idle workers heartbeat at the configured interval, inside the lease"""
+    print("\n=== Test 26: Heartbeat Interval ===")
+    
+    _, too_long, code = run_command("python -m queuectl.cli config set heartbeat-interval 20", check=False)
+    run_command("python -m queuectl.cli config set heartbeat-interval 1")
+    run_command("python -m queuectl.cli worker stop")
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(1.5)
+    conn = sqlite3.connect("queuectl.db")
+    query = "SELECT worker_id, last_heartbeat FROM workers"
+    first = dict(conn.execute(query).fetchall())
+    time.sleep(2)
+    second = dict(conn.execute(query).fetchall())
+    conn.close()
+    
+    run_command("python -m queuectl.cli worker stop")
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    run_command("python -m queuectl.cli config set heartbeat-interval 5")
+    
+    advanced = [worker for worker in first if second.get(worker, "") > first[worker]]
+    if code != 0 and "at least twice" in too_long and first and len(advanced) == len(first):
+        print("✓ Heartbeats advance every interval; an interval longer than half the lease is refused")
+        return True
+    else:
+        print(f"✗ Failed: {too_long!r} {first} {second}")
+        return False
+
+
+def test_reaper():
+    """Test 27: Jobs of dead workers are reaped; a draining worker keeps its lease"""
+    print("\n=== Test 27: Lease Reaper ===")
+    from queuectl.database import Database
+    
+    run_command("python -m queuectl.cli worker stop")
+    lines = "".join(json.dumps({"id": f"test-job-reap-{i}", "command": "true", "max_retries": retries}) + "\n"
+                    for i, retries in enumerate((3, 1)))
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=lines, capture_output=True, text=True)
+    
+    # A worker that crashed a minute ago holding both jobs
+    conn = sqlite3.connect("queuectl.db")
+    conn.execute("""
+        UPDATE jobs SET state = 'processing', worker_id = 'worker-ghost',
+               claimed_at = strftime('%Y-%m-%dT%H:%M:%fZ', 'now', '-60 seconds')
+        WHERE id LIKE 'test-job-reap-%'
+    """)
+    conn.execute("""
+        INSERT INTO workers (worker_id, pid, started_at, last_heartbeat)
+        VALUES ('worker-ghost', 0, '2000-01-01T00:00:00Z', '2000-01-01T00:00:00Z')
+    """)
+    conn.commit()
+    reaped, _, _ = run_command("python -m queuectl.cli reap --lease-timeout 10")
+    states = dict(conn.execute("""
+        SELECT id, state || '/' || attempts || '/' || COALESCE(worker_id, '-') FROM jobs
+        WHERE id LIKE 'test-job-reap-%'
+    """).fetchall())
+    ghost = conn.execute("SELECT COUNT(*) FROM workers WHERE worker_id = 'worker-ghost'").fetchone()[0]
+    
+    # A job the reaper has taken back cannot be completed by its old owner
+    db = Database("queuectl.db")
+    db.update_job("test-job-reap-0", owner="worker-ghost", state="completed")
+    lost_lease = db.get_job("test-job-reap-0")['state']
+    db.close()
+    conn.execute("DELETE FROM jobs WHERE id LIKE 'test-job-reap-%'")
+    conn.commit()
+    
+    # SIGTERM a worker in the middle of a job that outlives the lease
+    run_command("python -m queuectl.cli config set heartbeat-interval 1")
+    run_command("python -m queuectl.cli config set lease-timeout 2")
+    runs = Path(tempfile.mkdtemp()) / "runs.txt"
+    job = {"id": "test-job-reap-drain", "command": f"echo start >> {runs}; sleep 5; echo end >> {runs}"}
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=json.dumps(job) + "\n", capture_output=True, text=True)
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--count", "1"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(1.5)
+    pid = conn.execute("SELECT pid FROM workers").fetchone()[0]
+    os.kill(pid, signal.SIGTERM)
+    requeued = 0
+    rows_while_draining = []
+    for _ in range(5):
+        time.sleep(1)
+        out, _, _ = run_command("python -m queuectl.cli reap")
+        requeued += int(out.split()[1])
+        if "end" not in runs.read_text():
+            rows_while_draining.append(conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0])
+    time.sleep(2)
+    drained = conn.execute(
+        "SELECT state, attempts FROM jobs WHERE id = 'test-job-reap-drain'"
+    ).fetchone()
+    rows_after = conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+    conn.close()
+    
+    worker_process.terminate()
+    worker_process.wait(timeout=5)
+    run_command("python -m queuectl.cli config set lease-timeout 30")
+    run_command("python -m queuectl.cli config set heartbeat-interval 5")
+    ran = runs.read_text() if runs.exists() else ""
+    shutil.rmtree(runs.parent, ignore_errors=True)
+    
+    expected = {"test-job-reap-0": "pending/1/-", "test-job-reap-1": "dead/1/-"}
+    if states == expected and ghost == 0 and "Requeued 1 job(s)" in reaped \
+            and lost_lease == "pending" and ran == "start\nend\n" and requeued == 0 \
+            and drained == ("completed", 0) and rows_while_draining and all(rows_while_draining) \
+            and rows_after == 0:
+        print("✓ Reaped jobs of a dead worker; a stopping worker finished its job exactly once")
+        return True
+    else:
+        print(f"✗ Failed: {states} ghost={ghost} lost_lease={lost_lease} ran={ran!r} "
+              f"requeued={requeued} drained={drained} rows={rows_while_draining} {rows_after}")
+        return False
+
+
+def test_autoscale():
+    """Test 28: An autoscaled pool grows under a backlog and replaces crashed workers"""
+    print("\n=== Test 28: Autoscaling ===")
+    
+    run_command("python -m queuectl.cli worker stop")
+    lines = "".join(json.dumps({"id": f"test-job-scale-{i}", "command": "sleep 2"}) + "\n"
+                    for i in range(20))
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=lines, capture_output=True, text=True)
+    
+    def live_workers():
+        conn = sqlite3.connect("queuectl.db")
+        pids = [row[0] for row in conn.execute("SELECT pid FROM workers").fetchall()]
+        conn.close()
+        alive = []
+        for pid in pids:
+            try:
+                os.kill(pid, 0)
+                alive.append(pid)
+            except OSError:
+                pass
+        return alive
+    
+    worker_process = subprocess.Popen(
+        ["python", "-m", "queuectl.cli", "worker", "start", "--min", "1", "--max", "3",
+         "--target-wait", "1s"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    time.sleep(2)
+    before = live_workers()
+    # Two decisions over the target, SCALE_INTERVAL apart
+    time.sleep(11)
+    scaled = live_workers()
+    
+    killed = scaled[-1] if scaled else None
+    if killed:
+        os.kill(killed, signal.SIGKILL)
+    time.sleep(3)
+    after = live_workers()
+    
+    run_command("python -m queuectl.cli worker stop")
+    worker_process.terminate()
+    _, stderr = worker_process.communicate(timeout=5)
+    conn = sqlite3.connect("queuectl.db")
+    conn.execute("DELETE FROM jobs WHERE id LIKE 'test-job-scale-%'")
+    conn.commit()
+    conn.close()
+    
+    if len(before) == 1 and len(scaled) == 3 and len(after) == 3 and killed not in after \
+            and b"restarting" in stderr:
+        print("✓ Pool grew from 1 to 3 workers, and a killed worker was replaced")
+        return True
+    else:
+        print(f"✗ Failed: {len(before)} -> {len(scaled)} -> {len(after)} workers")
+        print(stderr.decode(errors="replace"))
+        return False
+
+
+def test_autoscale_retire():
+    """Test 29: A worker retired by the autoscaler finishes a job longer than the lease"""
+    print("\n=== Test 29: Autoscaler Retirement ===")
+    from queuectl.worker import WorkerManager
+    
+    run_command("python -m queuectl.cli worker stop")
+    run_command("python -m queuectl.cli config set heartbeat-interval 1")
+    run_command("python -m queuectl.cli config set lease-timeout 2")
+    runs = Path(tempfile.mkdtemp()) / "runs.txt"
+    job = {"id": "test-job-retire", "command": f"echo start >> {runs}; sleep 5; echo end >> {runs}"}
+    subprocess.run(["python", "-m", "queuectl.cli", "enqueue", "--file", "-"],
+                   input=json.dumps(job) + "\n", capture_output=True, text=True)
+    
+    manager = WorkerManager("queuectl.db")
+    manager.start_workers(1)
+    manager.autoscale(0, 1, 60)
+    time.sleep(1.5)
+    # The scale-down step, without waiting out SCALE_DOWN_TICKS quiet decisions
+    manager._retire_worker()
+    requeued = 0
+    for _ in range(8):
+        time.sleep(1)
+        manager.supervise()
+        out, _, _ = run_command("python -m queuectl.cli reap")
+        requeued += int(out.split()[1])
+    
+    conn = sqlite3.connect("queuectl.db")
+    state = conn.execute("SELECT state FROM jobs WHERE id = 'test-job-retire'").fetchone()[0]
+    rows = conn.execute("SELECT COUNT(*) FROM workers").fetchone()[0]
+    conn.close()
+    # Anything left running on failure; the test process would wait for it at exit
+    for p in list(manager.workers.values()) + list(manager.retiring.values()):
+        p.terminate()
+        p.join(timeout=5)
+    run_command("python -m queuectl.cli config set lease-timeout 30")
+    run_command("python -m queuectl.cli config set heartbeat-interval 5")
+    ran = runs.read_text() if runs.exists() else ""
+    shutil.rmtree(runs.parent, ignore_errors=True)
+    
+    if ran == "start\nend\n" and requeued == 0 and state == "completed" and rows == 0 \
+            and not manager.workers and not manager.retiring:
+        print("✓ Retired worker kept its lease, finished the job once and exited")
+        return True
+    else:
+        print(f"✗ Failed: ran={ran!r} requeued={requeued} state={state} rows={rows} "
+              f"workers={list(manager.workers)} retiring={list(manager.retiring)}")
+        return False
+
+
+def test_autoscale_crash_loop():
+    """Test 30: Workers failing on startup back off, then the pool gives up"""
+    print("\n=== Test 30: Autoscaler Crash Loop ===")
+    import queuectl.worker
+    from queuectl.metrics import Registry
+    
+    def crash(*args):
+        os._exit(3)
+    
+    saved = (queuectl.worker.RESTART_BACKOFF_MIN, queuectl.worker.RESTART_BACKOFF_MAX)
+    queuectl.worker.RESTART_BACKOFF_MIN, queuectl.worker.RESTART_BACKOFF_MAX = 0.2, 0.4
+    manager = queuectl.worker.WorkerManager("queuectl.db")
+    # As if the worker failed to open its database or import a module
+    manager._worker_process = crash
+    started = []
+    try:
+        manager.start_workers(1)
+        manager.autoscale(1, 1, 60)
+        # A snapshot the worker might have pushed before dying
+        worker_id = next(iter(manager.workers))
+        registry = Registry()
+        registry.gauge("queuectl_worker_running_jobs", "", ["worker"]).set(1, worker=worker_id)
+        registry.counter("queuectl_jobs_total", "").inc()
+        manager.worker_metrics[worker_id] = registry.snapshot()
+        
+        error = None
+        began = time.monotonic()
+        while time.monotonic() - began < 10:
+            started.extend(wid for wid in manager.workers if wid not in started)
+            try:
+                manager.supervise()
+            except RuntimeError as e:
+                error = e
+                break
+            time.sleep(0.05)
+        took = time.monotonic() - began
+    finally:
+        queuectl.worker.RESTART_BACKOFF_MIN, queuectl.worker.RESTART_BACKOFF_MAX = saved
+        for p in manager.workers.values():
+            p.join(timeout=5)
+    
+    gauges = [name for name in manager.exited_metrics if name == "queuectl_worker_running_jobs"]
+    # Backoffs 0.2 + 0.4 + 0.4 + 0.4 between the five attempts
+    if (error is not None and len(started) == queuectl.worker.MAX_QUICK_CRASHES
+            and took >= 1.4 and not manager.worker_metrics and not gauges
+            and "queuectl_jobs_total" in manager.exited_metrics):
+        print(f"✓ Gave up after {len(started)} quick crashes in {took:.1f}s; dead worker's gauge dropped")
+        return True
+    else:
+        print(f"✗ Failed: error={error} started={len(started)} took={took:.1f}s "
+              f"metrics={list(manager.worker_metrics)} exited={list(manager.exited_metrics)}")
+        return False
+
+
+# Milliseconds `import queuectl.cli` may spend on top of click itself
+IMPORT_BUDGET_MS = 50
+
+# Modules that enqueue/status must not pay for
+LAZY_MODULES = ["tabulate", "queuectl.worker", "multiprocessing", "concurrent.futures",
+                "http.server", "queuectl.profiling", "queuectl.bench",
+                "queuectl.server", "socketserver"]
+
+
+def test_cli_import_budget():
+    """Test 31: The CLI imports only what enqueue and status need"""
+    print("\n=== Test 31: CLI Import Budget ===")
+    
+    # Measure with bytecode in place, as an installed package has it
+    run_command("python -m compileall -q queuectl")
+    
+    best = None
+    imported = []
+    for _ in range(3):
+        result = subprocess.run(
+            ["python", "-X", "importtime", "-c", "import queuectl.cli"],
+            capture_output=True,
+            text=True
+        )
+        # "import time: self [us] | cumulative | module", nested modules indented
+        cumulative = {}
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            if len(parts) == 3 and parts[1].strip().isdigit():
+                cumulative[parts[2].strip()] = int(parts[1])
+        own = (cumulative.get("queuectl.cli", 0) - cumulative.get("click", 0)) / 1000
+        best = own if best is None else min(best, own)
+        imported = [name for name in LAZY_MODULES if name in cumulative]
+    
+    if not imported and best is not None and 0 < best <= IMPORT_BUDGET_MS:
+        print(f"✓ queuectl.cli imports in {best:.1f}ms on top of click")
+        return True
+    else:
+        print(f"✗ Failed: {best}ms (budget {IMPORT_BUDGET_MS}ms), imported eagerly: {imported}")
+        return False
+
+
 def test_config():
-    """Test 7: Configuration management"""
-    print("\n=== Test 7: Configuration ===")
+    """Test 32: Configuration management"""
+    print("\n=== Test 32: Configuration ===")
     
     # Set config
     stdout, stderr, code = run_command("python -m queuectl.cli config set max-retries 5")
@@ -237,6 +1491,90 @@ def test_config():
         return False
 
 
+def test_config_cache():
+    """Test 33: A running queue sees `config set` from another process within a second"""
+    print("\n=== Test 33: Config Cache ===")
+    from queuectl.database import CONFIG_CHECK_INTERVAL
+    from queuectl.queue import JobQueue
+    
+    workdir = tempfile.mkdtemp()
+    queue = JobQueue(os.path.join(workdir, "queuectl.db"))
+    # Fill the cache
+    old = (queue.db.get_config("backoff_base"), queue.db.get_config("max_retries"))
+    
+    env = dict(os.environ, PYTHONPATH=os.getcwd())
+    for key, value in (("backoff-base", "3"), ("max-retries", "7")):
+        subprocess.run(["python", "-m", "queuectl.cli", "config", "set", key, value],
+                       cwd=workdir, env=env, capture_output=True, text=True)
+    set_at = time.monotonic()
+    seen = None
+    while time.monotonic() - set_at < CONFIG_CHECK_INTERVAL + 1:
+        seen = (queue.db.get_config("backoff_base"), queue.db.get_config("max_retries"))
+        if seen == ("3", "7"):
+            break
+        time.sleep(0.05)
+    waited = time.monotonic() - set_at
+    # New jobs pick up the default from the refreshed cache
+    job = queue.enqueue("test-job-config", "true")
+    queue.db.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    
+    if old == ("2", "3") and seen == ("3", "7") and waited <= CONFIG_CHECK_INTERVAL + 0.2 \
+            and job['max_retries'] == 7:
+        print(f"✓ Config change seen after {waited:.2f}s")
+        return True
+    else:
+        print(f"✗ Failed: {old} -> {seen} after {waited:.2f}s, job max_retries {job['max_retries']}")
+        return False
+
+
+def test_bench():
+    """Test 34: `bench --quick` writes JSON results and --compare checks them"""
+    print("\n=== Test 34: Bench ===")
+    
+    workdir = tempfile.mkdtemp()
+    results = os.path.join(workdir, "results.json")
+    stdout, stderr, code = run_command(f"python -m queuectl.cli bench --quick --output {results}", check=False)
+    if code != 0:
+        print(f"✗ Failed: bench exited {code}: {stderr}")
+        shutil.rmtree(workdir, ignore_errors=True)
+        return False
+    
+    with open(results) as f:
+        result = json.load(f)
+    scenarios = {entry['scenario'] for entry in result['results']}
+    
+    # Quick runs are too short to compare within 20%; a loose threshold
+    # still exercises the comparison against the same file
+    compared = os.path.join(workdir, "compared.json")
+    _, _, same_code = run_command(
+        f"python -m queuectl.cli bench --quick --output {compared} --compare {results} --threshold 10",
+        check=False
+    )
+    with open(compared) as f:
+        regressions = json.load(f).get('regressions')
+    
+    # A baseline far faster than anything reachable is a regression
+    with open(os.path.join(workdir, "fast.json"), "w") as f:
+        json.dump({"results": [{"name": "enqueue[batch]", "metrics": {"enqueue_rate": 1e12}}]}, f)
+    _, stderr, slow_code = run_command(
+        f"python -m queuectl.cli bench --quick --scenario enqueue --output /dev/null "
+        f"--compare {os.path.join(workdir, 'fast.json')}",
+        check=False
+    )
+    shutil.rmtree(workdir, ignore_errors=True)
+    
+    if result['meta']['quick'] and scenarios == {"enqueue", "claim", "latency", "growth", "contention"} \
+            and same_code == 0 and regressions == [] \
+            and slow_code == 1 and "Regression: enqueue[batch] enqueue_rate" in stderr:
+        print(f"✓ Bench ran {len(result['results'])} benchmark(s) in {result['meta']['duration']}s")
+        return True
+    else:
+        print(f"✗ Failed: scenarios {sorted(scenarios)}, compare to self exited {same_code} "
+              f"with {regressions}, compare to fast baseline exited {slow_code}")
+        return False
+
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -248,12 +1586,39 @@ def main():
     
     tests = [
         test_basic_enqueue,
+        test_bulk_enqueue,
         test_persistence,
+        test_schema_upgrade,
         test_config,
         test_job_completion,
+        test_job_logs,
+        test_job_limits,
+        test_limits_unsupported,
         test_failed_job_retry,
+        test_retry_without_writes,
         test_multiple_workers,
+        test_no_duplicate_processing,
+        test_worker_concurrency,
+        test_prefetch_release,
+        test_priority_and_queues,
+        test_wakeup,
         test_dlq_retry,
+        test_job_stats,
+        test_list_paging,
+        test_gc,
+        test_job_counters,
+        test_metrics_endpoint,
+        test_worker_profile,
+        test_serve,
+        test_worker_flush,
+        test_heartbeat_interval,
+        test_reaper,
+        test_autoscale,
+        test_autoscale_retire,
+        test_autoscale_crash_loop,
+        test_cli_import_budget,
+        test_config_cache,
+        test_bench,
     ]
     
     results = []